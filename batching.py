@@ -0,0 +1,306 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+def _resolve(future, result):
+    """
+    Completes `future` with `result`. An exception fails it, and a `Future`
+    result (e.g. a pending upload) is chained so `future` completes with it.
+    """
+    if isinstance(result, BaseException):
+        future.set_exception(result)
+    elif isinstance(result, Future):
+        result.add_done_callback(
+            lambda done: future.set_exception(done.exception())
+            if done.exception() is not None
+            else future.set_result(done.result())
+        )
+    else:
+        future.set_result(result)
+
+
+class _Call:
+    """A single call of `fn(**kwargs)`, queued next to the batch items but never batched."""
+
+    def __init__(self, fn, kwargs):
+        self.fn = fn
+        self.kwargs = kwargs
+
+    def run(self):
+        try:
+            return self.fn(**self.kwargs)
+        except Exception as e:
+            return e
+
+
+class MicroBatchScheduler:
+    """
+    Collects concurrently submitted requests into micro-batches.
+
+    A single worker thread waits for the first request, then keeps collecting
+    until either `max_batch_size` requests are queued or `max_wait_ms` has
+    passed since the first one arrived. The whole batch is handed to
+    `batch_fn`, which must return one result (or exception) per item, in order.
+    A result may also be a `Future` for work that finishes off the batch thread.
+    `submit_call` runs a function alone on the same thread, between batches,
+    so every use of the model goes through it.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=4, max_wait_ms=50):
+        assert max_batch_size >= 1, "max_batch_size must be at least 1"
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="vton-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, item) -> Future:
+        if self._stopped.is_set():
+            raise RuntimeError("MicroBatchScheduler has been shut down")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit_call(self, fn, **kwargs) -> Future:
+        """Runs `fn(**kwargs)` alone on the batch thread; its result may be a `Future` too."""
+        return self.submit(_Call(fn, kwargs))
+
+    def shutdown(self, wait=True):
+        self._stopped.set()
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # re-queue the sentinel so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                break
+            calls = [(item, future) for item, future in batch if isinstance(item, _Call)]
+            items = [item for item, _ in batch if not isinstance(item, _Call)]
+            futures = [future for item, future in batch if not isinstance(item, _Call)]
+            if items:
+                try:
+                    results = self.batch_fn(items)
+                except Exception as e:
+                    results = [e] * len(items)
+                for future, result in zip(futures, results):
+                    _resolve(future, result)
+            for call, future in calls:
+                _resolve(future, call.run())
+        self._fail_queued()
+
+    def _fail_queued(self):
+        # Fail whatever was still queued at shutdown
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                entry[1].set_exception(
+                    RuntimeError(f"{type(self).__name__} has been shut down")
+                )
+
+
+class ContinuousBatchingEngine:
+    """
+    Iteration-level batching over `CatVTONPipeline.denoise_step`.
+
+    New requests are admitted into the running batch at every timestep
+    boundary, and each request leaves the batch as soon as its own last step
+    is done, so a request never waits for the rest of someone else's run.
+    Each request keeps its own latents, scheduler instance and generator.
+
+    Everything that runs the models goes through the engine thread: inputs
+    are encoded on admission, results decoded as requests finish, and
+    `submit_call` runs other model work (e.g. encoding with the latent
+    caches) between two steps.
+    """
+
+    def __init__(self, pipeline, max_batch_size=4):
+        assert max_batch_size >= 1, "max_batch_size must be at least 1"
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="vton-continuous-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(
+        self,
+        image,
+        condition_image,
+        mask,
+        num_inference_steps=50,
+        guidance_scale=2.5,
+        height=1024,
+        width=768,
+        generator=None,
+        eta=1.0,
+        condition_latent=None,
+        masked_latent=None,
+        mask_latent=None,
+        guidance_interval=(0.0, 1.0),
+        sampler=None,
+        coarse_scale=None,
+        coarse_until=0.5,
+    ) -> Future:
+        """
+        Queues one request; the returned future resolves to the list of PIL
+        images `CatVTONPipeline.__call__` would return.
+        """
+        if self._stopped.is_set():
+            raise RuntimeError("ContinuousBatchingEngine has been shut down")
+        future = Future()
+        request = dict(
+            image=image,
+            condition_image=condition_image,
+            mask=mask,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            height=height,
+            width=width,
+            generator=generator,
+            eta=eta,
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+            guidance_interval=guidance_interval,
+            sampler=sampler,
+            coarse_scale=coarse_scale,
+            coarse_until=coarse_until,
+        )
+        self._queue.put((request, future))
+        return future
+
+    def submit_call(self, fn, **kwargs) -> Future:
+        """Runs `fn(**kwargs)` on the engine thread at the next step boundary."""
+        if self._stopped.is_set():
+            raise RuntimeError("ContinuousBatchingEngine has been shut down")
+        future = Future()
+        self._queue.put((_Call(fn, kwargs), future))
+        return future
+
+    def shutdown(self, wait=True):
+        self._stopped.set()
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def _admit(self, active):
+        """
+        Moves queued requests into `active` until it is full. Blocks only when
+        nothing is running. Returns False once the engine is shutting down.
+        """
+        while len(active) < self.max_batch_size:
+            try:
+                entry = self._queue.get(block=not active)
+            except queue.Empty:
+                break
+            if entry is None:
+                return False
+            request, future = entry
+            if isinstance(request, _Call):
+                with torch.no_grad():
+                    _resolve(future, request.run())
+                continue
+            try:
+                with torch.no_grad():
+                    masked_latent, condition_latent, mask_latent = (
+                        self.pipeline.encode_inputs(
+                            request["image"],
+                            request["condition_image"],
+                            request["mask"],
+                            request["width"],
+                            request["height"],
+                            condition_latent=request["condition_latent"],
+                            masked_latent=request["masked_latent"],
+                            mask_latent=request["mask_latent"],
+                        )
+                    )
+                    state = self.pipeline.init_denoise_state(
+                        masked_latent,
+                        condition_latent,
+                        mask_latent,
+                        num_inference_steps=request["num_inference_steps"],
+                        guidance_scale=request["guidance_scale"],
+                        generator=request["generator"],
+                        eta=request["eta"],
+                        guidance_interval=request["guidance_interval"],
+                        sampler=request["sampler"],
+                        coarse_scale=request["coarse_scale"],
+                        coarse_until=request["coarse_until"],
+                    )
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            active.append((state, future))
+        return True
+
+    def _run(self):
+        active = []
+        running = True
+        while running or active:
+            if running:
+                running = self._admit(active)
+            if not active:
+                continue
+            try:
+                with torch.no_grad():
+                    self.pipeline.denoise_step([state for state, _ in active])
+            except Exception as e:
+                for _, future in active:
+                    future.set_exception(e)
+                active = []
+                continue
+
+            finished = [(state, future) for state, future in active if state.done]
+            active = [(state, future) for state, future in active if not state.done]
+            for state, future in finished:
+                try:
+                    with torch.no_grad():
+                        future.set_result(self.pipeline.decode_latents(state.latents))
+                except Exception as e:
+                    future.set_exception(e)
+
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                entry[1].set_exception(
+                    RuntimeError("ContinuousBatchingEngine has been shut down")
+                )
@@ -0,0 +1,93 @@
+"""
+Latency and output difference of the self-attention backends (see
+`model/attn_processor.py`) at the sequence lengths of the CatVTON UNet: the
+person and garment latents concatenated, at each resolution level that has
+attention. Compared against plain SDPA.
+
+    python benchmarks/bench_attention.py --width 768 --height 1024 --levels 1
+    python benchmarks/bench_attention.py --device cuda --dtype float16 --sdpa-kernels flash
+
+Peak memory per backend is measured on CUDA only.
+"""
+import argparse
+import json
+
+import torch
+
+from harness import StageTimer, environment
+from model.attn_processor import ATTN_BACKENDS
+
+# SD 1.5 UNet levels with attention: (channels, heads)
+SD15_LEVELS = [(320, 8), (640, 8), (1280, 8)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["sdpa", "chunked"], choices=list(ATTN_BACKENDS))
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", choices=["float32", "float16", "bfloat16"], default="float32")
+    parser.add_argument("--sdpa-kernels", type=str, default=None, help="e.g. flash,efficient")
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--slice-size", type=int, default=None)
+    parser.add_argument("--width", type=int, default=384)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=2, help="2 = one request with CFG")
+    parser.add_argument("--levels", type=int, default=len(SD15_LEVELS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    dtype = getattr(torch, args.dtype)
+    kwargs = {"sdpa_kernels": args.sdpa_kernels.split(",") if args.sdpa_kernels else None}
+    processors = {
+        "sdpa": ATTN_BACKENDS["sdpa"](**kwargs),
+        **{
+            backend: ATTN_BACKENDS[backend](
+                chunk_size=args.chunk_size, slice_size=args.slice_size, **kwargs
+            )
+            for backend in args.backends
+            if backend != "sdpa"
+        },
+    }
+    timer = StageTimer(track_memory=args.device.startswith("cuda"))
+    generator = torch.Generator().manual_seed(0)
+    rows = []
+    for level, (channels, heads) in enumerate(SD15_LEVELS[: args.levels]):
+        scale = 8 * 2**level
+        # person and garment concatenated along y
+        seq_len = 2 * (args.height // scale) * (args.width // scale)
+        query, key, value = (
+            torch.randn(args.batch_size, heads, seq_len, channels // heads, generator=generator)
+            .to(args.device, dtype=dtype)
+            for _ in range(3)
+        )
+        reference = None
+        for backend, processor in processors.items():
+            with torch.no_grad():
+                processor.attention(query, key, value)  # warmup
+                for _ in range(args.repeats):
+                    with timer.measure(f"{backend}_{level}"):
+                        output = processor.attention(query, key, value)
+            if reference is None:
+                reference = output
+            stage = timer.summary()[f"{backend}_{level}"]
+            rows.append(
+                {
+                    "level": level,
+                    "seq_len": seq_len,
+                    "backend": backend,
+                    "latency_ms": stage["p50_ms"],
+                    "peak_mb": stage.get("peak_mb"),
+                    "max_abs_diff": (output.float() - reference.float()).abs().max().item(),
+                }
+            )
+
+    report = {"config": vars(args), "environment": environment(), "results": rows}
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
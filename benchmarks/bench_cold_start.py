@@ -0,0 +1,104 @@
+"""
+Cold start of the pipeline by stage, each repeat in a fresh process: the
+`model.bundle` path (`CatVTONPipeline.from_bundle`) and, with `--pipeline
+catvton`, the Hugging Face download + checkpoint merge path for comparison.
+
+    python benchmarks/bench_cold_start.py
+    python benchmarks/bench_cold_start.py --pipeline catvton --device cuda \
+        --bundle bundle/catvton-fp16.safetensors --dtype float16
+
+Without `--bundle`, the tiny random pipeline is bundled into a temporary
+file first. Files stay in the page cache between repeats, so the numbers
+are warm-disk cold starts; a freshly attached volume reads slower.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from harness import environment, percentile, tiny_pipeline
+from model.bundle import save_bundle
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOAD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import torch
+from model.pipeline import CatVTONPipeline
+timings = {"import": time.perf_counter() - start}
+kind, path, device, dtype = sys.argv[1:]
+start = time.perf_counter()
+if kind == "bundle":
+    pipeline = CatVTONPipeline.from_bundle(path, device=device, weight_dtype=getattr(torch, dtype))
+else:
+    pipeline = CatVTONPipeline(
+        attn_ckpt_version="mix",
+        attn_ckpt="zhengchong/CatVTON",
+        base_ckpt="booksforcharlie/stable-diffusion-inpainting",
+        weight_dtype=getattr(torch, dtype),
+        device=device,
+        skip_safety_check=True,
+    )
+timings["load"] = time.perf_counter() - start
+timings.update(pipeline.load_timings)
+print("TIMINGS " + json.dumps(timings))
+"""
+
+
+def cold_start(kind, path, device, dtype):
+    output = subprocess.run(
+        [sys.executable, "-c", LOAD_SCRIPT, kind, path, device, dtype],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    line = next(line for line in output.splitlines() if line.startswith("TIMINGS "))
+    return json.loads(line[len("TIMINGS ") :])
+
+
+def summarize(runs):
+    return {
+        stage: {"p50_s": percentile([run[stage] for run in runs], 50), "max_s": max(run[stage] for run in runs)}
+        for stage in runs[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pipeline", choices=["tiny", "catvton"], default="tiny")
+    parser.add_argument("--bundle", type=str, default=None)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", choices=["float32", "float16", "bfloat16"], default="float32")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bundle = args.bundle
+        if bundle is None:
+            bundle = os.path.join(tmp, "tiny.safetensors")
+            save_bundle(tiny_pipeline(), bundle)
+        report = {
+            "config": vars(args),
+            "environment": environment(),
+            "bundle_mb": os.path.getsize(bundle) / 1024 / 1024,
+            "bundle": summarize(
+                [cold_start("bundle", bundle, args.device, args.dtype) for _ in range(args.repeats)]
+            ),
+        }
+        if args.pipeline == "catvton":
+            report["from_pretrained"] = summarize(
+                [cold_start("pretrained", "", args.device, args.dtype) for _ in range(args.repeats)]
+            )
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
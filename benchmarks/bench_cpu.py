@@ -0,0 +1,142 @@
+"""
+Latency and accuracy of the CPU backend (`CatVTONPipeline.enable_cpu_backend`)
+against the plain float32 pipeline. Every configuration is built fresh, run
+from the same seed and latents, and compared with the float32 result by
+PSNR and mean absolute difference, both over the whole image and inside the
+mask. With `--min-psnr`, the script exits with status 1 if any
+configuration falls below it, so it can gate a CPU node rollout.
+
+    python benchmarks/bench_cpu.py --threads 8
+    python benchmarks/bench_cpu.py --pipeline catvton --width 768 --height 1024 \
+        --person person.jpg --mask mask.png --upper upper.jpg --lower lower.jpg \
+        --threads 16 --min-psnr 30 --save-dir out/
+
+With the default tiny random pipeline the weights are not trained, so the
+accuracy columns understate what the real checkpoint reaches.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+from harness import (
+    add_input_args,
+    add_pipeline_args,
+    build_pipeline,
+    environment,
+    load_inputs,
+    masked,
+    mean_abs_diff,
+    psnr,
+)
+from model.cpu_backend import QUANTIZATION_MODES, bf16_supported
+from preprocess import Preprocessor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument(
+        "--quantization", choices=QUANTIZATION_MODES, nargs="+", default=list(QUANTIZATION_MODES)
+    )
+    parser.add_argument(
+        "--bf16",
+        choices=["on", "off"],
+        nargs="+",
+        default=["off", "on"] if bf16_supported() else ["off"],
+    )
+    parser.add_argument("--no-channels-last", action="store_true")
+    parser.add_argument("--steps", type=int, default=15)
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    add_input_args(parser)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-psnr", type=float, default=None, help="fail below this PSNR (dB)")
+    parser.add_argument("--save-dir", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+    args.cpu_quantization = None  # the reference is the plain float32 pipeline
+
+    preprocessor = Preprocessor(args.width, args.height)
+    person, mask, upper, lower = load_inputs(args)
+
+    def run(pipeline):
+        masked_latent, mask_latent = pipeline.encode_person(
+            preprocessor.person_batch([person]), preprocessor.mask_batch([mask])
+        )
+        condition_latent = pipeline.encode_condition(preprocessor.cloth_batch([(upper, lower)]))
+        return pipeline(
+            image=None,
+            condition_image=None,
+            mask=None,
+            num_inference_steps=args.steps,
+            guidance_scale=args.guidance_scale,
+            height=args.height,
+            width=args.width,
+            generator=torch.Generator().manual_seed(args.seed),
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+        )[0]
+
+    def measure(pipeline):
+        result = run(pipeline)  # warmup (and prepacking of the int8 weights)
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            result = run(pipeline)
+            times.append((time.perf_counter() - start) * 1000)
+        return result, sorted(times)[len(times) // 2]
+
+    with torch.no_grad():
+        reference, reference_ms = measure(build_pipeline(args))
+        rows = [{"quantization": None, "bf16": False, "latency_ms": reference_ms}]
+        for quantization in args.quantization:
+            for bf16 in args.bf16:
+                pipeline = build_pipeline(args)
+                pipeline.enable_cpu_backend(
+                    quantization,
+                    bf16=bf16 == "on",
+                    channels_last=not args.no_channels_last,
+                    num_threads=args.threads,
+                )
+                result, latency_ms = measure(pipeline)
+                rows.append(
+                    {
+                        "quantization": quantization,
+                        "bf16": bf16 == "on",
+                        "latency_ms": latency_ms,
+                        "speedup": reference_ms / latency_ms,
+                        "psnr_db": psnr(result, reference),
+                        "mean_abs_diff": mean_abs_diff(result, reference),
+                        "masked_psnr_db": psnr(masked(result, mask), masked(reference, mask)),
+                    }
+                )
+                if args.save_dir is not None:
+                    os.makedirs(args.save_dir, exist_ok=True)
+                    result.save(os.path.join(args.save_dir, f"cpu_{quantization}_bf16-{bf16}.png"))
+
+    failed = [
+        row for row in rows[1:] if args.min_psnr is not None and row["psnr_db"] < args.min_psnr
+    ]
+    report = {
+        "config": vars(args),
+        "environment": environment(),
+        "bf16_supported": bf16_supported(),
+        "num_threads": torch.get_num_threads(),
+        "results": rows,
+        "passed": not failed,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
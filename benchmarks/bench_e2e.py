@@ -0,0 +1,174 @@
+"""
+End-to-end benchmark of the serving path: `get_vton.get_vton_batch` with its
+latent caches, output stage and batched SQS notifier, broken down per stage
+(fetch, preprocess, VAE encode, each denoising step, decode, JPEG encode,
+upload and notify) through the `model.utils.timed_stage` hooks, with peak
+memory per stage on CUDA. Uses the tiny random pipeline (by default) and
+local HTTP/S3/SQS stand-ins from `harness.py`, so it runs on CPU with no
+network.
+
+    python benchmarks/bench_e2e.py --requests 16 --batch-size 4 --output base.json
+
+Write one JSON per commit and diff them to see which stage moved. The latent
+caches are off by default so every batch is encoded; give them a budget with
+`--garment-cache-mb`/`--person-cache-mb` to benchmark cache hits.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from harness import (
+    FakeS3,
+    FakeSQS,
+    LocalImageServer,
+    StageTimer,
+    add_pipeline_args,
+    build_pipeline,
+    encode_image,
+    environment,
+    synthetic_image,
+    synthetic_mask,
+)
+import model.utils
+from preprocess import Preprocessor
+
+
+def make_inputs(num_images, input_size):
+    files = {}
+    for i in range(num_images):
+        files[f"person_{i}.jpg"] = encode_image(synthetic_image(input_size, seed=i))
+        files[f"mask_{i}.png"] = encode_image(synthetic_mask(input_size, seed=i), "PNG")
+        files[f"upper_{i}.jpg"] = encode_image(
+            synthetic_image((input_size[0], input_size[1] // 2), seed=100 + i)
+        )
+        files[f"lower_{i}.jpg"] = encode_image(
+            synthetic_image((input_size[0], input_size[1] // 2), seed=200 + i)
+        )
+    return files
+
+
+def make_requests(server, indices, seed):
+    return [
+        {
+            "person_image_url": server.url(f"person_{i}.jpg"),
+            "upper_cloth_url": server.url(f"upper_{i}.jpg"),
+            "lower_cloth_url": server.url(f"lower_{i}.jpg"),
+            "mask_image_url": server.url(f"mask_{i}.png"),
+            "cloth_type": "upper",
+            "username": f"user_{i}",
+            "timestamp": "bench",
+            "seed": seed + i,
+        }
+        for i in indices
+    ]
+
+
+def run_batch(get_vton, requests):
+    """Serves one batch and waits until every result is uploaded."""
+    for result in get_vton.get_vton_batch(requests):
+        if isinstance(result, Exception):
+            raise result
+        result.result()
+
+
+def load_get_vton(args):
+    """Imports `get_vton` configured from `args`, with the pipeline and S3/SQS stand-ins in place."""
+    os.environ.update(
+        DEVICE=args.device,
+        NUM_STEP=str(args.steps),
+        MAX_BATCH_SIZE=str(args.batch_size),
+        SAVE_LOCAL_OUTPUT="0",
+        GARMENT_CACHE_DEVICE_MB=str(args.garment_cache_mb),
+        GARMENT_CACHE_HOST_MB=str(args.garment_cache_mb),
+        PERSON_CACHE_DEVICE_MB=str(args.person_cache_mb),
+        PERSON_CACHE_HOST_MB=str(args.person_cache_mb),
+        SQS_BATCH_WAIT_MS=str(args.sqs_batch_wait_ms),
+    )
+    import get_vton
+
+    get_vton.WIDTH, get_vton.HEIGHT = args.width, args.height
+    get_vton.preprocessor = Preprocessor(args.width, args.height)
+    get_vton.pipeline = build_pipeline(args)
+    get_vton.load_caches()
+    get_vton.load_clients(
+        s3_client=FakeS3(latency_ms=args.s3_latency_ms),
+        sqs_client=FakeSQS(latency_ms=args.sqs_latency_ms),
+    )
+    return get_vton
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=15)
+    parser.add_argument("--width", type=int, default=192)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--input-width", type=int, default=768)
+    parser.add_argument("--input-height", type=int, default=1024)
+    parser.add_argument("--num-images", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1, help="untimed batches")
+    parser.add_argument("--garment-cache-mb", type=int, default=0, help="per tier, 0 disables")
+    parser.add_argument("--person-cache-mb", type=int, default=0, help="per tier, 0 disables")
+    parser.add_argument("--http-latency-ms", type=float, default=0.0)
+    parser.add_argument("--s3-latency-ms", type=float, default=0.0)
+    parser.add_argument("--sqs-latency-ms", type=float, default=0.0)
+    parser.add_argument("--sqs-batch-wait-ms", type=float, default=100.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    get_vton = load_get_vton(args)
+    files = make_inputs(args.num_images, (args.input_width, args.input_height))
+    timer = StageTimer(track_memory=args.device.startswith("cuda"))
+    with LocalImageServer(files, latency_ms=args.http_latency_ms) as server:
+        batches = [
+            make_requests(
+                server,
+                [i % args.num_images for i in range(start, min(start + args.batch_size, args.requests))],
+                args.seed,
+            )
+            for start in range(0, args.requests, args.batch_size)
+        ]
+
+        with torch.no_grad():
+            for _ in range(args.warmup):
+                run_batch(get_vton, batches[0])
+            model.utils.stage_timer = timer
+            start = time.perf_counter()
+            for batch in batches:
+                with timer.measure("end_to_end", items=len(batch)):
+                    run_batch(get_vton, batch)
+            elapsed = time.perf_counter() - start
+            # notifications still waiting for a batch are sent (and timed) here
+            get_vton.close_clients()
+            model.utils.stage_timer = None
+        get_vton.fetcher.close()
+
+    pipeline = get_vton.pipeline
+    report = {
+        "config": vars(args),
+        "environment": environment(),
+        "wall_s": elapsed,
+        "throughput_per_s": args.requests / elapsed,
+        "stages": timer.summary(),
+        "output_stage": get_vton.output_stage.stats(),
+        "notifier": get_vton.notifier.stats(),
+        "garment_cache": get_vton.garment_cache.stats(),
+        "person_cache": get_vton.person_cache.stats(),
+    }
+    if pipeline.deep_cache is not None:
+        report["deep_cache"] = pipeline.deep_cache.stats()
+    report["vae"] = pipeline.budgeted_vae.stats()
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
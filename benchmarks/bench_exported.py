@@ -0,0 +1,128 @@
+"""
+Latency and output of the exported UNet/VAE graphs (`CatVTONPipeline.use_exported`)
+against the eager modules, over full denoising runs from the same seed and
+latents, once per sampler in `--samplers`: the default covers DDIM
+(integer timesteps) and Euler (fractional timesteps), which both have to
+run through the graphs. Exports into `--graphs-dir` first unless it already
+holds a manifest.
+
+    python benchmarks/bench_exported.py --graphs-dir /tmp/graphs --batch-size 2
+    python benchmarks/bench_exported.py --pipeline catvton --width 768 --height 1024 \
+        --graphs-dir graphs/ --threads 16 --format onnx
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from harness import add_pipeline_args, build_pipeline, environment, synthetic_image, synthetic_mask
+from model.exported import EXPORT_FORMATS, MANIFEST, export_pipeline
+from model.samplers import SAMPLERS
+from preprocess import Preprocessor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument("--graphs-dir", type=str, required=True)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="onnx")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--samplers", choices=list(SAMPLERS), nargs="+", default=["ddim", "euler"])
+    parser.add_argument("--steps", type=int, default=15)
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    parser.add_argument("--width", type=int, default=192)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.graphs_dir, MANIFEST)):
+        export_pipeline(
+            build_pipeline(args),
+            args.graphs_dir,
+            batch_sizes=[args.batch_size],
+            height=args.height,
+            width=args.width,
+            format=args.format,
+        )
+
+    preprocessor = Preprocessor(args.width, args.height)
+    size = (args.width, args.height)
+    person = preprocessor.person_batch([synthetic_image(size, seed=i) for i in range(args.batch_size)])
+    mask = preprocessor.mask_batch([synthetic_mask(size, seed=i) for i in range(args.batch_size)])
+    cloth = preprocessor.cloth_batch(
+        [
+            (synthetic_image((args.width, args.height // 2), seed=100 + i),) * 2
+            for i in range(args.batch_size)
+        ]
+    )
+
+    def run(pipeline, sampler):
+        masked_latent, mask_latent = pipeline.encode_person(person, mask)
+        condition_latent = pipeline.encode_condition(cloth)
+        state = pipeline.init_denoise_state(
+            masked_latent,
+            condition_latent,
+            mask_latent,
+            num_inference_steps=args.steps,
+            guidance_scale=args.guidance_scale,
+            generator=[torch.Generator().manual_seed(args.seed + i) for i in range(args.batch_size)],
+            sampler=sampler,
+        )
+        pipeline.denoise([state])
+        latents = state.latents.split(state.latents.shape[-2] // 2, dim=-2)[0]
+        return pipeline.budgeted_vae.decode(latents / pipeline.vae.config.scaling_factor).sample
+
+    def measure(pipeline, sampler):
+        torch.manual_seed(args.seed)  # the VAE samples its latents from the global generator
+        result = run(pipeline, sampler)  # warmup
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            result = run(pipeline, sampler)
+            times.append((time.perf_counter() - start) * 1000)
+        return result, sorted(times)[len(times) // 2]
+
+    eager = build_pipeline(args)
+    exported = build_pipeline(args)
+    exported.use_exported(args.graphs_dir, num_threads=args.threads)
+    rows = []
+    for sampler in args.samplers:
+        before = exported.exported_stats()["unet"]
+        with torch.no_grad():
+            reference, eager_ms = measure(eager, sampler)
+            result, exported_ms = measure(exported, sampler)
+        after = exported.exported_stats()["unet"]
+        difference = (result.float() - reference.float()).abs()
+        rows.append(
+            {
+                "sampler": sampler,
+                "eager_ms": eager_ms,
+                "exported_ms": exported_ms,
+                "speedup": eager_ms / exported_ms,
+                # decoded images in [-1, 1]
+                "max_abs_diff": float(difference.max()),
+                "mean_abs_diff": float(difference.mean()),
+                # a sampler whose timesteps the graphs cannot take falls back to eager
+                "unet_graph_calls": after["graph_calls"] - before["graph_calls"],
+                "unet_eager_calls": after["eager_calls"] - before["eager_calls"],
+            }
+        )
+
+    report = {
+        "config": vars(args),
+        "environment": environment(),
+        "results": rows,
+        "exported_stats": exported.exported_stats(),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Quality/latency comparison of classifier-free guidance intervals. Every
+interval is run from the same seed and latents, and compared against full
+CFG (`0,1`) by PSNR and mean absolute difference.
+
+    python benchmarks/bench_guidance.py --intervals 0,1 0,0.6 0,0.4 0.2,0.8
+    python benchmarks/bench_guidance.py --pipeline catvton --device cuda --dtype float16 \
+        --person person.jpg --mask mask.png --upper upper.jpg --lower lower.jpg --save-dir out/
+
+With the default tiny random pipeline only the latency column is meaningful;
+use `--pipeline catvton` with real inputs to judge quality.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from harness import (
+    add_input_args,
+    add_pipeline_args,
+    build_pipeline,
+    environment,
+    load_inputs,
+    mean_abs_diff,
+    psnr,
+)
+from preprocess import Preprocessor
+
+FULL_GUIDANCE = (0.0, 1.0)
+
+
+def parse_interval(value):
+    start, end = (float(x) for x in value.split(","))
+    return start, end
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument(
+        "--intervals",
+        type=parse_interval,
+        nargs="+",
+        default=[FULL_GUIDANCE, (0.0, 0.6), (0.0, 0.4), (0.0, 0.0)],
+        help="CFG intervals as start,end fractions of the steps",
+    )
+    parser.add_argument("--steps", type=int, default=15)
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    add_input_args(parser)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-dir", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    preprocessor = Preprocessor(args.width, args.height)
+    person, mask, upper, lower = load_inputs(args)
+    masked_latent, mask_latent = pipeline.encode_person(
+        preprocessor.person_batch([person]), preprocessor.mask_batch([mask])
+    )
+    condition_latent = pipeline.encode_condition(preprocessor.cloth_batch([(upper, lower)]))
+
+    def run(interval):
+        return pipeline(
+            image=None,
+            condition_image=None,
+            mask=None,
+            num_inference_steps=args.steps,
+            guidance_scale=args.guidance_scale,
+            height=args.height,
+            width=args.width,
+            generator=torch.Generator(device=args.device).manual_seed(args.seed),
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+            guidance_interval=interval,
+        )[0]
+
+    intervals = list(dict.fromkeys([FULL_GUIDANCE] + args.intervals))
+    reference = run(FULL_GUIDANCE)
+    if args.save_dir is not None:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    rows = []
+    for interval in intervals:
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            result = run(interval)
+            times.append((time.perf_counter() - start) * 1000)
+        cfg_steps = sum(
+            interval[0] <= i / args.steps < interval[1] for i in range(args.steps)
+        )
+        rows.append(
+            {
+                "interval": list(interval),
+                "cfg_steps": cfg_steps,
+                "unet_passes": args.steps + cfg_steps,
+                "latency_ms": sorted(times)[len(times) // 2],
+                "psnr_db": psnr(result, reference),
+                "mean_abs_diff": mean_abs_diff(result, reference),
+            }
+        )
+        if args.save_dir is not None:
+            result.save(
+                os.path.join(args.save_dir, f"cfg_{interval[0]:g}_{interval[1]:g}.png")
+            )
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "intervals"},
+        "environment": environment(),
+        "results": rows,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compares the single-pass `Preprocessor` against the previous preprocessing
+path (`resize_and_crop`/`resize_and_padding` + `VaeImageProcessor.preprocess`),
+reporting CPU time per batch and the largest output difference.
+
+    python benchmarks/bench_preprocess.py --batch-size 4 --iters 10
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+from diffusers.image_processor import VaeImageProcessor
+
+from harness import synthetic_image, synthetic_mask
+from preprocess import Preprocessor, concat_upper_and_lower
+from utils import resize_and_crop, resize_and_padding
+
+
+def reference_path(persons, cloths, masks, width, height):
+    vae_processor = VaeImageProcessor(vae_scale_factor=8)
+    mask_processor = VaeImageProcessor(
+        vae_scale_factor=8,
+        do_normalize=False,
+        do_binarize=True,
+        do_convert_grayscale=True,
+    )
+    person_out, cloth_out, mask_out = [], [], []
+    for person, (upper, lower), mask in zip(persons, cloths, masks):
+        person = resize_and_crop(person, (width, height))
+        cloth = resize_and_padding(concat_upper_and_lower(upper, lower), (width, height))
+        mask = resize_and_crop(mask, (width, height))
+        person_out.append(vae_processor.preprocess(person, height, width)[0])
+        cloth_out.append(vae_processor.preprocess(cloth, height, width)[0])
+        mask_out.append(mask_processor.preprocess(mask, height, width)[0])
+    return torch.stack(person_out), torch.stack(cloth_out), torch.stack(mask_out)
+
+
+def single_pass_path(preprocessor, persons, cloths, masks):
+    return (
+        preprocessor.person_batch(persons),
+        preprocessor.cloth_batch(cloths),
+        preprocessor.mask_batch(masks),
+    )
+
+
+def time_it(fn, iters):
+    fn()  # warmup
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    persons = [synthetic_image((1080, 1440), seed=i) for i in range(args.batch_size)]
+    cloths = [
+        (synthetic_image((600, 700), seed=100 + i), synthetic_image((500, 800), seed=200 + i))
+        for i in range(args.batch_size)
+    ]
+    masks = [synthetic_mask((1080, 1440), seed=300 + i) for i in range(args.batch_size)]
+    preprocessor = Preprocessor(args.width, args.height)
+
+    ref = reference_path(persons, cloths, masks, args.width, args.height)
+    new = single_pass_path(preprocessor, persons, cloths, masks)
+
+    report = {
+        "batch_size": args.batch_size,
+        "reference_ms": time_it(
+            lambda: reference_path(persons, cloths, masks, args.width, args.height),
+            args.iters,
+        ),
+        "single_pass_ms": time_it(
+            lambda: single_pass_path(preprocessor, persons, cloths, masks), args.iters
+        ),
+        "person_max_abs_diff": (ref[0] - new[0]).abs().max().item(),
+        "person_mean_abs_diff": (ref[0] - new[0]).abs().mean().item(),
+        "cloth_max_abs_diff": (ref[1] - new[1]).abs().max().item(),
+        "mask_mismatch_fraction": (ref[2] != new[2]).float().mean().item(),
+    }
+    report["speedup"] = report["reference_ms"] / report["single_pass_ms"]
+
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
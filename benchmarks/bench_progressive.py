@@ -0,0 +1,116 @@
+"""
+Speed/quality curve of coarse-to-fine denoising: the first `--until`
+fraction of the steps runs at `--scales` times the latent resolution, the
+rest at full resolution. Every setting is run from the same seed and
+latents, and compared against full resolution throughout by PSNR and mean
+absolute difference, both over the whole image and inside the mask.
+
+    python benchmarks/bench_progressive.py --scales 0.5 0.75 --until 0.3 0.5
+    python benchmarks/bench_progressive.py --pipeline catvton --device cuda --dtype float16 \
+        --width 768 --height 1024 --person person.jpg --mask mask.png \
+        --upper upper.jpg --lower lower.jpg --sampler dpmsolver++ --save-dir out/
+
+With the default tiny random pipeline only the latency column is
+meaningful; use `--pipeline catvton` with real inputs to judge quality.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import torch
+
+from harness import (
+    add_input_args,
+    add_pipeline_args,
+    build_pipeline,
+    environment,
+    load_inputs,
+    masked,
+    mean_abs_diff,
+    psnr,
+)
+from preprocess import Preprocessor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.5, 0.75])
+    parser.add_argument("--until", type=float, nargs="+", default=[0.3, 0.5, 0.7])
+    parser.add_argument("--sampler", type=str, default=None)
+    parser.add_argument("--steps", type=int, default=15)
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    add_input_args(parser)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-dir", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    preprocessor = Preprocessor(args.width, args.height)
+    person, mask, upper, lower = load_inputs(args)
+    masked_latent, mask_latent = pipeline.encode_person(
+        preprocessor.person_batch([person]), preprocessor.mask_batch([mask])
+    )
+    condition_latent = pipeline.encode_condition(preprocessor.cloth_batch([(upper, lower)]))
+
+    def run(scale, until):
+        return pipeline(
+            image=None,
+            condition_image=None,
+            mask=None,
+            num_inference_steps=args.steps,
+            guidance_scale=args.guidance_scale,
+            height=args.height,
+            width=args.width,
+            generator=torch.Generator(device=args.device).manual_seed(args.seed),
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+            sampler=args.sampler,
+            coarse_scale=scale,
+            coarse_until=until,
+        )[0]
+
+    settings = [(None, 0.0)] + list(itertools.product(args.scales, args.until))
+    reference = run(None, 0.0)
+    if args.save_dir is not None:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    rows = []
+    for scale, until in settings:
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            result = run(scale, until)
+            times.append((time.perf_counter() - start) * 1000)
+        rows.append(
+            {
+                "scale": scale,
+                "until": until,
+                "latency_ms": sorted(times)[len(times) // 2],
+                "psnr_db": psnr(result, reference),
+                "mean_abs_diff": mean_abs_diff(result, reference),
+                "masked_psnr_db": psnr(masked(result, mask), masked(reference, mask)),
+            }
+        )
+        if args.save_dir is not None:
+            name = "full" if scale is None else f"{scale:g}_{until:g}"
+            result.save(os.path.join(args.save_dir, f"coarse_{name}.png"))
+
+    report = {
+        "config": vars(args),
+        "environment": environment(),
+        "results": rows,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Quality/latency comparison of samplers and step counts. Every configuration
+is run from the same seed and latents, and compared against the production
+default (DDIM, 15 steps) by PSNR and mean absolute difference.
+
+    python benchmarks/bench_samplers.py --configs ddim:15 dpmsolver++:8 unipc:8 euler:10
+    python benchmarks/bench_samplers.py --pipeline catvton --device cuda --dtype float16 \
+        --person person.jpg --mask mask.png --upper upper.jpg --lower lower.jpg --save-dir out/
+
+With the default tiny random pipeline only the latency column is meaningful;
+use `--pipeline catvton` with real inputs to judge quality.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from harness import (
+    add_input_args,
+    add_pipeline_args,
+    build_pipeline,
+    environment,
+    load_inputs,
+    mean_abs_diff,
+    psnr,
+)
+from model.samplers import SAMPLERS
+from preprocess import Preprocessor
+
+REFERENCE = ("ddim", 15)
+
+
+def parse_config(value):
+    sampler, steps = value.rsplit(":", 1)
+    if sampler not in SAMPLERS:
+        raise argparse.ArgumentTypeError(f"unknown sampler: {sampler}")
+    return sampler, int(steps)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument(
+        "--configs",
+        type=parse_config,
+        nargs="+",
+        default=[REFERENCE, ("ddim", 8), ("dpmsolver++", 8), ("unipc", 8), ("euler", 10)],
+        help="sampler:steps pairs",
+    )
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    add_input_args(parser)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-dir", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    preprocessor = Preprocessor(args.width, args.height)
+    person, mask, upper, lower = load_inputs(args)
+    masked_latent, mask_latent = pipeline.encode_person(
+        preprocessor.person_batch([person]), preprocessor.mask_batch([mask])
+    )
+    condition_latent = pipeline.encode_condition(preprocessor.cloth_batch([(upper, lower)]))
+
+    def run(sampler, steps):
+        return pipeline(
+            image=None,
+            condition_image=None,
+            mask=None,
+            num_inference_steps=steps,
+            guidance_scale=args.guidance_scale,
+            height=args.height,
+            width=args.width,
+            generator=torch.Generator(device=args.device).manual_seed(args.seed),
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+            sampler=sampler,
+        )[0]
+
+    configs = list(dict.fromkeys([REFERENCE] + args.configs))
+    reference = run(*REFERENCE)
+    if args.save_dir is not None:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    rows = []
+    for sampler, steps in configs:
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            result = run(sampler, steps)
+            times.append((time.perf_counter() - start) * 1000)
+        rows.append(
+            {
+                "sampler": sampler,
+                "steps": steps,
+                "latency_ms": sorted(times)[len(times) // 2],
+                "psnr_db": psnr(result, reference),
+                "mean_abs_diff": mean_abs_diff(result, reference),
+            }
+        )
+        if args.save_dir is not None:
+            result.save(os.path.join(args.save_dir, f"{sampler}_{steps}.png"))
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "configs"},
+        "environment": environment(),
+        "results": rows,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
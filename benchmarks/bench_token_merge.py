@@ -0,0 +1,120 @@
+"""
+Speed/quality curve of self-attention token merging. Every setting is run
+from the same seed and latents, and compared against no merging by PSNR
+and mean absolute difference, both over the whole image and inside the
+mask (the repainted area).
+
+    python benchmarks/bench_token_merge.py --ratios 0.3 0.5 0.7 0.5,0.25
+    python benchmarks/bench_token_merge.py --pipeline catvton --device cuda --dtype float16 \
+        --width 768 --height 1024 --person person.jpg --mask mask.png \
+        --upper upper.jpg --lower lower.jpg --save-dir out/
+
+Each `--ratios` entry lists the merge ratio per UNet resolution level
+(0 = latent resolution). With the default tiny random pipeline only the
+latency column is meaningful; use `--pipeline catvton` with real inputs to
+judge quality.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from harness import (
+    add_input_args,
+    add_pipeline_args,
+    build_pipeline,
+    environment,
+    load_inputs,
+    masked,
+    mean_abs_diff,
+    parse_ratios,
+    psnr,
+)
+from preprocess import Preprocessor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument(
+        "--ratios",
+        type=parse_ratios,
+        nargs="+",
+        default=[(0.3,), (0.5,), (0.7,), (0.5, 0.25)],
+        help="comma separated merge ratios per UNet level",
+    )
+    parser.add_argument("--priority-bonus", type=float, default=1.0)
+    parser.add_argument("--steps", type=int, default=15)
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    add_input_args(parser)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-dir", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    preprocessor = Preprocessor(args.width, args.height)
+    person, mask, upper, lower = load_inputs(args)
+    masked_latent, mask_latent = pipeline.encode_person(
+        preprocessor.person_batch([person]), preprocessor.mask_batch([mask])
+    )
+    condition_latent = pipeline.encode_condition(preprocessor.cloth_batch([(upper, lower)]))
+
+    def run(ratios):
+        pipeline.enable_token_merging(ratios, args.priority_bonus)
+        return pipeline(
+            image=None,
+            condition_image=None,
+            mask=None,
+            num_inference_steps=args.steps,
+            guidance_scale=args.guidance_scale,
+            height=args.height,
+            width=args.width,
+            generator=torch.Generator(device=args.device).manual_seed(args.seed),
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+        )[0]
+
+    settings = list(dict.fromkeys([()] + args.ratios))
+    reference = run(())
+    if args.save_dir is not None:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    rows = []
+    for ratios in settings:
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            result = run(ratios)
+            times.append((time.perf_counter() - start) * 1000)
+        rows.append(
+            {
+                "ratios": list(ratios),
+                "latency_ms": sorted(times)[len(times) // 2],
+                "psnr_db": psnr(result, reference),
+                "mean_abs_diff": mean_abs_diff(result, reference),
+                "masked_psnr_db": psnr(masked(result, mask), masked(reference, mask)),
+            }
+        )
+        if args.save_dir is not None:
+            name = "_".join(f"{r:g}" for r in ratios) or "none"
+            result.save(os.path.join(args.save_dir, f"tome_{name}.png"))
+    pipeline.enable_token_merging(())
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "ratios"},
+        "environment": environment(),
+        "results": rows,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
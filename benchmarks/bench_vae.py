@@ -0,0 +1,104 @@
+"""
+Latency, peak memory and output difference of the VAE execution modes
+(`full`, `sliced`, `tiled`; see `model/vae_memory.py`) for encode and decode
+of one batch. Each mode is forced through a budget just below what the
+previous mode needs, and compared against `full`.
+
+    python benchmarks/bench_vae.py --batch-size 4
+    python benchmarks/bench_vae.py --pipeline catvton --device cuda --dtype float16 \
+        --width 768 --height 1024 --batch-size 4 --vae-tile-size 512
+
+Peak memory is only measured on CUDA (the stage timer resets the peak before
+each measurement, so every call reports its measured peak); the estimate
+used to pick the mode is reported everywhere.
+"""
+import argparse
+import json
+
+import torch
+
+from harness import (
+    StageTimer,
+    add_pipeline_args,
+    build_pipeline,
+    environment,
+    synthetic_image,
+)
+from model.vae_memory import FULL, SLICED, TILED, BudgetedVAE
+from preprocess import Preprocessor
+
+MB = 1024 * 1024
+
+
+def mode_budgets(budgeted_vae, op, batch_size, height, width):
+    """Budget in MB that makes `budgeted_vae` pick each mode."""
+    sliced = budgeted_vae.estimate_bytes(op, 1, height, width)
+    return {FULL: None, SLICED: sliced / MB, TILED: (sliced - 1) / MB}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--width", type=int, default=192)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    vae = pipeline.vae
+    preprocessor = Preprocessor(args.width, args.height)
+    images = preprocessor.person_batch(
+        [synthetic_image((args.width, args.height), seed=i) for i in range(args.batch_size)]
+    )
+    pixel_values = (images * 2 - 1).to(args.device, dtype=pipeline.weight_dtype)
+    with torch.no_grad():
+        latents = vae.encode(pixel_values).latent_dist.mode()
+
+    rows = []
+    timer = StageTimer(track_memory=args.device.startswith("cuda"))
+    for op, run in (
+        ("encode", lambda v: v.encode(pixel_values).latent_dist.mode()),
+        ("decode", lambda v: v.decode(latents).sample),
+    ):
+        reference = None
+        budgets = mode_budgets(
+            BudgetedVAE(vae), op, args.batch_size, args.height, args.width
+        )
+        for mode, budget_mb in budgets.items():
+            budgeted_vae = BudgetedVAE(vae, budget_mb, args.vae_tile_size)
+            with torch.no_grad():
+                run(budgeted_vae)  # warmup
+                for _ in range(args.repeats):
+                    with timer.measure(f"{op}_{mode}", items=args.batch_size):
+                        output = run(budgeted_vae)
+            if reference is None:
+                reference = output
+            stage = timer.summary()[f"{op}_{mode}"]
+            rows.append(
+                {
+                    "op": op,
+                    "mode": mode,
+                    "chosen": next(m for m in (FULL, SLICED, TILED) if budgeted_vae.stats()[op][m]),
+                    "latency_ms": stage["p50_ms"],
+                    "peak_mb": stage.get("peak_mb"),
+                    "estimated_peak_mb": budgeted_vae.stats()[op]["max_estimated_peak_mb"],
+                    "measured_peak_mb": budgeted_vae.stats()[op]["max_measured_peak_mb"],
+                    "max_abs_diff": (output.float() - reference.float()).abs().max().item(),
+                }
+            )
+
+    report = {
+        "config": vars(args),
+        "environment": environment(),
+        "results": rows,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
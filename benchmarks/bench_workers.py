@@ -0,0 +1,137 @@
+"""
+Throughput and memory of multi-process CPU serving (`cpu_workers.WorkerPool`)
+by worker count. The pipeline is loaded once in the pool's zygote process
+and every worker is forked from it, so the weights are shared
+copy-on-write; memory is reported as the summed PSS of the supervisor, the
+zygote and the workers (shared pages counted once) next to their summed
+RSS (what N separately loaded processes would roughly take).
+
+    python benchmarks/bench_workers.py --workers 1 2 4
+    python benchmarks/bench_workers.py --pipeline catvton --cpu-quantization dynamic \
+        --workers 1 2 4 8 --cores numa --width 768 --height 1024 --requests 64
+
+`--threads` sets the intra-op threads of each worker (default: its core
+count). With the default tiny random pipeline, activations dominate and
+the memory saving is small; with the real checkpoint it is about one
+model copy per extra worker.
+"""
+import argparse
+import functools
+import json
+import time
+from concurrent.futures import wait
+
+import torch
+
+from harness import add_input_args, add_pipeline_args, build_pipeline, environment, load_inputs
+from cpu_workers import WorkerPool, parse_core_sets
+from preprocess import Preprocessor
+
+# set in the zygote before forking, inherited by the workers
+PIPELINE = None
+LATENTS = None
+SETTINGS = None
+
+
+def run_batch(seeds):
+    masked_latent, mask_latent, condition_latent = (
+        latent.repeat(len(seeds), 1, 1, 1) for latent in LATENTS
+    )
+    with torch.no_grad():
+        PIPELINE(
+            image=None,
+            condition_image=None,
+            mask=None,
+            generator=[torch.Generator().manual_seed(seed) for seed in seeds],
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+            **SETTINGS,
+        )
+    return [None] * len(seeds)
+
+
+def warmup():
+    run_batch([0])
+    return torch.get_num_threads()
+
+
+def load(args):
+    global PIPELINE, LATENTS, SETTINGS
+    # the workers cannot use an OpenMP pool the zygote started
+    torch.set_num_threads(1)
+    PIPELINE = build_pipeline(args)
+    preprocessor = Preprocessor(args.width, args.height)
+    person, mask, upper, lower = load_inputs(args)
+    with torch.no_grad():
+        masked_latent, mask_latent = PIPELINE.encode_person(
+            preprocessor.person_batch([person]), preprocessor.mask_batch([mask])
+        )
+        condition_latent = PIPELINE.encode_condition(preprocessor.cloth_batch([(upper, lower)]))
+    LATENTS = (masked_latent, mask_latent, condition_latent)
+    SETTINGS = dict(num_inference_steps=args.steps, height=args.height, width=args.width)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--cores", type=str, default="", help='"", "numa" or e.g. "0-7;8-15"')
+    parser.add_argument("--batch-size", type=int, default=1, help="micro-batch size per worker")
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--steps", type=int, default=15)
+    add_input_args(parser)
+    parser.add_argument("--output", type=str, default=None, help="write JSON here")
+    args = parser.parse_args()
+    worker_threads, args.threads = args.threads, 1
+
+    rows = []
+    for num_workers in args.workers:
+        core_sets = parse_core_sets(args.cores, num_workers)
+        pool = WorkerPool(
+            run_batch,
+            core_sets,
+            load_fn=functools.partial(load, args),
+            init_fn=warmup,
+            max_batch_size=args.batch_size,
+            max_wait_ms=5,
+            num_threads=worker_threads,
+        )
+        pool.wait_loaded()
+        pool.start_workers()
+        start = time.perf_counter()
+        futures = [pool.submit(seed) for seed in range(args.requests)]
+        wait(futures)
+        elapsed = time.perf_counter() - start
+        for future in futures:
+            future.result()
+        stats = pool.stats()
+        memory = [stats["supervisor_memory"], stats["zygote"]["memory"]] + [worker["memory"] for worker in stats["workers"]]
+        rows.append(
+            {
+                "workers": num_workers,
+                "core_sets": core_sets,
+                "threads": [worker["init"] for worker in stats["workers"]],
+                "throughput_rps": args.requests / elapsed,
+                "total_pss_mb": sum(m["pss_mb"] for m in memory if m),
+                "total_rss_mb": sum(m["rss_mb"] for m in memory if m),
+                "batches": [worker["batches"] for worker in stats["workers"]],
+            }
+        )
+        pool.shutdown()
+    for row in rows:
+        row["speedup"] = row["throughput_rps"] / rows[0]["throughput_rps"]
+
+    report = {
+        "config": vars(args),
+        "environment": environment(),
+        "results": rows,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+"""
+Shared pieces for the benchmarks: a CatVTON pipeline built from tiny randomly
+initialized modules, local stand-ins for the image host, S3 and SQS, and a
+per-stage latency recorder. Everything runs on CPU without network access.
+"""
+import hashlib
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+import torch
+from diffusers import AutoencoderKL, DDIMScheduler, UNet2DConditionModel
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from model.pipeline import CatVTONPipeline  # noqa: E402
+
+# Same block layout as SD inpainting (9 input channels, cross-attention blocks
+# on both paths), scaled down so a step takes milliseconds on CPU.
+TINY_UNET_CONFIG = dict(
+    in_channels=9,
+    out_channels=4,
+    block_out_channels=(32, 64),
+    down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+    up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+    cross_attention_dim=32,
+    layers_per_block=1,
+    attention_head_dim=8,
+    norm_num_groups=8,
+)
+TINY_VAE_CONFIG = dict(
+    block_out_channels=(32, 32, 64, 64),
+    down_block_types=("DownEncoderBlock2D",) * 4,
+    up_block_types=("UpDecoderBlock2D",) * 4,
+    latent_channels=4,
+    layers_per_block=1,
+    norm_num_groups=8,
+)
+
+
+def tiny_pipeline(seed=0, device="cpu", weight_dtype=torch.float32, strip_cross_attn=False):
+    """
+    `CatVTONPipeline` with random tiny UNet and VAE weights. The VAE keeps the
+    8x downsampling of the real one, so latent shapes match production.
+    """
+    torch.manual_seed(seed)
+    return CatVTONPipeline.from_components(
+        vae=AutoencoderKL(**TINY_VAE_CONFIG),
+        unet=UNet2DConditionModel(**TINY_UNET_CONFIG),
+        noise_scheduler=DDIMScheduler(),
+        weight_dtype=weight_dtype,
+        device=device,
+        strip_cross_attn=strip_cross_attn,
+    )
+
+
+def add_pipeline_args(parser):
+    parser.add_argument(
+        "--pipeline",
+        choices=["tiny", "catvton"],
+        default="tiny",
+        help="tiny random weights on CPU, or the real CatVTON checkpoints",
+    )
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", choices=["float32", "float16", "bfloat16"], default="float32")
+    parser.add_argument("--deep-cache-interval", type=int, default=1, help="1 disables DeepCache")
+    parser.add_argument("--deep-cache-depth", type=int, default=1)
+    parser.add_argument("--vae-budget-mb", type=int, default=0, help="0 runs the VAE unbudgeted")
+    parser.add_argument("--vae-tile-size", type=int, default=None)
+    parser.add_argument(
+        "--strip-cross-attn", action="store_true", help="remove the skipped attn2 modules"
+    )
+    parser.add_argument("--attn-backend", choices=["sdpa", "chunked", "xformers"], default="sdpa")
+    parser.add_argument("--sdpa-kernels", type=str, default=None, help="e.g. flash,efficient")
+    parser.add_argument("--attn-chunk-size", type=int, default=1024)
+    parser.add_argument("--attn-slice-size", type=int, default=None)
+    parser.add_argument(
+        "--token-merge-ratios", type=str, default="", help="per UNet level, e.g. 0.5,0.25"
+    )
+    parser.add_argument(
+        "--cpu-quantization",
+        choices=["none", "dynamic", "weight_only"],
+        default=None,
+        help="set up the CPU backend with this UNet quantization",
+    )
+    parser.add_argument("--cpu-bf16", choices=["auto", "on", "off"], default="auto")
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads")
+
+
+def build_pipeline(args):
+    weight_dtype = getattr(torch, args.dtype)
+    if args.pipeline == "tiny":
+        pipeline = tiny_pipeline(
+            device=args.device,
+            weight_dtype=weight_dtype,
+            strip_cross_attn=args.strip_cross_attn,
+        )
+    else:
+        pipeline = CatVTONPipeline(
+            attn_ckpt_version="mix",
+            attn_ckpt="zhengchong/CatVTON",
+            base_ckpt="booksforcharlie/stable-diffusion-inpainting",
+            weight_dtype=weight_dtype,
+            device=args.device,
+            skip_safety_check=True,
+            strip_cross_attn=args.strip_cross_attn,
+        )
+    pipeline.set_attn_backend(
+        args.attn_backend,
+        sdpa_kernels=args.sdpa_kernels.split(",") if args.sdpa_kernels else None,
+        chunk_size=args.attn_chunk_size,
+        slice_size=args.attn_slice_size,
+    )
+    pipeline.enable_deep_cache(args.deep_cache_interval, args.deep_cache_depth)
+    pipeline.enable_token_merging(parse_ratios(args.token_merge_ratios))
+    pipeline.enable_vae_memory_budget(args.vae_budget_mb, args.vae_tile_size)
+    if args.cpu_quantization is not None:
+        pipeline.enable_cpu_backend(
+            args.cpu_quantization,
+            bf16=parse_switch(args.cpu_bf16),
+            num_threads=args.threads,
+        )
+    return pipeline
+
+
+def parse_ratios(value):
+    return tuple(float(x) for x in value.split(",") if x)
+
+
+def parse_switch(value):
+    """`on`/`off`/`auto` as True/False/None."""
+    return {"on": True, "off": False, "auto": None}[value]
+
+
+def synthetic_image(size, seed=0, mode="RGB"):
+    """Smooth random image, closer to a photo than white noise."""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(size[1] // 16, 1), max(size[0] // 16, 1), 3))
+    image = Image.fromarray(small.astype(np.uint8)).resize(size, Image.BICUBIC)
+    return image.convert(mode)
+
+
+def synthetic_mask(size, seed=0):
+    """Binary mask covering a random box in the middle of the image."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    left, top = rng.integers(w // 8, w // 3), rng.integers(h // 8, h // 3)
+    right, bottom = rng.integers(2 * w // 3, 7 * w // 8), rng.integers(2 * h // 3, 7 * h // 8)
+    mask = np.zeros((h, w), dtype=np.uint8)
+    mask[top:bottom, left:right] = 255
+    return Image.fromarray(mask)
+
+
+def add_input_args(parser):
+    parser.add_argument("--width", type=int, default=192)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--person", type=str, default=None)
+    parser.add_argument("--mask", type=str, default=None)
+    parser.add_argument("--upper", type=str, default=None)
+    parser.add_argument("--lower", type=str, default=None)
+
+
+def load_inputs(args):
+    """`(person, mask, upper, lower)` from the given paths, or synthetic ones."""
+    if args.person is not None:
+        return (
+            Image.open(args.person),
+            Image.open(args.mask),
+            Image.open(args.upper),
+            Image.open(args.lower),
+        )
+    size = (args.width, args.height)
+    return (
+        synthetic_image(size, seed=0),
+        synthetic_mask(size, seed=0),
+        synthetic_image((args.width, args.height // 2), seed=1),
+        synthetic_image((args.width, args.height // 2), seed=2),
+    )
+
+
+def encode_image(image, format="JPEG"):
+    buffer = BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+
+class LocalImageServer:
+    """
+    Serves in-memory image bytes over HTTP on 127.0.0.1, with ETag and
+    Content-Length headers like S3 presigned URLs.
+
+        with LocalImageServer({"person.jpg": data}) as server:
+            server.url("person.jpg")
+    """
+
+    def __init__(self, files, latency_ms=0.0):
+        self.files = dict(files)
+        self.latency = latency_ms / 1000.0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                data = server.files.get(self.path.lstrip("/"))
+                if server.latency:
+                    time.sleep(server.latency)
+                if data is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("ETag", '"%s"' % hashlib.md5(data).hexdigest())
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def url(self, name):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class FakeS3:
+    """`upload_fileobj` stand-in that keeps objects in memory."""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def upload_fileobj(self, fileobj, bucket, key, **kwargs):
+        data = fileobj.read()
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.objects[(bucket, key)] = data
+
+
+class FakeSQS:
+    """`send_message`/`send_message_batch` stand-in that keeps messages in memory."""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        return self.send_message_batch(QueueUrl, [{"Id": "0", "MessageBody": MessageBody}])[
+            "Successful"
+        ][0]
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if self.latency:
+            time.sleep(self.latency)
+        successful = []
+        with self._lock:
+            for entry in Entries:
+                self.messages.append(entry["MessageBody"])
+                successful.append({"Id": entry["Id"], "MessageId": str(len(self.messages))})
+        return {"Successful": successful, "Failed": []}
+
+
+def psnr(image, reference):
+    """PSNR in dB between two PIL images of the same size."""
+    a = np.asarray(image, dtype=np.float64)
+    b = np.asarray(reference, dtype=np.float64)
+    mse = np.mean((a - b) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0**2 / mse))
+
+
+def mean_abs_diff(image, reference):
+    """Mean absolute pixel difference (0-255) between two PIL images."""
+    a = np.asarray(image, dtype=np.float64)
+    b = np.asarray(reference, dtype=np.float64)
+    return float(np.mean(np.abs(a - b)))
+
+
+def masked(image, mask):
+    """Pixels of `image` inside `mask` as a 1 x N x 3 image-like array."""
+    return np.asarray(image)[np.asarray(mask.convert("L").resize(image.size)) > 127][None]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+class StageTimer:
+    """
+    Records wall-clock durations per stage. `items` is how many requests a
+    measurement covered, so batched stages report per-request throughput.
+    With `track_memory` (CUDA only) the peak memory allocated on top of what
+    was already in use is recorded per stage as well.
+
+        with timer.measure("decode", items=4):
+            ...
+    """
+
+    def __init__(self, track_memory=False):
+        self.durations = {}
+        self.items = {}
+        self.peaks = {}
+        self.track_memory = track_memory and torch.cuda.is_available()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, items=1, peak_bytes=None):
+        with self._lock:
+            self.durations.setdefault(stage, []).append(seconds * 1000)
+            self.items[stage] = self.items.get(stage, 0) + items
+            if peak_bytes is not None:
+                self.peaks[stage] = max(self.peaks.get(stage, 0), peak_bytes)
+
+    def measure(self, stage, items=1):
+        return _Measure(self, stage, items)
+
+    def summary(self):
+        with self._lock:
+            summary = {}
+            for stage, durations in self.durations.items():
+                total_s = sum(durations) / 1000
+                summary[stage] = {
+                    "count": len(durations),
+                    "p50_ms": percentile(durations, 50),
+                    "p95_ms": percentile(durations, 95),
+                    "mean_ms": float(np.mean(durations)),
+                    "throughput_per_s": self.items[stage] / total_s if total_s else 0.0,
+                }
+                if stage in self.peaks:
+                    summary[stage]["peak_mb"] = self.peaks[stage] / 1024 / 1024
+            return summary
+
+
+class _Measure:
+    def __init__(self, timer, stage, items):
+        self.timer = timer
+        self.stage = stage
+        self.items = items
+
+    def __enter__(self):
+        if self.timer.track_memory:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            self.allocated = torch.cuda.memory_allocated()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        peak_bytes = None
+        if self.timer.track_memory:
+            torch.cuda.synchronize()
+            peak_bytes = torch.cuda.max_memory_allocated() - self.allocated
+        self.timer.record(self.stage, time.perf_counter() - self.start, self.items, peak_bytes)
+
+
+def environment():
+    """Metadata stored next to the results so runs can be compared."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "torch": torch.__version__,
+        "num_threads": torch.get_num_threads(),
+        "python": sys.version.split()[0],
+    }
@@ -0,0 +1,45 @@
+"""
+Builds the model bundle `MODEL_BUNDLE` points at: one safetensors file with
+the CatVTON UNet (attention checkpoint merged) and VAE, already in the
+serving dtype, so startup skips the downloads and the checkpoint merge.
+
+    python build_bundle.py --output bundle/catvton-fp16.safetensors --dtype float16
+    python build_bundle.py --output bundle/catvton-fp32.safetensors --dtype float32 --strip-cross-attn
+
+Build float16 for CUDA nodes and float32 for CPU nodes.
+"""
+import argparse
+import os
+
+import torch
+
+from model.bundle import save_bundle
+from model.pipeline import CatVTONPipeline
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--dtype", choices=["float32", "float16", "bfloat16"], default="float16")
+    parser.add_argument("--attn-ckpt-version", choices=["mix", "vitonhd", "dresscode"], default="mix")
+    parser.add_argument(
+        "--strip-cross-attn", action="store_true", help="leave the skipped attn2 weights out"
+    )
+    args = parser.parse_args()
+
+    pipeline = CatVTONPipeline(
+        attn_ckpt_version=args.attn_ckpt_version,
+        attn_ckpt="zhengchong/CatVTON",
+        base_ckpt="booksforcharlie/stable-diffusion-inpainting",
+        weight_dtype=getattr(torch, args.dtype),
+        device="cpu",
+        skip_safety_check=True,
+        strip_cross_attn=args.strip_cross_attn,
+    )
+    save_bundle(pipeline, args.output)
+    print(f"wrote {args.output} ({os.path.getsize(args.output) / 1024 / 1024:.0f} MB)")
+    print(f"load stages (s): {pipeline.load_timings}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+import collections
+import glob
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import warnings
+from concurrent.futures import Future
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import recv_handle, send_handle
+
+from batching import MicroBatchScheduler, _Call, _resolve
+from model.cpu_backend import configure_threads
+
+
+def parse_cpulist(cpulist):
+    """Cores of a Linux cpulist such as `0-3,8-11`."""
+    cores = []
+    for part in cpulist.strip().split(","):
+        if part:
+            first, _, last = part.partition("-")
+            cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def numa_nodes():
+    """Cores of each NUMA node this process may run on (one node if the topology is unavailable)."""
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        with open(path) as f:
+            cores = [core for core in parse_cpulist(f.read()) if core in allowed]
+        if cores:
+            nodes.append(cores)
+    return nodes or [sorted(allowed)]
+
+
+def _split(cores, num_parts):
+    """`cores` in `num_parts` contiguous sets; parts share cores when there are fewer cores than parts."""
+    return [
+        cores[i * len(cores) // num_parts : (i + 1) * len(cores) // num_parts]
+        or [cores[i % len(cores)]]
+        for i in range(num_parts)
+    ]
+
+
+def parse_core_sets(spec, num_workers):
+    """
+    Core set of each of `num_workers` workers. `spec` is empty to split the
+    cores this process may run on evenly, `numa` to spread the workers over
+    the NUMA nodes (and split each node between its workers), or explicit
+    cpulists separated by `;` (e.g. `0-7;8-15`), one per worker.
+    """
+    if spec == "numa":
+        nodes = numa_nodes()
+        counts = [len(range(i, num_workers, len(nodes))) for i in range(len(nodes))]
+        per_node = [_split(cores, count) if count else [] for cores, count in zip(nodes, counts)]
+        # round robin over the nodes, so any worker count stays balanced
+        return [per_node[i % len(nodes)][i // len(nodes)] for i in range(num_workers)]
+    if spec:
+        core_sets = [parse_cpulist(cpulist) for cpulist in spec.split(";")]
+        if len(core_sets) != num_workers:
+            raise ValueError(f"{len(core_sets)} core sets given for {num_workers} workers: {spec}")
+        return core_sets
+    return _split(sorted(os.sched_getaffinity(0)), num_workers)
+
+
+def memory_usage(pid):
+    """RSS, PSS (shared pages split between their processes) and shared memory of `pid` in MB, or None."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            # skip the header line (address range), keep "Name:  123 kB" lines
+            fields = dict(line.split(":", 1) for line in f if " " not in line.split(":", 1)[0])
+    except OSError:
+        return None
+
+    def mb(*names):
+        return sum(int(fields[name].split()[0]) for name in names if name in fields) / 1024
+
+    return {
+        "rss_mb": mb("Rss"),
+        "pss_mb": mb("Pss"),
+        "shared_mb": mb("Shared_Clean", "Shared_Dirty"),
+    }
+
+
+class _Worker:
+    def __init__(self, index, cores):
+        self.index = index
+        self.cores = cores
+        self.pid = None
+        self.conn = None  # None once the worker is gone for good
+        self.generation = 0  # bumped whenever the worker exits
+        self.pending = {}  # task id -> Future
+        self.busy = False
+        self.batches = 0
+        self.requests = 0
+        self.restarts = 0
+        self.init_result = None
+
+
+class WorkerPool(MicroBatchScheduler):
+    """
+    Micro-batches requests like `MicroBatchScheduler`, but runs each batch
+    on one of several worker processes, each pinned to its own core set
+    with as many intra-op threads.
+
+    Creating the pool forks a single-threaded "zygote" process that runs
+    `load_fn` (loading the model) and then forks every worker: the workers
+    inherit the weights copy-on-write, and since inference only reads them,
+    the pages stay shared and N workers cost about one copy of the weights
+    plus N sets of activations. `load_fn` must keep torch at one thread (a
+    forked child cannot use its parent's OpenMP pool and deadlocks on it).
+    Threads do not survive a fork either, so create the pool before this
+    process starts any (in the API server: in the startup hook, before the
+    request, job and fetch pools exist); the zygote stays single-threaded,
+    so workers forked from it later are safe as well.
+
+    `wait_loaded` and `start_workers` then block until the model is loaded
+    and every worker has run `init_fn` (clients, warmup...). Whenever a
+    worker is idle, the next micro-batch goes to it. Results that are
+    futures (e.g. pending uploads) are sent back once they complete, while
+    the worker already takes the next batch. A worker that exits fails its
+    pending requests and is forked again from the zygote; once no worker
+    is left, queued and new requests fail. `exit_fn` runs in each worker at
+    shutdown. The functions passed to `submit_call` must be module-level
+    functions.
+    """
+
+    def __init__(
+        self,
+        batch_fn,
+        core_sets,
+        load_fn=None,
+        init_fn=None,
+        exit_fn=None,
+        max_batch_size=4,
+        max_wait_ms=50,
+        num_threads=None,
+    ):
+        if threading.active_count() > 1:
+            warnings.warn(
+                "WorkerPool forks from a process that already runs other threads; "
+                "locks they hold may deadlock the workers",
+                RuntimeWarning,
+            )
+        self.workers = [_Worker(index, cores) for index, cores in enumerate(core_sets)]
+        self.load_result = None
+        self._task_ids = itertools.count()
+        self._calls = collections.deque()
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._spawn_lock = threading.Lock()
+        self._readers = []
+        self._error = None
+        self._control, zygote_control = multiprocessing.Pipe()
+        self.zygote_pid = _fork(
+            _zygote_main,
+            zygote_control,
+            self._control,
+            load_fn,
+            (num_threads, batch_fn, init_fn, exit_fn),
+        )
+        zygote_control.close()
+        # the dispatcher thread starts only after the fork
+        super().__init__(batch_fn, max_batch_size, max_wait_ms)
+
+    def wait_loaded(self):
+        """Blocks until the zygote has run `load_fn`; returns its result."""
+        try:
+            status, result = self._control.recv()
+        except EOFError:
+            raise RuntimeError("Model process exited while loading") from None
+        if status != "loaded":
+            raise RuntimeError(f"Loading failed: {result}")
+        self.load_result = result
+        return result
+
+    def start_workers(self):
+        """Forks every worker and blocks until all of them have run `init_fn`."""
+        with self._spawn_lock:
+            for worker in self.workers:
+                self._fork_worker(worker)
+            for worker in self.workers:
+                self._wait_ready(worker)
+        for worker in self.workers:
+            self._idle.put((worker, worker.generation))
+            reader = threading.Thread(
+                target=self._read, args=(worker,), name=f"vton-worker-{worker.index}-reader", daemon=True
+            )
+            reader.start()
+            self._readers.append(reader)
+
+    def submit(self, item) -> Future:
+        if self._error is not None:
+            raise RuntimeError(self._error)
+        future = super().submit(item)
+        if self._error is not None and not self._worker.is_alive():
+            self._fail_queued()  # the dispatcher exited while this was being queued
+        return future
+
+    def submit_call(self, fn, **kwargs) -> Future:
+        """Runs `fn(**kwargs)` alone on the next idle worker."""
+        return self.submit(_Call(fn, kwargs))
+
+    def shutdown(self, wait=True):
+        self._stop()
+        if wait:
+            self._worker.join()
+        with self._spawn_lock:  # no restart in flight
+            for worker in self.workers:
+                if worker.conn is not None:
+                    try:
+                        worker.conn.send(None)
+                    except OSError:
+                        pass
+            try:
+                self._control.send(None)
+            except OSError:
+                pass
+        # workers flush their uploads in `exit_fn`, then close their connection
+        for reader in self._readers:
+            reader.join(timeout=30)
+        _reap(self.zygote_pid, timeout=30)
+
+    def alive(self):
+        """Number of workers still running."""
+        return sum(worker.conn is not None for worker in self.workers)
+
+    def stats(self):
+        with self._lock:
+            workers = [
+                {
+                    "pid": worker.pid,
+                    "cores": worker.cores,
+                    "alive": worker.conn is not None,
+                    "busy": worker.busy,
+                    "pending": len(worker.pending),
+                    "batches": worker.batches,
+                    "requests": worker.requests,
+                    "restarts": worker.restarts,
+                    "init": worker.init_result,
+                    "memory": memory_usage(worker.pid) if worker.pid else None,
+                }
+                for worker in self.workers
+            ]
+        return {
+            "workers": workers,
+            "queued": self._queue.qsize() + len(self._calls),
+            "error": self._error,
+            "zygote": {"pid": self.zygote_pid, "memory": memory_usage(self.zygote_pid)},
+            "supervisor_memory": memory_usage(os.getpid()),
+        }
+
+    def _stop(self, error=None):
+        self._error = error
+        self._stopped.set()
+        self._queue.put(None)
+        self._idle.put(None)
+
+    def _fork_worker(self, worker):
+        # the zygote forks the worker and hands over our end of its connection
+        self._control.send((worker.index, worker.cores))
+        try:
+            worker.pid = self._control.recv()
+            worker.conn = Connection(recv_handle(self._control))
+        except EOFError:
+            raise RuntimeError("Model process exited") from None
+
+    def _wait_ready(self, worker):
+        try:
+            status, result = worker.conn.recv()
+        except EOFError:
+            status, result = "failed", "exited"
+        if status != "ready":
+            worker.conn.close()
+            worker.conn = None
+            raise RuntimeError(f"Worker {worker.index} failed to start: {result}")
+        worker.init_result = result
+
+    def _run(self):
+        while True:
+            entry = self._idle.get()
+            if entry is None:
+                break
+            worker, generation = entry
+            if worker.generation != generation:
+                continue  # exited since it became idle
+            if self._calls:
+                entries = [self._calls.popleft()]
+            else:
+                batch = self._collect()
+                if not batch:
+                    break
+                entries = [entry for entry in batch if not isinstance(entry[0], _Call)]
+                self._calls.extend(entry for entry in batch if isinstance(entry[0], _Call))
+                if not entries:
+                    entries = [self._calls.popleft()]
+            self._dispatch(worker, entries)
+        error = RuntimeError(self._error or "WorkerPool has been shut down")
+        for item, future in self._calls:
+            future.set_exception(error)
+        self._calls.clear()
+        self._fail_queued()
+
+    def _fail_queued(self):
+        error = RuntimeError(self._error or "WorkerPool has been shut down")
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                entry[1].set_exception(error)
+
+    def _dispatch(self, worker, entries):
+        task_ids = [next(self._task_ids) for _ in entries]
+        first = entries[0][0]
+        if isinstance(first, _Call):
+            message = (task_ids, first.fn, first.kwargs, True)
+        else:
+            message = (task_ids, self.batch_fn, [item for item, _ in entries], False)
+        with self._lock:
+            worker.busy = True
+            worker.batches += 1
+            worker.requests += len(entries)
+            worker.pending.update(zip(task_ids, (future for _, future in entries)))
+        try:
+            worker.conn.send(message)
+        except OSError:
+            pass  # the worker is gone; its reader fails these and restarts it
+
+    def _read(self, worker):
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                if self._exited(worker):
+                    continue
+                break
+            if message[0] == "result":
+                _, task_id, result = message
+                with self._lock:
+                    future = worker.pending.pop(task_id)
+                _resolve(future, result)
+            else:  # idle
+                with self._lock:
+                    worker.busy = False
+                self._idle.put((worker, worker.generation))
+        if not self._stopped.is_set() and not self.alive():
+            print("All CPU workers exited, failing requests")
+            self._stop("No CPU worker left")
+
+    def _exited(self, worker):
+        """Fails the requests of a worker that exited and forks it again; returns whether it runs."""
+        with self._lock:
+            pending, worker.pending = worker.pending, {}
+            worker.generation += 1
+            worker.busy = False
+        error = RuntimeError(f"Worker {worker.index} exited")
+        for future in pending.values():
+            future.set_exception(error)
+        worker.conn.close()
+        if self._stopped.is_set():
+            worker.conn = None
+            return False
+        print(f"Worker {worker.index} (pid {worker.pid}) exited, restarting")
+        try:
+            with self._spawn_lock:
+                if self._stopped.is_set():
+                    raise RuntimeError("shutting down")
+                self._fork_worker(worker)
+                self._wait_ready(worker)
+        except Exception as e:
+            print(f"Could not restart worker {worker.index}: {e!r}")
+            worker.conn = None
+            return False
+        worker.restarts += 1
+        self._idle.put((worker, worker.generation))
+        return True
+
+
+def _fork(target, *args):
+    """Runs `target(*args)` in a forked child that exits when it returns; returns the child's pid."""
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 0
+    try:
+        target(*args)
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def _reap(pid, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                return
+        except ChildProcessError:
+            return
+        time.sleep(0.1)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+
+def _picklable(result):
+    # exceptions that do not survive a round trip (required constructor
+    # arguments...) go back as a RuntimeError with their message
+    if isinstance(result, BaseException):
+        try:
+            pickle.loads(pickle.dumps(result))
+        except Exception:
+            return RuntimeError(f"{type(result).__name__}: {result}")
+    return result
+
+
+def _zygote_main(control, supervisor_control, load_fn, worker_args):
+    supervisor_control.close()
+    # the kernel reaps exited workers
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        result = load_fn() if load_fn is not None else None
+    except Exception as e:
+        control.send(("failed", repr(e)))
+        return
+    control.send(("loaded", _picklable(result)))
+    while True:
+        try:
+            message = control.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        cores = message[1]
+        supervisor_end, worker_end = socket.socketpair()
+        pid = _fork(_worker_main, control, supervisor_end, worker_end, cores, *worker_args)
+        worker_end.close()
+        control.send(pid)
+        send_handle(control, supervisor_end.fileno(), os.getppid())
+        supervisor_end.close()
+
+
+def _worker_main(control, supervisor_end, worker_end, cores, num_threads, batch_fn, init_fn, exit_fn):
+    # only the zygote talks to the supervisor over `control`
+    control.close()
+    supervisor_end.close()
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    conn = Connection(worker_end.detach())
+    os.sched_setaffinity(0, cores)
+    configure_threads(num_threads or len(cores))
+    try:
+        init_result = init_fn() if init_fn is not None else None
+    except Exception as e:
+        conn.send(("failed", repr(e)))
+        return
+    conn.send(("ready", _picklable(init_result)))
+    send_lock = threading.Lock()
+
+    def send_result(task_id, result):
+        with send_lock:
+            conn.send(("result", task_id, _picklable(result)))
+
+    def on_done(task_id, future):
+        error = future.exception()
+        send_result(task_id, error if error is not None else future.result())
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        task_ids, fn, payload, is_call = message
+        try:
+            results = [fn(**payload)] if is_call else fn(payload)
+        except Exception as e:
+            results = [e] * len(task_ids)
+        for task_id, result in zip(task_ids, results):
+            if isinstance(result, Future):
+                result.add_done_callback(lambda future, task_id=task_id: on_done(task_id, future))
+            else:
+                send_result(task_id, result)
+        with send_lock:
+            conn.send(("idle",))
+    if exit_fn is not None:
+        exit_fn()
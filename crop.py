@@ -0,0 +1,59 @@
+import math
+
+from PIL import ImageFilter
+
+from utils import repaint_result
+
+
+def mask_crop_box(mask, margin=4, multiple=8, scale=8, max_area_fraction=0.8):
+    """
+    Crop box around a `(H, W)` mask tensor, in pixels, for cropped inference.
+
+    The mask's bounding box is taken at latent resolution (`scale` pixels per
+    latent cell), padded by `margin` cells, widened to the aspect ratio of the
+    frame and rounded up to `multiple` cells so the UNet can downsample it.
+    Returns None when the mask is empty or the box would cover more than
+    `max_area_fraction` of the frame, i.e. when cropping is not worth it.
+    """
+    height, width = mask.shape[-2] // scale, mask.shape[-1] // scale
+    cells = mask[: height * scale, : width * scale].reshape(height, scale, width, scale)
+    cells = cells.amax(dim=(1, 3)) > 0.5
+    ys, xs = cells.any(dim=1).nonzero(), cells.any(dim=0).nonzero()
+    if len(ys) == 0:
+        return None
+    top, bottom = max(ys.min().item() - margin, 0), min(ys.max().item() + 1 + margin, height)
+    left, right = max(xs.min().item() - margin, 0), min(xs.max().item() + 1 + margin, width)
+
+    # keep the aspect ratio of the frame (the model was trained on it)
+    box_w, box_h = right - left, bottom - top
+    if box_w * height < box_h * width:
+        box_w = math.ceil(box_h * width / height)
+    else:
+        box_h = math.ceil(box_w * height / width)
+    box_w = min(math.ceil(box_w / multiple) * multiple, width)
+    box_h = min(math.ceil(box_h / multiple) * multiple, height)
+    if box_w * box_h > max_area_fraction * width * height:
+        return None
+
+    # grow around the center of the mask, shifted back inside the frame
+    left = min(max((left + right - box_w) // 2, 0), width - box_w)
+    top = min(max((top + bottom - box_h) // 2, 0), height - box_h)
+    return (
+        left * scale,
+        top * scale,
+        (left + box_w) * scale,
+        (top + box_h) * scale,
+    )
+
+
+def paste_crop(result, person_image, mask_image, box, feather=8):
+    """
+    Pastes the result of cropped inference back into the full person image.
+    Only the masked area is taken from `result`, with its edge softened by a
+    `feather` pixel blur; the rest is the original person.
+    """
+    full_result = person_image.copy()
+    full_result.paste(result, box[:2])
+    if feather:
+        mask_image = mask_image.filter(ImageFilter.GaussianBlur(feather))
+    return repaint_result(full_result, person_image, mask_image)
@@ -0,0 +1,56 @@
+"""
+Exports the CatVTON UNet and VAE as shape-specialized graphs for
+`EXPORTED_GRAPHS_DIR`, checking each one against the eager modules.
+
+    python export_graphs.py --output graphs/ --batch-sizes 1 2 4
+    python export_graphs.py --output graphs-pt2/ --format torch --device cuda --dtype float16
+
+Export in the device and dtype the server runs with (`DEVICE`, float16 on
+CUDA, float32 on CPU), for every batch size it serves (up to
+`MAX_BATCH_SIZE`); other shapes fall back to the eager modules.
+"""
+import argparse
+
+import torch
+
+from model.exported import EXPORT_FORMATS, export_pipeline
+from model.pipeline import CatVTONPipeline
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="onnx")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1])
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", choices=["float32", "float16", "bfloat16"], default="float32")
+    parser.add_argument("--rtol", type=float, default=None, help="max error relative to the eager output range")
+    args = parser.parse_args()
+    if args.format == "onnx" and args.dtype == "bfloat16":
+        # ONNX Runtime is fed through numpy, which has no bfloat16
+        parser.error("--dtype bfloat16 needs --format torch")
+
+    pipeline = CatVTONPipeline(
+        attn_ckpt_version="mix",
+        attn_ckpt="zhengchong/CatVTON",
+        base_ckpt="booksforcharlie/stable-diffusion-inpainting",
+        weight_dtype=getattr(torch, args.dtype),
+        device=args.device,
+        skip_safety_check=True,
+    )
+    manifest = export_pipeline(
+        pipeline,
+        args.output,
+        batch_sizes=args.batch_sizes,
+        height=args.height,
+        width=args.width,
+        format=args.format,
+        rtol=args.rtol,
+    )
+    print(f"exported {len(manifest['graphs'])} graphs to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
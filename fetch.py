@@ -0,0 +1,111 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import ImageFile
+from requests.adapters import HTTPAdapter
+
+
+class FetchError(Exception):
+    pass
+
+
+class ImageFetcher:
+    """
+    Downloads input images concurrently over a pooled keep-alive session.
+
+    Every download is bounded by `timeout` (connect, read) seconds and
+    `max_bytes`, and is decoded incrementally while the body streams in.
+    """
+
+    def __init__(
+        self,
+        max_workers=8,
+        timeout=(3.05, 10),
+        max_bytes=20 * 1024 * 1024,
+        chunk_size=64 * 1024,
+    ):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="vton-fetch"
+        )
+
+    def fetch_image(self, url):
+        """
+        Returns `(image, timing)` where `timing` holds the byte count, time to
+        first byte and total time in milliseconds for `url`. The SHA-256 of
+        the downloaded bytes and the response ETag are stored in `image.info`.
+        """
+        start = time.perf_counter()
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    raise FetchError(f"GET {url} returned {response.status_code}")
+                try:
+                    content_length = int(response.headers.get("Content-Length"))
+                except (TypeError, ValueError):
+                    # missing or malformed: the streamed byte count is checked below
+                    content_length = None
+                if content_length is not None and content_length > self.max_bytes:
+                    raise FetchError(
+                        f"GET {url} is {content_length} bytes, limit is {self.max_bytes}"
+                    )
+                parser = ImageFile.Parser()
+                digest = hashlib.sha256()
+                num_bytes = 0
+                first_byte = None
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if first_byte is None:
+                        first_byte = time.perf_counter()
+                    num_bytes += len(chunk)
+                    if num_bytes > self.max_bytes:
+                        raise FetchError(
+                            f"GET {url} exceeded the limit of {self.max_bytes} bytes"
+                        )
+                    digest.update(chunk)
+                    parser.feed(chunk)
+                image = parser.close()
+                image.info["sha256"] = digest.hexdigest()
+                image.info["etag"] = response.headers.get("ETag")
+        except requests.RequestException as e:
+            raise FetchError(f"GET {url} failed: {e}") from e
+        except OSError as e:
+            raise FetchError(f"Cannot decode image from {url}: {e}") from e
+        end = time.perf_counter()
+        timing = {
+            "url": url,
+            "bytes": num_bytes,
+            "ttfb_ms": ((first_byte or end) - start) * 1000,
+            "total_ms": (end - start) * 1000,
+        }
+        return image, timing
+
+    def fetch_images(self, urls, return_exceptions=False):
+        """
+        Downloads all `urls` at once. Returns `(images, timings)` in the order
+        of `urls`. With `return_exceptions=True`, a failed download yields its
+        `FetchError` in place of the image instead of raising.
+        """
+        futures = [self._executor.submit(self.fetch_image, url) for url in urls]
+        images, timings = [], []
+        for future in futures:
+            try:
+                image, timing = future.result()
+            except FetchError as e:
+                if not return_exceptions:
+                    raise
+                image, timing = e, None
+            images.append(image)
+            timings.append(timing)
+        return images, timings
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
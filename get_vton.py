@@ -1,13 +1,25 @@
-from io import BytesIO
-import json
+import time
+
+# import 시간 측정 시작 (torch/diffusers import 포함)
+IMPORT_START = time.perf_counter()
+
+import atexit
 import os
-import requests
+import threading
+from concurrent.futures import Future
 import torch
-from diffusers.image_processor import VaeImageProcessor
 from PIL import Image
+from crop import mask_crop_box, paste_crop
+from fetch import ImageFetcher
+from latent_cache import TensorLRUCache, content_key
 from model.pipeline import CatVTONPipeline
-from utils import resize_and_crop, resize_and_padding
+from model.utils import timed, timed_stage
+from preprocess import Preprocessor
+from output_stage import OutputStage
+from sqs_notifier import SQSNotifier
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,139 +30,664 @@ print("is cuda? : ", torch.cuda.is_available())
 AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
 NUM_STEP = int(os.environ.get("NUM_STEP", 15))
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 4))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MAX_BATCH_WAIT_MS", 50))
+FETCH_TIMEOUT = float(os.environ.get("FETCH_TIMEOUT", 10))
+FETCH_MAX_BYTES = int(os.environ.get("FETCH_MAX_BYTES", 20 * 1024 * 1024))
+# latent 캐시 예산: GPU에서는 디바이스/호스트 메모리를 각각 사용, CPU에서는 호스트 예산만 사용 (CPU_WORKERS면 워커마다 따로)
+GARMENT_CACHE_DEVICE_MB = int(os.environ.get("GARMENT_CACHE_DEVICE_MB", 512))
+GARMENT_CACHE_HOST_MB = int(os.environ.get("GARMENT_CACHE_HOST_MB", 2048))
+PERSON_CACHE_DEVICE_MB = int(os.environ.get("PERSON_CACHE_DEVICE_MB", 256))
+PERSON_CACHE_HOST_MB = int(os.environ.get("PERSON_CACHE_HOST_MB", 1024))
+PERSON_CACHE_TTL = float(os.environ.get("PERSON_CACHE_TTL", 1800))
+# 로컬 결과 저장 여부 (컨테이너에서는 0 권장), 업로드 워커 수와 대기열 크기
+SAVE_LOCAL_OUTPUT = os.environ.get("SAVE_LOCAL_OUTPUT", "1") == "1"
+OUTPUT_WORKERS = int(os.environ.get("OUTPUT_WORKERS", 8))
+OUTPUT_QUEUE_SIZE = int(os.environ.get("OUTPUT_QUEUE_SIZE", 64))
+# SQS 알림 배치 크기(최대 10)와 최대 대기 시간
+SQS_BATCH_SIZE = int(os.environ.get("SQS_BATCH_SIZE", 10))
+SQS_BATCH_WAIT_MS = float(os.environ.get("SQS_BATCH_WAIT_MS", 100))
+# 로컬 S3 대체 서버(minio, moto 등) 테스트용
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+# "micro": 배치 단위 스케줄링, "continuous": 타임스텝 단위 스케줄링
+BATCHING_MODE = os.environ.get("BATCHING_MODE", "micro")
+# CFG를 적용할 디노이징 구간 (전체 스텝 대비 "시작,끝" 비율), 나머지 스텝은 조건부 UNet만 실행
+GUIDANCE_INTERVAL = tuple(
+    float(x) for x in os.environ.get("GUIDANCE_INTERVAL", "0.0,1.0").split(",")
+)
+# 마스크 영역만 잘라서 추론한 뒤 원본 사용자 이미지에 합성 (상의/하의처럼 일부만 바뀌는 경우)
+CROP_INFERENCE = os.environ.get("CROP_INFERENCE", "0") == "1"
+CROP_MARGIN = int(os.environ.get("CROP_MARGIN", 4))  # latent 칸 단위 (1칸 = 8px)
+# UNet 깊은 층 특징을 몇 스텝마다 다시 계산할지 (1이면 끔), 매 스텝 다시 계산하는 바깥 층 수
+DEEP_CACHE_INTERVAL = int(os.environ.get("DEEP_CACHE_INTERVAL", 1))
+DEEP_CACHE_DEPTH = int(os.environ.get("DEEP_CACHE_DEPTH", 1))
+# 기본 샘플러 (ddim, dpmsolver++, unipc, euler), 요청별로 sampler/num_inference_steps 지정 가능
+SAMPLER = os.environ.get("SAMPLER", "ddim")
+MAX_INFERENCE_STEPS = int(os.environ.get("MAX_INFERENCE_STEPS", 50))
+# VAE 인코딩/디코딩 활성화 메모리 상한 (MB, 0이면 제한 없음), 넘으면 샘플별 → 타일 단위로 실행
+VAE_MEMORY_BUDGET_MB = int(os.environ.get("VAE_MEMORY_BUDGET_MB", 0))
+VAE_TILE_SIZE = int(os.environ.get("VAE_TILE_SIZE", 512))  # 픽셀 단위
+# 쓰지 않는 cross-attention(attn2) 가중치를 UNet에서 제거 (결과 동일, 메모리 절약)
+STRIP_CROSS_ATTN = os.environ.get("STRIP_CROSS_ATTN", "0") == "1"
+# self-attention 구현 (sdpa, chunked, xformers), sdpa 커널 제한 (예: "flash,efficient")
+ATTN_BACKEND = os.environ.get("ATTN_BACKEND", "sdpa")
+ATTN_SDPA_KERNELS = [k for k in os.environ.get("ATTN_SDPA_KERNELS", "").split(",") if k]
+# chunked: 한 번에 처리할 query 토큰 수, batch x head 수 (0이면 전체)
+ATTN_CHUNK_SIZE = int(os.environ.get("ATTN_CHUNK_SIZE", 1024))
+ATTN_SLICE_SIZE = int(os.environ.get("ATTN_SLICE_SIZE", 0))
+# self-attention 토큰 병합 비율 (UNet 해상도 단계별, 예: "0.5,0.25", 비우면 끔), 의상/배경 우선 병합 가중치
+TOKEN_MERGE_RATIOS = [float(x) for x in os.environ.get("TOKEN_MERGE_RATIOS", "").split(",") if x]
+TOKEN_MERGE_PRIORITY = float(os.environ.get("TOKEN_MERGE_PRIORITY", 1.0))
+# 초반 스텝을 낮은 latent 해상도로 실행할 배율 (예: 0.5, 0이면 끔), 전체 스텝 중 저해상도 구간 비율
+COARSE_SCALE = float(os.environ.get("COARSE_SCALE", 0))
+COARSE_UNTIL = float(os.environ.get("COARSE_UNTIL", 0.5))
+# 추론 장치 (cuda, cpu), cpu는 float32 가중치에 아래 CPU 설정을 적용
+DEVICE = os.environ.get("DEVICE", "cuda")
+# CPU UNet 양자화 (dynamic, weight_only, none), bf16 autocast (auto, on, off), intra-op 스레드 수 (0이면 torch 기본값)
+CPU_QUANTIZATION = os.environ.get("CPU_QUANTIZATION", "dynamic")
+CPU_BF16 = os.environ.get("CPU_BF16", "auto")
+CPU_THREADS = int(os.environ.get("CPU_THREADS", 0))
+# export_graphs.py로 내보낸 UNet/VAE 그래프 디렉터리 (비우면 eager 모듈 사용)
+EXPORTED_GRAPHS_DIR = os.environ.get("EXPORTED_GRAPHS_DIR", "")
+# build_bundle.py로 만든 safetensors 번들 경로 (비우면 Hugging Face 체크포인트를 받아서 병합)
+MODEL_BUNDLE = os.environ.get("MODEL_BUNDLE", "")
+# 시작 시 미리 실행할 배치 크기 목록 (기본 1..MAX_BATCH_SIZE, 비우면 웜업 생략)과 웜업 스텝 수
+WARMUP_BATCH_SIZES = [
+    int(x)
+    for x in os.environ.get(
+        "WARMUP_BATCH_SIZES", ",".join(str(i) for i in range(1, MAX_BATCH_SIZE + 1))
+    ).split(",")
+    if x
+]
+WARMUP_STEPS = int(os.environ.get("WARMUP_STEPS", 2))
+# CPU 추론 워커 프로세스 수 (0이면 API 프로세스에서 직접 추론), 가중치는 한 번 로드해서 fork로 공유
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", 0))
+# 워커별 코어 (비우면 균등 분할, "numa"면 NUMA 노드별, 직접 지정은 "0-7;8-15"), 워커 스레드 수는 CPU_THREADS (0이면 코어 수)
+CPU_WORKER_CORES = os.environ.get("CPU_WORKER_CORES", "")
 QUEUE_URL = "https://sqs.ap-northeast-2.amazonaws.com/565393031158/omoib-vton-queue"
+BUCKET_NAME = "githubsalt-bucket"
+OUTPUT_DIR = "./vton_output"
 
 print(f"NUM_STEP should be : {NUM_STEP}")
-
-s3 = boto3.client(
-    "s3",
-    region_name="ap-northeast-2",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-)
-
-sqs = boto3.client(
-    "sqs",
-    region_name="ap-northeast-2",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-)
-
+print(f"MAX_BATCH_SIZE : {MAX_BATCH_SIZE}, MAX_BATCH_WAIT_MS : {MAX_BATCH_WAIT_MS}")
+print(f"BATCHING_MODE : {BATCHING_MODE}")
+print(f"GUIDANCE_INTERVAL : {GUIDANCE_INTERVAL}")
+print(f"CROP_INFERENCE : {CROP_INFERENCE}, CROP_MARGIN : {CROP_MARGIN}")
+print(f"DEEP_CACHE_INTERVAL : {DEEP_CACHE_INTERVAL}, DEEP_CACHE_DEPTH : {DEEP_CACHE_DEPTH}")
+print(f"SAMPLER : {SAMPLER}, MAX_INFERENCE_STEPS : {MAX_INFERENCE_STEPS}")
+print(f"VAE_MEMORY_BUDGET_MB : {VAE_MEMORY_BUDGET_MB}, VAE_TILE_SIZE : {VAE_TILE_SIZE}")
+print(f"STRIP_CROSS_ATTN : {STRIP_CROSS_ATTN}")
+print(f"ATTN_BACKEND : {ATTN_BACKEND}, ATTN_SDPA_KERNELS : {ATTN_SDPA_KERNELS}")
+print(f"TOKEN_MERGE_RATIOS : {TOKEN_MERGE_RATIOS}, TOKEN_MERGE_PRIORITY : {TOKEN_MERGE_PRIORITY}")
+print(f"COARSE_SCALE : {COARSE_SCALE}, COARSE_UNTIL : {COARSE_UNTIL}")
+print(f"DEVICE : {DEVICE}, CPU_QUANTIZATION : {CPU_QUANTIZATION}, CPU_BF16 : {CPU_BF16}, CPU_THREADS : {CPU_THREADS}")
+print(f"EXPORTED_GRAPHS_DIR : {EXPORTED_GRAPHS_DIR}")
+print(f"MODEL_BUNDLE : {MODEL_BUNDLE}")
+print(f"WARMUP_BATCH_SIZES : {WARMUP_BATCH_SIZES}, WARMUP_STEPS : {WARMUP_STEPS}")
+print(f"CPU_WORKERS : {CPU_WORKERS}, CPU_WORKER_CORES : {CPU_WORKER_CORES}")
 
 SEED = 42
 NUM_INFERENCE_STEPS = NUM_STEP
 WIDTH = 768
 HEIGHT = 1024
 
-pipeline = CatVTONPipeline(
-    attn_ckpt_version="mix",
-    attn_ckpt="zhengchong/CatVTON",
-    base_ckpt="booksforcharlie/stable-diffusion-inpainting",
-    weight_dtype=torch.float16,
-    device="cuda",
-    skip_safety_check=True,
-)
+# 이미지 -> 텐서 전처리 (리사이즈 1회, 미리 할당한 버퍼에 바로 정규화)
+preprocessor = Preprocessor(WIDTH, HEIGHT)
 
 
-def concat_upper_and_lower(image1, image2):
-    # 두 이미지의 너비를 맞추고, 높이를 합산
-    new_width = max(image1.width, image2.width)
-    new_height = image1.height + image2.height
+WEIGHT_DTYPE = torch.float16 if DEVICE == "cuda" else torch.float32
 
-    # 새 이미지를 만들고, 이미지1과 이미지2를 붙이기
-    new_image = Image.new("RGB", (new_width, new_height))
-    new_image.paste(image1, (0, 0))
-    new_image.paste(image2, (0, image1.height))
+# AWS 클라이언트, 업로드/알림 스테이지, 파이프라인과 캐시는 load()에서 생성 (import만으로는 만들지 않음)
+s3 = sqs = notifier = output_stage = fetcher = None
+pipeline = garment_cache = person_cache = None
+CROP_MULTIPLE = None
 
-    return new_image
+# 시작 단계 (not_started → loading → warming_up → ready, 실패 시 failed), /ping과 /metrics에 노출
+startup = {"phase": "not_started", "error": None}
+# 콜드 스타트 단계별 소요 시간 (초), /metrics의 cold_start로 노출
+cold_start = {}
 
 
-def preprocess_images(
+def load():
+    """
+    Creates the AWS clients, the output and notification stages, the
+    pipeline and the latent caches. Importing this module does none of it,
+    so the API server can answer `/ping` while this runs. With
+    `CPU_WORKERS`, this runs in the worker pool's single-threaded zygote
+    process and the clients are left to each worker (`init_worker`).
+    Returns the cold start times so far.
+    """
+    startup["phase"] = "loading"
+    if not CPU_WORKERS:
+        load_clients()
+    load_pipeline()
+    return dict(cold_start)
+
+
+def load_clients(s3_client=None, sqs_client=None):
+    """
+    AWS clients, upload/notification stages and the image fetcher; they run
+    threads, so one set per process. `s3_client`/`sqs_client` replace the
+    boto3 clients (the benchmarks pass in-memory stand-ins).
+    """
+    global s3, sqs, notifier, output_stage, fetcher
+
+    s3 = s3_client or boto3.client(
+        "s3",
+        region_name="ap-northeast-2",
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        endpoint_url=S3_ENDPOINT_URL,
+        config=Config(
+            max_pool_connections=OUTPUT_WORKERS,
+            retries={"max_attempts": 3, "mode": "standard"},
+        ),
+    )
+
+    sqs = sqs_client or boto3.client(
+        "sqs",
+        region_name="ap-northeast-2",
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+    )
+
+    # SQS 완료 알림 (send_message_batch로 모아서 전송, 종료 시 남은 메시지 전송)
+    notifier = SQSNotifier(
+        sqs,
+        QUEUE_URL,
+        max_batch_size=SQS_BATCH_SIZE,
+        max_wait_ms=SQS_BATCH_WAIT_MS,
+    )
+    atexit.register(notifier.shutdown)
+
+    # 결과 업로드 스테이지 (JPEG 인코딩 1회, 업로드/재시도는 별도 워커에서)
+    output_stage = OutputStage(
+        s3,
+        BUCKET_NAME,
+        num_workers=OUTPUT_WORKERS,
+        max_queue_size=OUTPUT_QUEUE_SIZE,
+        # 결과 이미지는 수백 KB 수준이라 멀티파트/스레드 없이 단일 PUT으로 업로드
+        transfer_config=TransferConfig(
+            multipart_threshold=64 * 1024 * 1024, use_threads=False
+        ),
+    )
+
+    # 입력 이미지 다운로드용 커넥션 풀 (요청 4장 x 최대 배치 크기를 동시에 받음)
+    fetcher = ImageFetcher(
+        max_workers=4 * MAX_BATCH_SIZE,
+        timeout=(3.05, FETCH_TIMEOUT),
+        max_bytes=FETCH_MAX_BYTES,
+    )
+
+
+def load_pipeline():
+    """The pipeline, set up from the environment, and the latent caches."""
+    global pipeline
+
+    if CPU_WORKERS:
+        # 워커를 fork하기 전까지 OpenMP 스레드를 만들지 않도록 1스레드로 로드
+        torch.set_num_threads(1)
+    with timed(cold_start, "load"):
+        if MODEL_BUNDLE:
+            pipeline = CatVTONPipeline.from_bundle(
+                MODEL_BUNDLE,
+                device=DEVICE,
+                weight_dtype=WEIGHT_DTYPE,
+                strip_cross_attn=STRIP_CROSS_ATTN,
+            )
+        else:
+            pipeline = CatVTONPipeline(
+                attn_ckpt_version="mix",
+                attn_ckpt="zhengchong/CatVTON",
+                base_ckpt="booksforcharlie/stable-diffusion-inpainting",
+                weight_dtype=WEIGHT_DTYPE,
+                device=DEVICE,
+                skip_safety_check=True,
+                strip_cross_attn=STRIP_CROSS_ATTN,
+            )
+    with timed(cold_start, "setup"):
+        pipeline.set_attn_backend(
+            ATTN_BACKEND,
+            sdpa_kernels=ATTN_SDPA_KERNELS or None,
+            chunk_size=ATTN_CHUNK_SIZE,
+            slice_size=ATTN_SLICE_SIZE or None,
+        )
+        pipeline.enable_deep_cache(DEEP_CACHE_INTERVAL, DEEP_CACHE_DEPTH)
+        pipeline.enable_token_merging(TOKEN_MERGE_RATIOS, TOKEN_MERGE_PRIORITY)
+        pipeline.enable_vae_memory_budget(VAE_MEMORY_BUDGET_MB, VAE_TILE_SIZE)
+        if DEVICE == "cpu":
+            pipeline.enable_cpu_backend(
+                CPU_QUANTIZATION,
+                bf16={"auto": None, "on": True, "off": False}[CPU_BF16],
+                num_threads=1 if CPU_WORKERS else CPU_THREADS or None,
+            )
+        if EXPORTED_GRAPHS_DIR and not CPU_WORKERS:
+            pipeline.use_exported(EXPORTED_GRAPHS_DIR, num_threads=CPU_THREADS or None)
+        # 잘못된 SAMPLER 이름이면 시작할 때 바로 실패
+        pipeline.create_scheduler(SAMPLER)
+    cold_start["load_stages"] = pipeline.load_timings
+    load_caches()
+
+
+def load_caches():
+    """The latent caches and crop settings for the loaded `pipeline`."""
+    global garment_cache, person_cache, CROP_MULTIPLE
+
+    # 의류 condition latent 캐시 (의류 이미지 바이트 해시 기준)
+    garment_cache = TensorLRUCache(
+        device=pipeline.device,
+        device_budget_bytes=GARMENT_CACHE_DEVICE_MB * 1024 * 1024,
+        host_budget_bytes=GARMENT_CACHE_HOST_MB * 1024 * 1024,
+    )
+
+    # 사용자 이미지 + 마스크의 (masked_latent, mask_latent) 캐시 (TTL 적용)
+    person_cache = TensorLRUCache(
+        device=pipeline.device,
+        device_budget_bytes=PERSON_CACHE_DEVICE_MB * 1024 * 1024,
+        host_budget_bytes=PERSON_CACHE_HOST_MB * 1024 * 1024,
+        ttl_seconds=PERSON_CACHE_TTL,
+    )
+
+    # 잘라낸 영역의 latent 크기는 UNet 다운샘플링 배수여야 함
+    CROP_MULTIPLE = 2 ** (len(pipeline.unet.config.block_out_channels) - 1)
+
+
+def warmup():
+    """
+    Runs each of `WARMUP_BATCH_SIZES` once through preprocessing, VAE
+    encode, `WARMUP_STEPS` denoising steps with the server's default
+    settings and decode, so the first requests after startup do not pay
+    for allocator growth, kernel autotuning or lazy compilation. Marks
+    the server ready when done.
+    """
+    startup["phase"] = "warming_up"
+    cold_start["warmup_batches"] = {}
+    person = Image.new("RGB", (WIDTH, HEIGHT), (128, 128, 128))
+    mask = Image.new("L", (WIDTH, HEIGHT), 255)
+    cloth = Image.new("RGB", (WIDTH, HEIGHT // 2), (128, 128, 128))
+    settings = denoise_settings(WARMUP_STEPS)
+    with timed(cold_start, "warmup"), torch.no_grad():
+        for batch_size in WARMUP_BATCH_SIZES:
+            with timed(cold_start["warmup_batches"], batch_size):
+                masked_latent, mask_latent = pipeline.encode_person(
+                    preprocessor.person_batch([person] * batch_size),
+                    preprocessor.mask_batch([mask] * batch_size),
+                )
+                condition_latent = pipeline.encode_condition(
+                    preprocessor.cloth_batch([(cloth, cloth)] * batch_size)
+                )
+                pipeline(
+                    image=None,
+                    condition_image=None,
+                    mask=None,
+                    height=HEIGHT,
+                    width=WIDTH,
+                    generator=[
+                        torch.Generator(device=DEVICE).manual_seed(SEED)
+                        for _ in range(batch_size)
+                    ],
+                    condition_latent=condition_latent,
+                    masked_latent=masked_latent,
+                    mask_latent=mask_latent,
+                    **settings,
+                )
+    startup["phase"] = "ready"
+    print(f"ready, cold start (s) : {cold_start}")
+
+
+def init_worker():
+    """
+    Per-process setup of a `CPU_WORKERS` worker, after the fork: clients,
+    exported graphs (ONNX Runtime sessions do not survive a fork) and
+    warmup. Returns this worker's cold start times.
+    """
+    load_clients()
+    if EXPORTED_GRAPHS_DIR:
+        with timed(cold_start, "exported"):
+            pipeline.use_exported(EXPORTED_GRAPHS_DIR, num_threads=torch.get_num_threads())
+    warmup()
+    return dict(cold_start)
+
+
+def close_clients():
+    """Flushes pending uploads and notifications (`CPU_WORKERS` workers skip atexit)."""
+    output_stage.shutdown()
+    notifier.shutdown()
+
+
+def log_fetch_timings(timings):
+    for timing in timings:
+        if timing is not None:
+            print(
+                f"fetched {timing['url']} ({timing['bytes']} bytes) "
+                f"ttfb {timing['ttfb_ms']:.1f}ms total {timing['total_ms']:.1f}ms"
+            )
+
+
+def fetch_input_images(vton_requests):
+    """
+    Downloads the person, upper, lower and mask images of every request at
+    once. Returns one `(person, upper, lower, mask)` tuple per request, or the
+    `FetchError` that failed that request.
+    """
+    urls = []
+    for request in vton_requests:
+        urls += [
+            request["person_image_url"],
+            request["upper_cloth_url"],
+            request["lower_cloth_url"],
+            request["mask_image_url"],
+        ]
+    with timed_stage("fetch", items=len(vton_requests)):
+        images, timings = fetcher.fetch_images(urls, return_exceptions=True)
+    log_fetch_timings(timings)
+
+    results = []
+    for i in range(len(vton_requests)):
+        request_images = tuple(images[4 * i : 4 * i + 4])
+        errors = [image for image in request_images if isinstance(image, Exception)]
+        results.append(errors[0] if errors else request_images)
+    return results
+
+
+def preprocess_person_and_mask(person_image, mask_image):
+    return preprocessor.person(person_image), preprocessor.mask(mask_image)
+
+
+def preprocess_cloth(upper_cloth_image, lower_cloth_image):
+    return preprocessor.cloth(upper_cloth_image, lower_cloth_image)
+
+
+def preprocess_fetched_images(
+        person_image,
+        upper_cloth_image,
+        lower_cloth_image,
+        mask_image,
+    ):
+    preprocessed_person_image, preprocessed_mask_image = preprocess_person_and_mask(
+        person_image, mask_image
+    )
+    preprocessed_cloth_image = preprocess_cloth(upper_cloth_image, lower_cloth_image)
+
+    return preprocessed_person_image, preprocessed_cloth_image, preprocessed_mask_image
+
+
+def lookup_or_encode(cache, keys, encode_fn):
+    """
+    Looks up `keys` in `cache` and calls `encode_fn(indices)` once for the
+    distinct missing keys, where `indices` point at the first request with
+    each key. `encode_fn` returns one cache entry per index.
+    """
+    entries = {}
+    for key in keys:
+        if key not in entries:
+            entries[key] = cache.get(key)
+
+    missing = [key for key, entry in entries.items() if entry is None]
+    if missing:
+        encoded = encode_fn([keys.index(key) for key in missing])
+        for key, entry in zip(missing, encoded):
+            cache.put(key, entry)
+            entries[key] = entry
+
+    return [entries[key] for key in keys]
+
+
+def get_person_latents(person_images):
+    """
+    Returns `(masked_latent, mask_latent)` for a list of `(person, mask)`
+    image pairs, each as one batch. Pairs already in `person_cache` skip
+    preprocessing and VAE encoding; the misses are encoded together.
+    """
+    def encode(indices):
+        with timed_stage("preprocess", items=len(indices)):
+            person = preprocessor.person_batch([person_images[i][0] for i in indices])
+            mask = preprocessor.mask_batch([person_images[i][1] for i in indices])
+        masked_latent, mask_latent = pipeline.encode_person(person, mask)
+        return list(zip(masked_latent.split(1), mask_latent.split(1)))
+
+    keys = [
+        content_key(person, mask, extra=f"{WIDTH}x{HEIGHT}")
+        for person, mask in person_images
+    ]
+    latents = lookup_or_encode(person_cache, keys, encode)
+
+    return (
+        torch.cat([masked_latent for masked_latent, _ in latents]),
+        torch.cat([mask_latent for _, mask_latent in latents]),
+    )
+
+
+def get_condition_latents(cloth_images):
+    """
+    Returns the condition latents for a list of `(upper, lower)` garment image
+    pairs as one batch. Garments already in `garment_cache` skip
+    preprocessing and VAE encoding; the misses are encoded together.
+    """
+    def encode(indices):
+        with timed_stage("preprocess", items=len(indices)):
+            cloth = preprocessor.cloth_batch([cloth_images[i] for i in indices])
+        return pipeline.encode_condition(cloth).split(1)
+
+    keys = [
+        content_key(upper, lower, extra=f"{WIDTH}x{HEIGHT}")
+        for upper, lower in cloth_images
+    ]
+    return torch.cat(lookup_or_encode(garment_cache, keys, encode))
+
+
+def get_crop_inputs(person_images, cloth_images):
+    """
+    Cropped-inference counterpart of `get_person_latents` and
+    `get_condition_latents`. Finds the crop box of each request's mask and
+    returns `(boxes, person_latents, condition_latents)`, one entry per
+    request: the person latents cover only the crop and the garment is
+    encoded at the crop size. A box is None when the request runs on the
+    full frame.
+    """
+    masks = [preprocessor.mask(mask) for _, mask in person_images]
+    boxes = [
+        mask_crop_box(mask[0], margin=CROP_MARGIN, multiple=CROP_MULTIPLE)
+        for mask in masks
+    ]
+    crops = [box or (0, 0, WIDTH, HEIGHT) for box in boxes]
+
+    def encode_person(indices):
+        latents = []
+        for i in indices:
+            left, top, right, bottom = crops[i]
+            latents.append(
+                pipeline.encode_person(
+                    preprocessor.person(person_images[i][0])[:, top:bottom, left:right],
+                    masks[i][:, top:bottom, left:right],
+                )
+            )
+        return latents
+
+    def encode_condition(indices):
+        latents = []
+        for i in indices:
+            left, top, right, bottom = crops[i]
+            crop_preprocessor = Preprocessor(right - left, bottom - top)
+            latents.append(
+                pipeline.encode_condition(crop_preprocessor.cloth_batch([cloth_images[i]]))
+            )
+        return latents
+
+    # 잘라내지 않은 요청은 전체 프레임 캐시 항목을 그대로 공유
+    person_keys = [
+        content_key(
+            person, mask, extra=f"{WIDTH}x{HEIGHT}" + ("" if box is None else f":{box}")
+        )
+        for (person, mask), box in zip(person_images, boxes)
+    ]
+    cloth_keys = [
+        content_key(upper, lower, extra=f"{right - left}x{bottom - top}")
+        for (upper, lower), (left, top, right, bottom) in zip(cloth_images, crops)
+    ]
+    return (
+        boxes,
+        lookup_or_encode(person_cache, person_keys, encode_person),
+        lookup_or_encode(garment_cache, cloth_keys, encode_condition),
+    )
+
+
+def paste_crop_results(results, person_images, boxes):
+    return [
+        result
+        if box is None
+        else paste_crop(
+            result, preprocessor.resize_person(person), preprocessor.resize_mask(mask), box
+        )
+        for result, (person, mask), box in zip(results, person_images, boxes)
+    ]
+
+
+def denoise_settings(num_inference_steps=None, sampler=None, guidance_interval=None):
+    """Per-request denoising settings, falling back to the server defaults."""
+    return dict(
+        num_inference_steps=num_inference_steps or NUM_INFERENCE_STEPS,
+        sampler=sampler or SAMPLER,
+        guidance_interval=guidance_interval or GUIDANCE_INTERVAL,
+        coarse_scale=COARSE_SCALE or None,
+        coarse_until=COARSE_UNTIL,
+    )
+
+
+def run_cropped(person_images, cloth_images, generators, settings):
+    """
+    Cropped inference for a batch of requests: each one denoises only the
+    crop around its mask, and the result is pasted back into its person
+    image. Crops of the same size share UNet passes. `settings` holds the
+    `denoise_settings` of each request.
+    """
+    boxes, person_latents, condition_latents = get_crop_inputs(
+        person_images, cloth_images
+    )
+    states = [
+        pipeline.init_denoise_state(
+            masked_latent,
+            condition_latent,
+            mask_latent,
+            generator=[generator],
+            **request_settings,
+        )
+        for (masked_latent, mask_latent), condition_latent, generator, request_settings in zip(
+            person_latents, condition_latents, generators, settings
+        )
+    ]
+    pipeline.denoise(states)
+    results = [pipeline.decode_latents(state.latents)[0] for state in states]
+    return paste_crop_results(results, person_images, boxes)
+
+
+def fetch_request_images(
         person_image_url,
         upper_cloth_url,
         lower_cloth_url,
         mask_image_url,
     ):
-    response = requests.get(person_image_url)
-    if response.status_code == 200:
-        person_image = Image.open(BytesIO(response.content))
+    # 네 장의 이미지를 동시에 다운로드
+    fetched = fetch_input_images(
+        [
+            dict(
+                person_image_url=person_image_url,
+                upper_cloth_url=upper_cloth_url,
+                lower_cloth_url=lower_cloth_url,
+                mask_image_url=mask_image_url,
+            )
+        ]
+    )[0]
+    if isinstance(fetched, Exception):
+        raise fetched
+    return fetched
 
-    response = requests.get(upper_cloth_url)
-    if response.status_code == 200:
-        upper_cloth_image = Image.open(BytesIO(response.content))
 
-    response = requests.get(lower_cloth_url)
-    if response.status_code == 200:
-        lower_cloth_image = Image.open(BytesIO(response.content))
-
-    response = requests.get(mask_image_url)
-    if response.status_code == 200:
-        mask_image = Image.open(BytesIO(response.content))
-
-    vae_processor = VaeImageProcessor(vae_scale_factor=8)
-    mask_processor = VaeImageProcessor(
-        vae_scale_factor=8,
-        do_normalize=False,
-        do_binarize=True,
-        do_convert_grayscale=True,
+def preprocess_images(
+        person_image_url,
+        upper_cloth_url,
+        lower_cloth_url,
+        mask_image_url,
+    ):
+    return preprocess_fetched_images(
+        *fetch_request_images(
+            person_image_url,
+            upper_cloth_url,
+            lower_cloth_url,
+            mask_image_url,
+        )
     )
 
-    person_image = resize_and_crop(person_image, (WIDTH, HEIGHT))
 
-    cloth_image = concat_upper_and_lower(upper_cloth_image, lower_cloth_image)
-    cloth_image = resize_and_padding(cloth_image, (WIDTH, HEIGHT))
+def submit_result(result, username, cloth_type, timestamp, index=None, on_uploaded=None):
+    """
+    Hands the result to the background output stage and returns a future
+    that resolves to its S3 location once uploaded.
+    """
+    # 여러 벌을 한 번에 입힌 경우 결과 파일명에 순번을 붙임
+    suffix = "" if index is None else f"_{index}"
 
-    mask_image = resize_and_crop(mask_image, (WIDTH, HEIGHT))
+    # 로컬 결과 저장 경로 (선택)
+    local_path = None
+    if SAVE_LOCAL_OUTPUT:
+        local_path = os.path.join(
+            OUTPUT_DIR, username, f"{username}_{cloth_type}_{timestamp}{suffix}.jpg"
+        )
 
-    preprocessed_person_image = vae_processor.preprocess(person_image, HEIGHT, WIDTH)[0]
-    preprocessed_cloth_image = vae_processor.preprocess(cloth_image, HEIGHT, WIDTH)[0]
-    preprocessed_mask_image = mask_processor.preprocess(mask_image, HEIGHT, WIDTH)[0]
+    object_name = f"users/{username}/vton_result/{timestamp}/result{suffix}.jpg"
 
-    return preprocessed_person_image, preprocessed_cloth_image, preprocessed_mask_image
+    return output_stage.submit(
+        result, object_name, local_path=local_path, on_uploaded=on_uploaded
+    )
 
 
-def save_and_upload_s3(result, username, cloth_type, timestamp):
-    # 결과 저장 디렉토리 생성
-    output_dir = "./vton_output"
-    os.makedirs(output_dir, exist_ok=True)
+def gather_uploads(uploads, on_uploaded=None):
+    """
+    Returns a future for the S3 locations of `uploads`, in order, that fails
+    with the first failed upload. `on_uploaded(locations)` runs right before
+    it resolves.
+    """
+    gathered = Future()
+    remaining = [len(uploads)]
+    lock = threading.Lock()
 
-    # 결과 저장
-    output_path = os.path.join(
-        output_dir, username, f"{username}_{cloth_type}_{timestamp}.jpg"
-    )
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    result.save(output_path)
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        for upload in uploads:
+            if upload.exception() is not None:
+                gathered.set_exception(upload.exception())
+                return
+        locations = [upload.result() for upload in uploads]
+        if on_uploaded is not None:
+            on_uploaded(locations)
+        gathered.set_result(locations)
 
-    # 이미지를 메모리 버퍼에 저장
-    buffer = BytesIO()
-    result.save(buffer, "JPEG")
-    buffer.seek(0)  # 버퍼의 시작 위치로 이동
+    for upload in uploads:
+        upload.add_done_callback(done)
+    return gathered
 
-    bucket_name = "githubsalt-bucket"
-    object_name = f"users/{username}/vton_result/{timestamp}/result.jpg"
 
-    s3.upload_fileobj(buffer, bucket_name, object_name)
+def save_and_upload_s3(result, username, cloth_type, timestamp, index=None):
+    return submit_result(result, username, cloth_type, timestamp, index).result()
 
 
-def send_sqs(username, timestamp):
+def send_sqs(username, timestamp, num_results=None):
+    """
+    Queues the completion message on the batched SQS notifier and returns
+    right away with a future for the MessageId.
+    """
     message_body = {
         "userId": username,
         "initial_timestamp": timestamp,
     }
+    if num_results is not None:
+        message_body["num_results"] = num_results
 
-    try:
-        response = sqs.send_message(
-            QueueUrl=QUEUE_URL, MessageBody=json.dumps(message_body)
-        )
-        print(f"Message sent to SQS with MessageId: {response['MessageId']}")
+    return notifier.notify(message_body)
 
-        return {"statusCode": 200, "body": json.dumps("Message sent successfully!")}
-    except Exception as e:
-        print(f"Error sending message: {str(e)}")
-        return {
-            "statusCode": 500,
-            "body": json.dumps("Error sending message to SQS"),
-        }
 
 def get_vton(
     person_image_url,
@@ -160,10 +697,13 @@ def get_vton(
     cloth_type,
     username,
     timestamp,
+    guidance_interval=None,
+    num_inference_steps=None,
+    sampler=None,
 ):
-    # 이미지 전처리
-    preprocessed_person_image, preprocessed_cloth_image, preprocessed_mask_image = (
-        preprocess_images(
+    # 이미지 다운로드
+    person_image, upper_cloth_image, lower_cloth_image, mask_image = (
+        fetch_request_images(
             person_image_url,
             upper_cloth_url,
             lower_cloth_url,
@@ -172,37 +712,332 @@ def get_vton(
     )
 
     # 난수 고정
-    generator = torch.Generator(device="cuda").manual_seed(SEED)
+    generator = torch.Generator(device=DEVICE).manual_seed(SEED)
+    settings = denoise_settings(num_inference_steps, sampler, guidance_interval)
 
-    # 결과 생성
-    try:
+    if CROP_INFERENCE:
+        # 마스크 영역만 잘라서 추론 후 원본에 합성
+        result = run_cropped(
+            [(person_image, mask_image)],
+            [(upper_cloth_image, lower_cloth_image)],
+            [generator],
+            [settings],
+        )[0]
+    else:
+        # 이미지 전처리 + 인코딩 (사용자/의류 모두 캐시된 latent 사용)
+        masked_latent, mask_latent = get_person_latents([(person_image, mask_image)])
+        condition_latent = get_condition_latents([(upper_cloth_image, lower_cloth_image)])
+
+        # 결과 생성
         result = pipeline(
-            image=preprocessed_person_image,
-            condition_image=preprocessed_cloth_image,
-            mask=preprocessed_mask_image,
-            num_inference_steps=NUM_INFERENCE_STEPS,
+            image=None,
+            condition_image=None,
+            mask=None,
             height=HEIGHT,
             width=WIDTH,
             generator=generator,
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+            **settings,
         )[0]
-    except:
-        print("Error")
-        result = pipeline(
-            image=preprocessed_person_image[0],
-            condition_image=preprocessed_cloth_image[0],
-            mask=preprocessed_mask_image[0],
-            num_inference_steps=NUM_INFERENCE_STEPS,
+
+    # 결과 저장 (업로드 후 SQS 알림)
+    return submit_result(
+        result,
+        username,
+        cloth_type,
+        timestamp,
+        on_uploaded=lambda _: send_sqs(username, timestamp),
+    ).result()
+
+
+def get_vton_batch(vton_requests):
+    """
+    Runs several `get_vton` requests through one batched denoising loop.
+
+    Each request is a dict with the keyword arguments of `get_vton`, plus an
+    optional `seed`. Requests with different `guidance_interval`s, samplers
+    or step counts still share the UNet passes. Returns one entry per request, in order: a future that
+    resolves to the uploaded S3 location, or the exception that failed that
+    request.
+    """
+    results = [None] * len(vton_requests)
+
+    # 배치 전체 이미지를 한 번에 다운로드
+    fetched_images = fetch_input_images(vton_requests)
+
+    # 다운로드 실패 요청 제외
+    person_images, cloth_images, generators, valid = [], [], [], []
+    for i, (request, fetched) in enumerate(zip(vton_requests, fetched_images)):
+        if isinstance(fetched, Exception):
+            print(f"Error fetching request {i}: {fetched}")
+            results[i] = fetched
+            continue
+        person_image, upper_cloth_image, lower_cloth_image, mask_image = fetched
+        person_images.append((person_image, mask_image))
+        cloth_images.append((upper_cloth_image, lower_cloth_image))
+        # 요청별 난수 고정
+        generators.append(
+            torch.Generator(device=DEVICE).manual_seed(request.get("seed", SEED))
+        )
+        valid.append(i)
+
+    if not valid:
+        return results
+
+    # 요청별 샘플러, 스텝 수, CFG 구간
+    settings = [
+        denoise_settings(
+            vton_requests[i].get("num_inference_steps"),
+            vton_requests[i].get("sampler"),
+            vton_requests[i].get("guidance_interval"),
+        )
+        for i in valid
+    ]
+
+    if CROP_INFERENCE:
+        # 마스크 영역만 잘라서 추론 (요청마다 크기가 달라 같은 크기끼리만 UNet 배치)
+        try:
+            batch_result = run_cropped(
+                person_images,
+                cloth_images,
+                generators,
+                settings,
+            )
+        except Exception as e:
+            print(f"Error running batch of {len(valid)}: {e}")
+            for i in valid:
+                results[i] = e
+            return results
+        return submit_batch_results(vton_requests, valid, batch_result, results)
+
+    # 이미지 전처리 + 인코딩 (실패 시 요청별로 다시 시도해 실패한 요청만 제외)
+    try:
+        masked_latent, mask_latent = get_person_latents(person_images)
+        condition_latent = get_condition_latents(cloth_images)
+    except Exception as e:
+        print(f"Error encoding batch, retrying per request: {e}")
+        encoded = []
+        for i, person_pair, cloth_pair, generator in zip(
+            list(valid), person_images, cloth_images, list(generators)
+        ):
+            try:
+                encoded.append(
+                    (*get_person_latents([person_pair]), get_condition_latents([cloth_pair]))
+                )
+            except Exception as e:
+                print(f"Error preprocessing request {i}: {e}")
+                results[i] = e
+                del settings[valid.index(i)]
+                valid.remove(i)
+                generators.remove(generator)
+        if not valid:
+            return results
+        masked_latent, mask_latent, condition_latent = [
+            torch.cat(latents) for latents in zip(*encoded)
+        ]
+
+    # 배치 결과 생성 (사용자/의류 모두 캐시된 latent 사용)
+    try:
+        batch_result = pipeline(
+            image=None,
+            condition_image=None,
+            mask=None,
             height=HEIGHT,
             width=WIDTH,
-            generator=generator,
-        )[0]
+            generator=generators,
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+            # 요청별 값 목록 (같은 설정끼리 묶여도 UNet 패스는 배치 전체가 공유)
+            **{name: [s[name] for s in settings] for name in settings[0]},
+        )
+    except Exception as e:
+        print(f"Error running batch of {len(valid)}: {e}")
+        for i in valid:
+            results[i] = e
+        return results
+
+    return submit_batch_results(vton_requests, valid, batch_result, results)
+
+
+def submit_batch_results(vton_requests, indices, batch_result, results):
+    # 결과 저장 (업로드와 알림은 출력 스테이지에서 진행, GPU 워커는 바로 반환)
+    for i, result in zip(indices, batch_result):
+        request = vton_requests[i]
+        results[i] = submit_result(
+            result,
+            request["username"],
+            request["cloth_type"],
+            request["timestamp"],
+            on_uploaded=lambda _, request=request: send_sqs(
+                request["username"], request["timestamp"]
+            ),
+        )
+    return results
+
+
+def get_vton_multi(
+    person_image_url,
+    mask_image_url,
+    outfits,
+    cloth_type,
+    username,
+    timestamp,
+    seed=SEED,
+    guidance_interval=None,
+    num_inference_steps=None,
+    sampler=None,
+):
+    """
+    Tries several outfits on one person. `outfits` is a list of dicts with
+    `upper_cloth_url` and `lower_cloth_url`. The person is encoded once and
+    broadcast across the outfits, which run through batched denoising loops
+    of up to `MAX_BATCH_SIZE` outfits. Returns a future for the uploaded S3
+    locations in the order of `outfits`, so the batch thread that runs this
+    (`submit_call`) does not wait for the uploads.
+    """
+    # 사용자 이미지, 마스크, 모든 의류 이미지를 한 번에 다운로드
+    urls = [person_image_url, mask_image_url]
+    for outfit in outfits:
+        urls += [outfit["upper_cloth_url"], outfit["lower_cloth_url"]]
+    images, timings = fetcher.fetch_images(urls)
+    log_fetch_timings(timings)
+    person_image, mask_image = images[:2]
+    cloth_images = list(zip(images[2::2], images[3::2]))
+    settings = denoise_settings(num_inference_steps, sampler, guidance_interval)
+
+    # 사용자 이미지는 한 번만 인코딩
+    if not CROP_INFERENCE:
+        masked_latent, mask_latent = get_person_latents([(person_image, mask_image)])
+
+    uploads = []
+    for start in range(0, len(cloth_images), MAX_BATCH_SIZE):
+        chunk = cloth_images[start : start + MAX_BATCH_SIZE]
+        # 의상별 난수 고정 (단일 실행과 같은 시드)
+        generators = [
+            torch.Generator(device=DEVICE).manual_seed(seed) for _ in chunk
+        ]
+
+        if CROP_INFERENCE:
+            # 같은 사용자라 잘라낸 영역 크기가 같아 UNet 배치가 유지됨 (사용자 latent는 캐시에서 공유)
+            results = run_cropped(
+                [(person_image, mask_image)] * len(chunk),
+                chunk,
+                generators,
+                [settings] * len(chunk),
+            )
+        else:
+            # 결과 생성 (사용자 latent를 배치 전체에 브로드캐스트)
+            results = pipeline(
+                image=None,
+                condition_image=None,
+                mask=None,
+                height=HEIGHT,
+                width=WIDTH,
+                generator=generators,
+                condition_latent=get_condition_latents(chunk),
+                masked_latent=masked_latent,
+                mask_latent=mask_latent,
+                **settings,
+            )
+
+        # 결과 저장 (다음 배치를 돌리는 동안 업로드 진행)
+        for index, result in enumerate(results, start=start):
+            uploads.append(
+                submit_result(result, username, cloth_type, timestamp, index)
+            )
+
+    # 업로드가 모두 끝나면 SQS 알림
+    return gather_uploads(
+        uploads,
+        on_uploaded=lambda locations: send_sqs(username, timestamp, num_results=len(locations)),
+    )
+
+
+def encode_request_inputs(person_images, cloth_images):
+    """
+    Latents of a single request, from the latent caches: `(crop boxes or
+    None, (masked latent, mask latent), condition latent)`.
+    """
+    if CROP_INFERENCE:
+        # 마스크 영역만 잘라서 인코딩
+        boxes, person_latents, condition_latents = get_crop_inputs(person_images, cloth_images)
+        return boxes, person_latents[0], condition_latents[0]
+    return None, get_person_latents(person_images), get_condition_latents(cloth_images)
+
+
+def get_vton_continuous(
+    engine,
+    person_image_url,
+    upper_cloth_url,
+    lower_cloth_url,
+    mask_image_url,
+    cloth_type,
+    username,
+    timestamp,
+    seed=SEED,
+    guidance_interval=None,
+    num_inference_steps=None,
+    sampler=None,
+):
+    """
+    Same as `get_vton`, but the denoising runs inside a shared
+    `ContinuousBatchingEngine` so it can overlap with other requests.
+    """
+    # 이미지 다운로드
+    person_image, upper_cloth_image, lower_cloth_image, mask_image = (
+        fetch_request_images(
+            person_image_url,
+            upper_cloth_url,
+            lower_cloth_url,
+            mask_image_url,
+        )
+    )
+
+    # 이미지 전처리 + 인코딩은 엔진 스레드에서 (UNet 스텝과 동시에 VAE가 돌지 않도록)
+    person_images = [(person_image, mask_image)]
+    boxes, (masked_latent, mask_latent), condition_latent = engine.submit_call(
+        encode_request_inputs,
+        person_images=person_images,
+        cloth_images=[(upper_cloth_image, lower_cloth_image)],
+    ).result()
+
+    # 난수 고정
+    generator = torch.Generator(device=DEVICE).manual_seed(seed)
+
+    # 결과 생성 (다른 요청과 타임스텝 단위로 배치됨)
+    result = engine.submit(
+        image=None,
+        condition_image=None,
+        mask=None,
+        height=HEIGHT,
+        width=WIDTH,
+        generator=generator,
+        condition_latent=condition_latent,
+        masked_latent=masked_latent,
+        mask_latent=mask_latent,
+        **denoise_settings(num_inference_steps, sampler, guidance_interval),
+    ).result()[0]
+    if CROP_INFERENCE:
+        result = paste_crop_results([result], person_images, boxes)[0]
+
+    # 결과 저장 (업로드 후 SQS 알림)
+    return submit_result(
+        result,
+        username,
+        cloth_type,
+        timestamp,
+        on_uploaded=lambda _: send_sqs(username, timestamp),
+    ).result()
+
 
-    # 결과 저장
-    save_and_upload_s3(result, username, cloth_type, timestamp)
-    send_sqs(username, timestamp)
+cold_start["import"] = time.perf_counter() - IMPORT_START
 
 
 if __name__ == "__main__":
+    load()
 
     person_image_url = "enter your person image url"
 
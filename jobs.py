@@ -0,0 +1,99 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a dedicated inference executor and keeps their
+    status in a bounded in-memory table.
+
+    At most `max_jobs` jobs are remembered; the oldest finished jobs are
+    evicted first. When `max_pending` jobs are already queued or running,
+    `submit` raises `JobQueueFull` instead of growing the backlog.
+    """
+
+    def __init__(self, num_workers=1, max_jobs=1000, max_pending=64):
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="vton-inference"
+        )
+
+    def submit(self, fn, *args, **kwargs) -> Job:
+        with self._lock:
+            num_pending = sum(not job.finished for job in self._jobs.values())
+            if num_pending >= self.max_pending:
+                raise JobQueueFull(f"{num_pending} jobs are already pending")
+            job = Job(uuid.uuid4().hex)
+            self._jobs[job.job_id] = job
+            self._evict()
+        self._executor.submit(self._run, job, fn, *args, **kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _evict(self):
+        # Drop the oldest finished jobs first; pending jobs are never evicted
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished]:
+            del self._jobs[job_id]
+            if len(self._jobs) <= self.max_jobs:
+                break
+
+    def _run(self, job, fn, *args, **kwargs):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = SUCCEEDED
+        except Exception as e:
+            print(f"Job {job.job_id} failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
@@ -0,0 +1,159 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+
+def content_key(*images, extra=""):
+    """
+    Content hash of one or more PIL images. Uses the SHA-256 of the
+    downloaded bytes stored by `ImageFetcher` when present, and falls back to
+    hashing the decoded pixels.
+    """
+    digest = hashlib.sha256()
+    for image in images:
+        image_hash = image.info.get("sha256")
+        if image_hash is None:
+            image_hash = hashlib.sha256(image.tobytes()).hexdigest()
+        digest.update(image_hash.encode())
+    digest.update(extra.encode())
+    return digest.hexdigest()
+
+
+def _num_bytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    return sum(_num_bytes(v) for v in value)
+
+
+def _to_device(value, device):
+    if isinstance(value, torch.Tensor):
+        return value.to(device)
+    return tuple(_to_device(v, device) for v in value)
+
+
+class TensorLRUCache:
+    """
+    Two-tier LRU cache of tensors (or tuples of tensors), budgeted in bytes.
+
+    New entries go to the device tier. When the device tier is over
+    `device_budget_bytes`, its least recently used entries are moved to host
+    memory, and when the host tier is over `host_budget_bytes` they are
+    dropped. A host hit is promoted back to the device. With `ttl_seconds`,
+    entries also expire that long after they were put.
+
+    On an accelerator the cache holds up to `device_budget_bytes` of device
+    memory plus `host_budget_bytes` of host memory. On a CPU device both
+    tiers would be host memory, so the device tier is disabled and the cache
+    holds at most `host_budget_bytes`.
+    """
+
+    def __init__(
+        self, device, device_budget_bytes, host_budget_bytes=0, ttl_seconds=None
+    ):
+        self.device = device
+        self.single_tier = torch.device(device).type == "cpu"
+        self.device_budget_bytes = 0 if self.single_tier else device_budget_bytes
+        self.host_budget_bytes = host_budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self._device_tier = OrderedDict()
+        self._host_tier = OrderedDict()
+        self._expires_at = {}
+        self._device_bytes = 0
+        self._host_bytes = 0
+        self._lock = threading.Lock()
+        self.device_hits = 0
+        self.host_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            expires_at = self._expires_at.get(key)
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._discard(key)
+                self.expirations += 1
+            if key in self._device_tier:
+                self._device_tier.move_to_end(key)
+                self.device_hits += 1
+                return self._device_tier[key]
+            if key in self._host_tier and self.single_tier:
+                self._host_tier.move_to_end(key)
+                self.host_hits += 1
+                return self._host_tier[key]
+            if key in self._host_tier:
+                value = self._host_tier.pop(key)
+                self._host_bytes -= _num_bytes(value)
+                self.host_hits += 1
+                value = _to_device(value, self.device)
+                self._put_device(key, value)
+                return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        value = _to_device(value, self.device)
+        with self._lock:
+            self._discard(key)
+            self._purge_expired()
+            if self.ttl_seconds is not None:
+                self._expires_at[key] = time.monotonic() + self.ttl_seconds
+            if self.single_tier:
+                self._put_host(key, value)
+            else:
+                self._put_device(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._device_tier.clear()
+            self._host_tier.clear()
+            self._expires_at.clear()
+            self._device_bytes = 0
+            self._host_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "device_entries": len(self._device_tier),
+                "device_bytes": self._device_bytes,
+                "host_entries": len(self._host_tier),
+                "host_bytes": self._host_bytes,
+                "device_hits": self.device_hits,
+                "host_hits": self.host_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _discard(self, key):
+        self._expires_at.pop(key, None)
+        if key in self._device_tier:
+            self._device_bytes -= _num_bytes(self._device_tier.pop(key))
+        if key in self._host_tier:
+            self._host_bytes -= _num_bytes(self._host_tier.pop(key))
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for key in [key for key, t in self._expires_at.items() if t <= now]:
+            self._discard(key)
+            self.expirations += 1
+
+    def _put_device(self, key, value):
+        self._device_tier[key] = value
+        self._device_bytes += _num_bytes(value)
+        while self._device_bytes > self.device_budget_bytes and self._device_tier:
+            old_key, old_value = self._device_tier.popitem(last=False)
+            self._device_bytes -= _num_bytes(old_value)
+            self._put_host(old_key, _to_device(old_value, "cpu"))
+
+    def _put_host(self, key, value):
+        self._host_tier[key] = value
+        self._host_bytes += _num_bytes(value)
+        while self._host_bytes > self.host_budget_bytes and self._host_tier:
+            old_key, old_value = self._host_tier.popitem(last=False)
+            self._host_bytes -= _num_bytes(old_value)
+            self._expires_at.pop(old_key, None)
+            self.evictions += 1
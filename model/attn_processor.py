@@ -1,6 +1,22 @@
+import contextlib
+
 from torch.nn import functional as F
 import torch
 
+from model.token_merge import token_merge_fns
+
+try:
+    from torch.nn.attention import SDPBackend, sdpa_kernel
+except ImportError:  # torch < 2.3
+    SDPBackend = sdpa_kernel = None
+
+SDPA_KERNELS = {
+    "flash": "FLASH_ATTENTION",
+    "efficient": "EFFICIENT_ATTENTION",
+    "cudnn": "CUDNN_ATTENTION",
+    "math": "MATH",
+}
+
 
 class SkipAttnProcessor(torch.nn.Module):
     def __init__(self, *args, **kwargs) -> None:
@@ -25,11 +41,30 @@ class AttnProcessor2_0(torch.nn.Module):
         self,
         hidden_size=None,
         cross_attention_dim=None,
+        sdpa_kernels=None,
         **kwargs
     ):
         super().__init__()
         if not hasattr(F, "scaled_dot_product_attention"):
             raise ImportError("AttnProcessor2_0 requires PyTorch 2.0, to use it, please upgrade PyTorch to 2.0.")
+        # restrict SDPA to these kernels (names from SDPA_KERNELS), e.g. ["flash", "efficient"]
+        self.sdpa_backends = None
+        if sdpa_kernels:
+            if sdpa_kernel is None:
+                raise ImportError("Selecting SDPA kernels requires PyTorch 2.3 or later.")
+            self.sdpa_backends = [getattr(SDPBackend, SDPA_KERNELS[name]) for name in sdpa_kernels]
+
+    def sdpa_context(self):
+        if self.sdpa_backends is None:
+            return contextlib.nullcontext()
+        return sdpa_kernel(self.sdpa_backends)
+
+    def attention(self, query, key, value, attention_mask=None):
+        """Attention over `(batch, heads, seq_len, head_dim)` tensors."""
+        with self.sdpa_context():
+            return F.scaled_dot_product_attention(
+                query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
+            )
 
     def __call__(
         self,
@@ -65,6 +100,13 @@ class AttnProcessor2_0(torch.nn.Module):
         if attn.group_norm is not None:
             hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(1, 2)
 
+        # token merging (only active inside a `TokenMerging.context`)
+        merge_fns = None
+        if encoder_hidden_states is None and attention_mask is None:
+            merge_fns = token_merge_fns(hidden_states)
+        if merge_fns is not None:
+            hidden_states = merge_fns[0](hidden_states)
+
         query = attn.to_q(hidden_states)
 
         if encoder_hidden_states is None:
@@ -85,9 +127,7 @@ class AttnProcessor2_0(torch.nn.Module):
 
         # the output of sdp = (batch, num_heads, seq_len, head_dim)
         # TODO: add support for attn.scale when we move to Torch 2.1
-        hidden_states = F.scaled_dot_product_attention(
-            query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
-        )
+        hidden_states = self.attention(query, key, value, attention_mask)
 
         hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim)
         hidden_states = hidden_states.to(query.dtype)
@@ -97,6 +137,9 @@ class AttnProcessor2_0(torch.nn.Module):
         # dropout
         hidden_states = attn.to_out[1](hidden_states)
 
+        if merge_fns is not None:
+            hidden_states = merge_fns[1](hidden_states)
+
         if input_ndim == 4:
             hidden_states = hidden_states.transpose(-1, -2).reshape(batch_size, channel, height, width)
 
@@ -106,4 +149,81 @@ class AttnProcessor2_0(torch.nn.Module):
         hidden_states = hidden_states / attn.rescale_output_factor
 
         return hidden_states
-   
\ No newline at end of file
+
+
+class ChunkedAttnProcessor(AttnProcessor2_0):
+    r"""
+    Bounded-memory attention: queries are processed `chunk_size` tokens at a
+    time and, with `slice_size`, `slice_size` of the batch x heads at a time,
+    so at most `slice_size * chunk_size * seq_len` attention scores exist at
+    once. Useful when SDPA falls back to its math kernel, which materializes
+    the full score matrix of the concatenated person+garment sequence.
+    """
+
+    def __init__(
+        self,
+        hidden_size=None,
+        cross_attention_dim=None,
+        chunk_size=1024,
+        slice_size=None,
+        **kwargs
+    ):
+        super().__init__(hidden_size, cross_attention_dim, **kwargs)
+        self.chunk_size = chunk_size
+        self.slice_size = slice_size
+
+    def attention(self, query, key, value, attention_mask=None):
+        batch_size, heads, seq_len, head_dim = query.shape
+        slice_size = self.slice_size or batch_size * heads
+        if seq_len <= self.chunk_size and slice_size >= batch_size * heads:
+            return super().attention(query, key, value, attention_mask)
+
+        query, key, value = (x.reshape(batch_size * heads, -1, head_dim) for x in (query, key, value))
+        if attention_mask is not None:
+            attention_mask = attention_mask.expand(batch_size, heads, seq_len, -1).reshape(
+                batch_size * heads, seq_len, -1
+            )
+        hidden_states = torch.empty_like(query)
+        with self.sdpa_context():
+            for i in range(0, batch_size * heads, slice_size):
+                for j in range(0, seq_len, self.chunk_size):
+                    hidden_states[i : i + slice_size, j : j + self.chunk_size] = (
+                        F.scaled_dot_product_attention(
+                            query[i : i + slice_size, j : j + self.chunk_size],
+                            key[i : i + slice_size],
+                            value[i : i + slice_size],
+                            attn_mask=None
+                            if attention_mask is None
+                            else attention_mask[i : i + slice_size, j : j + self.chunk_size],
+                        )
+                    )
+        return hidden_states.view(batch_size, heads, seq_len, head_dim)
+
+
+class XFormersAttnProcessor(AttnProcessor2_0):
+    r"""
+    Attention through `xformers.ops.memory_efficient_attention`.
+    """
+
+    def __init__(self, hidden_size=None, cross_attention_dim=None, **kwargs):
+        super().__init__(hidden_size, cross_attention_dim, **kwargs)
+        import xformers.ops
+
+        self.memory_efficient_attention = xformers.ops.memory_efficient_attention
+
+    def attention(self, query, key, value, attention_mask=None):
+        # xformers expects (batch, seq_len, heads, head_dim)
+        hidden_states = self.memory_efficient_attention(
+            query.transpose(1, 2),
+            key.transpose(1, 2),
+            value.transpose(1, 2),
+            attn_bias=attention_mask,
+        )
+        return hidden_states.transpose(1, 2)
+
+
+ATTN_BACKENDS = {
+    "sdpa": AttnProcessor2_0,
+    "chunked": ChunkedAttnProcessor,
+    "xformers": XFormersAttnProcessor,
+}
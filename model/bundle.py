@@ -0,0 +1,120 @@
+import json
+import os
+import struct
+
+import torch
+from accelerate import init_empty_weights
+from diffusers import AutoencoderKL, DDIMScheduler, UNet2DConditionModel
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from model.attn_processor import SkipAttnProcessor
+from model.utils import init_adapter, strip_cross_attention, timed
+
+BUNDLE_VERSION = "1"
+
+# safetensors dtype names
+_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def save_bundle(pipeline, path):
+    """
+    Writes the UNet (attention checkpoint merged, cross-attention stripped
+    if it was) and VAE of `pipeline` to one safetensors file in the
+    pipeline's dtype, with their configs in the file metadata.
+    """
+    unet = getattr(pipeline.unet, "_orig_mod", pipeline.unet)  # torch.compile wrapper
+    vae = getattr(pipeline.vae, "_orig_mod", pipeline.vae)
+    tensors = {}
+    for prefix, module in (("unet.", unet), ("vae.", vae)):
+        for name, tensor in module.state_dict().items():
+            tensors[prefix + name] = tensor.detach().to("cpu", pipeline.weight_dtype).contiguous()
+    stripped = not any(name.endswith("attn2.to_q.weight") for name in tensors)
+    metadata = {
+        "bundle_version": BUNDLE_VERSION,
+        "dtype": str(pipeline.weight_dtype).replace("torch.", ""),
+        "strip_cross_attn": json.dumps(stripped),
+        "unet_config": json.dumps(dict(unet.config)),
+        "vae_config": json.dumps(dict(vae.config)),
+        "scheduler_config": json.dumps(dict(pipeline.noise_scheduler.config)),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    save_file(tensors, path, metadata=metadata)
+    return metadata
+
+
+def read_header(path):
+    """`(header, data_offset)` of a safetensors file; `header["__metadata__"]` holds the metadata."""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def map_tensors(path):
+    """
+    Tensors of a safetensors file as views into one copy-on-write memory
+    map of it: nothing is read until a tensor is touched, and pages stay
+    shared with the page cache (and other processes mapping the file).
+    """
+    header, data_offset = read_header(path)
+    storage = torch.from_file(path, shared=False, size=os.path.getsize(path), dtype=torch.uint8)
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _DTYPES[info["dtype"]]
+        begin, end = (data_offset + offset for offset in info["data_offsets"])
+        data = storage[begin:end]
+        if begin % torch.empty((), dtype=dtype).element_size():
+            data = data.clone()  # misaligned for this dtype
+        tensors[name] = data.view(dtype).reshape(info["shape"])
+    return tensors
+
+
+def load_bundle(path, device="cpu", timings=None):
+    """
+    `(vae, unet, noise_scheduler, weight_dtype)` from a `save_bundle` file.
+    The modules are built without allocating weights and then take the
+    bundle's tensors as their parameters: memory-mapped on CPU, read
+    straight to the device otherwise. Stage times go to `timings`.
+    """
+    timings = {} if timings is None else timings
+    with timed(timings, "read_header"):
+        header, _ = read_header(path)
+        metadata = header["__metadata__"]
+        if metadata.get("bundle_version") != BUNDLE_VERSION:
+            raise ValueError(f"Unsupported bundle version in {path}: {metadata.get('bundle_version')}")
+    with timed(timings, "build_modules"):
+        with init_empty_weights():
+            unet = UNet2DConditionModel.from_config(json.loads(metadata["unet_config"]))
+            vae = AutoencoderKL.from_config(json.loads(metadata["vae_config"]))
+        noise_scheduler = DDIMScheduler.from_config(json.loads(metadata["scheduler_config"]))
+        init_adapter(unet, cross_attn_cls=SkipAttnProcessor)
+        if json.loads(metadata["strip_cross_attn"]):
+            strip_cross_attention(unet)
+    with timed(timings, "map_weights"):
+        if torch.device(device).type == "cpu":
+            tensors = map_tensors(path)
+        else:
+            with safe_open(path, framework="pt", device=str(device)) as f:
+                tensors = {name: f.get_tensor(name) for name in f.keys()}
+    with timed(timings, "assign_weights"):
+        for prefix, module in (("unet.", unet), ("vae.", vae)):
+            state_dict = {
+                name[len(prefix) :]: tensor for name, tensor in tensors.items() if name.startswith(prefix)
+            }
+            module.load_state_dict(state_dict, strict=True, assign=True)
+            module.eval()
+    return vae, unet, noise_scheduler, getattr(torch, metadata["dtype"])
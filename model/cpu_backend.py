@@ -0,0 +1,143 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+QUANTIZATION_MODES = ("none", "dynamic", "weight_only")
+
+# Kept in floating point: the UNet's input and output convs are the layers
+# most sensitive to weight error, and they hold a negligible share of the weights.
+KEEP_FLOAT = ("conv_in", "conv_out")
+
+# /proc/cpuinfo flags of native bf16 compute (AVX512-BF16, AMX)
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+
+
+def bf16_supported():
+    """
+    Whether this CPU computes bf16 natively (AVX512-BF16 or AMX), so bf16
+    autocast pays off. Read from /proc/cpuinfo; False where it is missing.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = next((line.split(":", 1)[1].split() for line in f if line.startswith("flags")), [])
+    except OSError:
+        return False
+    return any(flag in flags for flag in BF16_CPU_FLAGS)
+
+
+def configure_threads(num_threads=None, interop_threads=None):
+    """Sets torch's intra-op (and inter-op) thread pool sizes; returns the intra-op size."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # only settable before the first inter-op parallel work
+            print("inter-op threads already started, keeping", torch.get_num_interop_threads())
+    return torch.get_num_threads()
+
+
+def quantize_per_channel(weight):
+    """Symmetric int8 weights with one float scale per output channel."""
+    flat = weight.detach().float().flatten(1)
+    scale = flat.abs().amax(dim=1).clamp(min=1e-8) / 127
+    weight_int8 = torch.round(flat / scale[:, None]).clamp(-127, 127).to(torch.int8)
+    return weight_int8.view_as(weight), scale
+
+
+class WeightOnlyInt8Linear(nn.Module):
+    """`nn.Linear` with int8 weights, dequantized to `compute_dtype` on every call."""
+
+    def __init__(self, linear, compute_dtype=torch.float32):
+        super().__init__()
+        self.in_features, self.out_features = linear.in_features, linear.out_features
+        self.compute_dtype = compute_dtype
+        weight_int8, scale = quantize_per_channel(linear.weight)
+        self.register_buffer("weight_int8", weight_int8)
+        self.register_buffer("weight_scale", scale)
+        self.bias = linear.bias
+
+    def forward(self, x):
+        weight = self.weight_int8.to(self.compute_dtype) * self.weight_scale.to(self.compute_dtype)[:, None]
+        bias = None if self.bias is None else self.bias.to(self.compute_dtype)
+        return F.linear(x.to(self.compute_dtype), weight, bias)
+
+
+class WeightOnlyInt8Conv2d(nn.Module):
+    """`nn.Conv2d` (zero padding) with int8 weights, dequantized to `compute_dtype` on every call."""
+
+    def __init__(self, conv, compute_dtype=torch.float32):
+        super().__init__()
+        self.stride, self.padding = conv.stride, conv.padding
+        self.dilation, self.groups = conv.dilation, conv.groups
+        self.compute_dtype = compute_dtype
+        weight_int8, scale = quantize_per_channel(conv.weight)
+        self.register_buffer("weight_int8", weight_int8)
+        self.register_buffer("weight_scale", scale)
+        self.bias = conv.bias
+
+    def forward(self, x):
+        scale = self.weight_scale.to(self.compute_dtype)[:, None, None, None]
+        weight = self.weight_int8.to(self.compute_dtype) * scale
+        bias = None if self.bias is None else self.bias.to(self.compute_dtype)
+        return F.conv2d(
+            x.to(self.compute_dtype), weight, bias, self.stride, self.padding, self.dilation, self.groups
+        )
+
+
+class DynamicInt8Linear(nn.Module):
+    """
+    Dynamically quantized linear (`torch.ao.quantization.quantize_dynamic`)
+    running as an int8 GEMM (fbgemm/onednn): activations are quantized per
+    call from their observed range, weights once per channel. The quantized
+    module only takes float32; this one takes and returns any float dtype,
+    e.g. under bf16 autocast.
+    """
+
+    def __init__(self, linear):
+        super().__init__()
+        self.in_features, self.out_features = linear.in_features, linear.out_features
+        self.linear = linear
+
+    def forward(self, x):
+        return self.linear(x.float()).to(x.dtype)
+
+
+def quantize_modules(model, mode, compute_dtype=torch.float32, keep_float=KEEP_FLOAT):
+    """
+    Replaces the `nn.Linear` and zero-padded `nn.Conv2d` modules of `model`
+    (except those named in `keep_float`) in place. `dynamic` runs the linears
+    as int8 GEMMs and stores conv weights in int8; `weight_only` stores all
+    of them in int8 and computes in `compute_dtype`. Returns the number of
+    modules replaced.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(
+            f"Unknown quantization mode: {mode} (available: {', '.join(QUANTIZATION_MODES)})"
+        )
+    if mode == "none":
+        return 0
+    if mode == "dynamic":
+        qconfig_spec = {
+            name: torch.ao.quantization.per_channel_dynamic_qconfig
+            for name, module in model.named_modules()
+            if type(module) is nn.Linear and name not in keep_float
+        }
+        torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+    replaced = 0
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if f"{name}.{child_name}".lstrip(".") in keep_float:
+                continue
+            if type(child) is torch.ao.nn.quantized.dynamic.Linear:
+                child = DynamicInt8Linear(child)
+            elif type(child) is nn.Linear:
+                child = WeightOnlyInt8Linear(child, compute_dtype)
+            elif type(child) is nn.Conv2d and child.padding_mode == "zeros":
+                child = WeightOnlyInt8Conv2d(child, compute_dtype)
+            else:
+                continue
+            setattr(module, child_name, child)
+            replaced += 1
+    return replaced
@@ -0,0 +1,169 @@
+import contextlib
+import threading
+
+import torch
+
+
+def _call_block(block, sample, emb, **kwargs):
+    if getattr(block, "has_cross_attention", False):
+        return block(hidden_states=sample, temb=emb, encoder_hidden_states=None, **kwargs)
+    return block(hidden_states=sample, temb=emb, **kwargs)
+
+
+class DeepCache:
+    """
+    Cross-step UNet feature cache (DeepCache, https://arxiv.org/abs/2312.00858).
+
+    On a refresh step the whole UNet runs and the input of the outermost
+    `depth` up blocks, i.e. the output of the deep down, mid and inner up
+    blocks, is stored on the `DenoiseState`. For the next `interval - 1`
+    steps only `conv_in`, the outer `depth` down blocks and those up blocks
+    run, reusing the stored deep features.
+
+    Supports the CatVTON UNet as used by the pipeline: no text, class or
+    added conditioning. `unet_context(sample)`, if given, returns a context
+    manager entered around every pass (e.g. `TokenMerging.context`).
+    """
+
+    def __init__(self, unet, interval=3, depth=1, unet_context=None):
+        assert interval >= 1, "interval must be at least 1"
+        assert 1 <= depth < len(unet.up_blocks), "depth must leave a deep branch to cache"
+        self.unet = unet
+        self.interval = interval
+        self.depth = depth
+        self.unet_context = unet_context or (lambda sample: contextlib.nullcontext())
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.hits = 0
+
+    def __call__(self, states, model_inputs, model_timesteps):
+        """
+        Noise predictions for `model_inputs` (one per state, as built by
+        `denoise_step`). States due for a refresh share one full UNet pass and
+        the rest share one shallow pass.
+        """
+        refresh, cached = [], []
+        for i, (state, model_input) in enumerate(zip(states, model_inputs)):
+            features = state.deep_features
+            if (
+                features is None
+                or state.step_index - state.deep_features_step >= self.interval
+                # cached without CFG, but this step uses it
+                or features.shape[0] < model_input.shape[0]
+            ):
+                refresh.append(i)
+            else:
+                # with CFG off for this step, the conditional half is at the end
+                cached.append((i, features[-model_input.shape[0] :]))
+
+        noise_preds = [None] * len(states)
+        if refresh:
+            noise_pred, features = self._forward(
+                torch.cat([model_inputs[i] for i in refresh]),
+                torch.cat([model_timesteps[i] for i in refresh]),
+            )
+            sizes = [model_inputs[i].shape[0] for i in refresh]
+            for i, pred, feature in zip(
+                refresh, noise_pred.split(sizes), features.split(sizes)
+            ):
+                noise_preds[i] = pred
+                states[i].deep_features = feature
+                states[i].deep_features_step = states[i].step_index
+        if cached:
+            noise_pred, _ = self._forward(
+                torch.cat([model_inputs[i] for i, _ in cached]),
+                torch.cat([model_timesteps[i] for i, _ in cached]),
+                deep_features=torch.cat([features for _, features in cached]),
+            )
+            sizes = [model_inputs[i].shape[0] for i, _ in cached]
+            for (i, _), pred in zip(cached, noise_pred.split(sizes)):
+                noise_preds[i] = pred
+
+        with self._lock:
+            self.refreshes += len(refresh)
+            self.hits += len(cached)
+        return noise_preds
+
+    def stats(self):
+        with self._lock:
+            total = self.refreshes + self.hits
+            return {
+                "interval": self.interval,
+                "depth": self.depth,
+                "refreshes": self.refreshes,
+                "hits": self.hits,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _forward(self, sample, timestep, deep_features=None):
+        """
+        `UNet2DConditionModel.forward` split at the cached depth. Runs the
+        whole UNet when `deep_features` is None, otherwise only the shallow
+        branch. Returns `(noise_pred, deep_features)`.
+        """
+        with self.unet_context(sample):
+            return self._forward_unet(sample, timestep, deep_features)
+
+    def _forward_unet(self, sample, timestep, deep_features=None):
+        unet = self.unet
+        forward_upsample_size = any(
+            dim % 2**unet.num_upsamplers != 0 for dim in sample.shape[-2:]
+        )
+        upsample_size = None
+
+        # 1. time
+        emb = unet.time_embedding(unet.get_time_embed(sample=sample, timestep=timestep))
+        if unet.time_embed_act is not None:
+            emb = unet.time_embed_act(emb)
+
+        # 2. pre-process + 3. down (only the shallow blocks when cached)
+        sample = unet.conv_in(sample)
+        down_block_res_samples = (sample,)
+        down_blocks = unet.down_blocks if deep_features is None else unet.down_blocks[: self.depth]
+        for downsample_block in down_blocks:
+            sample, res_samples = _call_block(downsample_block, sample, emb)
+            down_block_res_samples += res_samples
+
+        shallow_up_blocks = unet.up_blocks[-self.depth :]
+        if deep_features is None:
+            # 4. mid + 5. deep up blocks
+            sample = unet.mid_block(sample, emb) if unet.mid_block is not None else sample
+            for upsample_block in unet.up_blocks[: -self.depth]:
+                res_samples = down_block_res_samples[-len(upsample_block.resnets) :]
+                down_block_res_samples = down_block_res_samples[: -len(upsample_block.resnets)]
+                if forward_upsample_size:
+                    upsample_size = down_block_res_samples[-1].shape[2:]
+                sample = _call_block(
+                    upsample_block,
+                    sample,
+                    emb,
+                    res_hidden_states_tuple=res_samples,
+                    upsample_size=upsample_size,
+                )
+            deep_features = sample
+        else:
+            # the shallow up blocks only consume the first skip connections
+            num_res_samples = sum(len(block.resnets) for block in shallow_up_blocks)
+            down_block_res_samples = down_block_res_samples[:num_res_samples]
+            sample = deep_features
+
+        # 5. shallow up blocks
+        for i, upsample_block in enumerate(shallow_up_blocks):
+            is_final_block = i == len(shallow_up_blocks) - 1
+            res_samples = down_block_res_samples[-len(upsample_block.resnets) :]
+            down_block_res_samples = down_block_res_samples[: -len(upsample_block.resnets)]
+            if not is_final_block and forward_upsample_size:
+                upsample_size = down_block_res_samples[-1].shape[2:]
+            sample = _call_block(
+                upsample_block,
+                sample,
+                emb,
+                res_hidden_states_tuple=res_samples,
+                upsample_size=upsample_size,
+            )
+
+        # 6. post-process
+        if unet.conv_norm_out:
+            sample = unet.conv_norm_out(sample)
+            sample = unet.conv_act(sample)
+        return unet.conv_out(sample), deep_features
@@ -0,0 +1,254 @@
+import json
+import os
+import threading
+
+import torch
+from diffusers.models.autoencoders.vae import DecoderOutput, DiagonalGaussianDistribution
+from diffusers.models.modeling_outputs import AutoencoderKLOutput
+from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
+
+from model.utils import strip_cross_attention
+
+EXPORT_FORMATS = ("torch", "onnx")
+MANIFEST = "manifest.json"
+# UNet graphs take float timesteps: DDIM-style schedulers yield integers,
+# Euler-style ones fractional values, and a batch may mix both
+TIMESTEP_DTYPE = torch.float32
+
+
+class _UNetGraph(torch.nn.Module):
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep):
+        return self.unet(sample, timestep, encoder_hidden_states=None, return_dict=False)[0]
+
+
+class _VAEEncodeGraph(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, image):
+        # mean and logvar, so sampling stays outside the graph
+        return self.vae.encode(image).latent_dist.parameters
+
+
+class _VAEDecodeGraph(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latents):
+        return self.vae.decode(latents).sample
+
+
+def graph_shapes(batch_sizes, height, width, vae_scale=8):
+    """
+    Input shapes of every graph a pipeline serving `batch_sizes` requests of
+    `height`x`width` pixels runs: the UNet sees the person and garment
+    latents stacked along y, at the request batch size (conditional steps
+    only) and twice that (classifier-free guidance).
+    """
+    latent_height, latent_width = height // vae_scale, width // vae_scale
+    shapes = {"unet": [], "vae_encode": [], "vae_decode": []}
+    for batch_size in batch_sizes:
+        shapes["vae_encode"].append((batch_size, 3, height, width))
+        shapes["vae_decode"].append((batch_size, 4, latent_height, latent_width))
+        for unet_batch_size in (batch_size, 2 * batch_size):
+            shapes["unet"].append((unet_batch_size, 9, 2 * latent_height, latent_width))
+    return {name: sorted(set(values)) for name, values in shapes.items()}
+
+
+def export_pipeline(pipeline, directory, batch_sizes=(1,), height=1024, width=768, format="onnx", rtol=None):
+    """
+    Exports the UNet and the VAE encoder/decoder of `pipeline` as graphs
+    specialized to the shapes of `graph_shapes`, into `directory` with a
+    manifest `CatVTONPipeline.use_exported` reads. The UNet is exported
+    with its skipped cross-attention removed (`strip_cross_attention`) and
+    the loaded attention weights baked in.
+
+    Every graph is loaded back through its runtime and checked against the
+    eager module on random inputs; its maximum error relative to the eager
+    output's range is recorded in the manifest, and a `ValueError` is
+    raised above `rtol` (default 1e-3 in float32, 1e-2 otherwise).
+
+    ONNX graphs run through numpy, which has no bfloat16, so bfloat16
+    pipelines can only be exported in the `torch` format.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {format} (available: {', '.join(EXPORT_FORMATS)})")
+    if format == "onnx" and pipeline.weight_dtype == torch.bfloat16:
+        raise ValueError("ONNX export does not support bfloat16, use float32/float16 or format='torch'")
+    if rtol is None:
+        rtol = 1e-3 if pipeline.weight_dtype == torch.float32 else 1e-2
+    strip_cross_attention(pipeline.unet)
+    os.makedirs(directory, exist_ok=True)
+    modules = {
+        "unet": _UNetGraph(pipeline.unet),
+        "vae_encode": _VAEEncodeGraph(pipeline.vae),
+        "vae_decode": _VAEDecodeGraph(pipeline.vae),
+    }
+    vae_scale = 2 ** (len(pipeline.vae.config.block_out_channels) - 1)
+    generator = torch.Generator().manual_seed(0)
+    graphs = []
+    for name, shapes in graph_shapes(batch_sizes, height, width, vae_scale).items():
+        for shape in shapes:
+            inputs = [
+                torch.randn(shape, generator=generator).to(pipeline.device, pipeline.weight_dtype)
+            ]
+            if name == "unet":
+                timestep = torch.rand(shape[:1], generator=generator) * 1000
+                inputs.append(timestep.to(pipeline.device, TIMESTEP_DTYPE))
+            file = f"{name}_{'x'.join(map(str, shape))}.{'onnx' if format == 'onnx' else 'pt2'}"
+            path = os.path.join(directory, file)
+            with torch.no_grad():
+                _export(modules[name].eval(), inputs, path, format)
+                expected = modules[name](*inputs).float()
+                actual = _load_runner(path, format, pipeline.device)(*inputs).float()
+            error = float((actual - expected).abs().max() / expected.abs().max().clamp(min=1e-6))
+            print(f"exported {file}: relative error {error:.2e}")
+            if not error <= rtol:  # also catches NaN
+                raise ValueError(f"{file} differs from the eager module: relative error {error:.2e} > {rtol:.0e}")
+            graphs.append({"name": name, "file": file, "shape": list(shape), "relative_error": error})
+    manifest = {
+        "format": format,
+        "dtype": str(pipeline.weight_dtype).replace("torch.", ""),
+        "graphs": graphs,
+    }
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _export(module, inputs, path, format):
+    if format == "torch":
+        torch.export.save(torch.export.export(module, tuple(inputs)), path)
+    else:
+        input_names = ["sample", "timestep"] if len(inputs) == 2 else ["input"]
+        torch.onnx.export(module, tuple(inputs), path, input_names=input_names, output_names=["output"])
+
+
+def _load_runner(path, format, device, num_threads=None):
+    if format == "torch":
+        return torch.export.load(path).module()
+    return OrtRunner(path, device, num_threads=num_threads)
+
+
+class OrtRunner:
+    """Runs an ONNX graph with ONNX Runtime's CPU execution provider, taking and returning torch tensors."""
+
+    def __init__(self, path, device="cpu", num_threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.device = device
+
+    def __call__(self, *inputs):
+        feed = {name: x.detach().cpu().numpy() for name, x in zip(self.input_names, inputs)}
+        return torch.from_numpy(self.session.run(None, feed)[0]).to(self.device)
+
+
+class _ExportedModule:
+    """
+    Stands in for an eager module: calls whose input shape has an exported
+    graph run the graph, anything else runs the eager module. Attribute
+    access (config, dtype, submodules...) goes to the eager module.
+    """
+
+    def __init__(self, module, runners):
+        self.module = module
+        self.runners = runners
+        self._lock = threading.Lock()
+        self.graph_calls = 0
+        self.eager_calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["module"], name)
+
+    def _runner(self, runners, x):
+        runner = runners.get(tuple(x.shape))
+        with self._lock:
+            if runner is None:
+                self.eager_calls += 1
+            else:
+                self.graph_calls += 1
+        return runner
+
+    def stats(self):
+        with self._lock:
+            return {
+                "graphs": len(self.runners),
+                "graph_calls": self.graph_calls,
+                "eager_calls": self.eager_calls,
+            }
+
+
+class ExportedUNet(_ExportedModule):
+    def __call__(self, sample, timestep, encoder_hidden_states=None, return_dict=True, **kwargs):
+        runner = self._runner(self.runners, sample)
+        if runner is None or kwargs:
+            return self.module(
+                sample, timestep, encoder_hidden_states=encoder_hidden_states, return_dict=return_dict, **kwargs
+            )
+        timestep = torch.as_tensor(timestep, device=sample.device).to(TIMESTEP_DTYPE).expand(sample.shape[0])
+        noise_pred = runner(sample, timestep).to(sample.dtype)
+        return UNet2DConditionOutput(sample=noise_pred) if return_dict else (noise_pred,)
+
+
+class ExportedVAE(_ExportedModule):
+    def __init__(self, module, encoders, decoders):
+        super().__init__(module, {})
+        self.encoders = encoders
+        self.decoders = decoders
+
+    def encode(self, x, return_dict=True):
+        runner = self._runner(self.encoders, x)
+        if runner is None:
+            return self.module.encode(x, return_dict=return_dict)
+        posterior = DiagonalGaussianDistribution(runner(x).to(x.dtype))
+        return AutoencoderKLOutput(latent_dist=posterior) if return_dict else (posterior,)
+
+    def decode(self, z, return_dict=True, **kwargs):
+        runner = self._runner(self.decoders, z)
+        if runner is None:
+            return self.module.decode(z, return_dict=return_dict, **kwargs)
+        sample = runner(z).to(z.dtype)
+        return DecoderOutput(sample=sample) if return_dict else (sample,)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "graphs": len(self.encoders) + len(self.decoders),
+                "graph_calls": self.graph_calls,
+                "eager_calls": self.eager_calls,
+            }
+
+
+def load_exported(directory, unet, vae, weight_dtype, device="cpu", num_threads=None):
+    """`(ExportedUNet, ExportedVAE)` over the graphs `export_pipeline` wrote to `directory`."""
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest["dtype"] != str(weight_dtype).replace("torch.", ""):
+        raise ValueError(
+            f"Graphs in {directory} were exported in {manifest['dtype']}, the pipeline runs in {weight_dtype}"
+        )
+    if manifest["format"] == "onnx" and weight_dtype == torch.bfloat16:
+        raise ValueError("ONNX graphs cannot run in bfloat16")
+    runners = {"unet": {}, "vae_encode": {}, "vae_decode": {}}
+    for graph in manifest["graphs"]:
+        runners[graph["name"]][tuple(graph["shape"])] = _load_runner(
+            os.path.join(directory, graph["file"]), manifest["format"], device, num_threads
+        )
+    return (
+        ExportedUNet(unet, runners["unet"]),
+        ExportedVAE(vae, runners["vae_encode"], runners["vae_decode"]),
+    )
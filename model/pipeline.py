@@ -1,6 +1,8 @@
+import contextlib
+import functools
 import inspect
 import os
-from typing import Union
+from typing import Optional, Union
 
 import PIL
 import numpy as np
@@ -15,10 +17,18 @@ from diffusers.utils.torch_utils import randn_tensor
 from huggingface_hub import snapshot_download
 from transformers import CLIPImageProcessor
 
-from model.attn_processor import SkipAttnProcessor
-from model.utils import get_trainable_module, init_adapter
+from model.attn_processor import ATTN_BACKENDS, SkipAttnProcessor
+from model.bundle import load_bundle
+from model.cpu_backend import bf16_supported, configure_threads, quantize_modules
+from model.deep_cache import DeepCache
+from model.exported import ExportedUNet, load_exported
+from model.samplers import get_sampler
+from model.token_merge import TokenMerging
+from model.vae_memory import BudgetedVAE
+from model.utils import get_trainable_module, init_adapter, strip_cross_attention, timed, timed_stage
 from utils import (
     compute_vae_encodings,
+    is_xformers_available,
     numpy_to_pil,
     prepare_image,
     prepare_mask_image,
@@ -27,6 +37,11 @@ from utils import (
 )
 
 
+@functools.lru_cache(maxsize=None)
+def _step_parameters(scheduler_cls):
+    return frozenset(inspect.signature(scheduler_cls.step).parameters)
+
+
 class CatVTONPipeline:
     def __init__(
         self,
@@ -38,46 +53,232 @@ class CatVTONPipeline:
         compile=False,
         skip_safety_check=False,
         use_tf32=False,
+        strip_cross_attn=False,
     ):
         self.device = device
         self.weight_dtype = weight_dtype
         self.skip_safety_check = skip_safety_check
+        # seconds per loading stage, for cold start reporting
+        self.load_timings = {}
         print("device: " + self.device)
         
-        self.vae = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse").to(
-            device, dtype=weight_dtype
-        )
+        with timed(self.load_timings, "vae"):
+            self.vae = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse").to(
+                device, dtype=weight_dtype
+            )
 
         if not skip_safety_check:
-            self.feature_extractor = CLIPImageProcessor.from_pretrained(
-                base_ckpt, subfolder="feature_extractor"
-            )
-            self.safety_checker = StableDiffusionSafetyChecker.from_pretrained(
-                base_ckpt, subfolder="safety_checker"
-            ).to(device, dtype=weight_dtype)
+            with timed(self.load_timings, "safety_checker"):
+                self.feature_extractor = CLIPImageProcessor.from_pretrained(
+                    base_ckpt, subfolder="feature_extractor"
+                )
+                self.safety_checker = StableDiffusionSafetyChecker.from_pretrained(
+                    base_ckpt, subfolder="safety_checker"
+                ).to(device, dtype=weight_dtype)
 
         self.noise_scheduler = DDIMScheduler.from_pretrained(
             base_ckpt, subfolder="scheduler"
         )
+        self._sampler_configs = {}
         
-        self.unet = UNet2DConditionModel.from_pretrained(
-            base_ckpt, subfolder="unet"
-        ).to(device, dtype=weight_dtype)
-        init_adapter(
-            self.unet, cross_attn_cls=SkipAttnProcessor
-        )  # Skip Cross-Attention
-        self.attn_modules = get_trainable_module(self.unet, "attention")
-        self.auto_attn_ckpt_load(attn_ckpt, attn_ckpt_version)
+        with timed(self.load_timings, "unet"):
+            self.unet = UNet2DConditionModel.from_pretrained(
+                base_ckpt, subfolder="unet"
+            ).to(device, dtype=weight_dtype)
+        with timed(self.load_timings, "attention_checkpoint"):
+            init_adapter(
+                self.unet, cross_attn_cls=SkipAttnProcessor
+            )  # Skip Cross-Attention
+            self.attn_modules = get_trainable_module(self.unet, "attention")
+            self.auto_attn_ckpt_load(attn_ckpt, attn_ckpt_version)
+        if strip_cross_attn:
+            # drop the skipped cross-attention weights (outputs are unchanged)
+            print(f"stripped {strip_cross_attention(self.unet)} cross-attention parameters")
+        self.deep_cache = None
+        self.token_merging = None
+        self.autocast_dtype = None
         # Pytorch 2.0 Compile
         if compile:
             self.unet = torch.compile(self.unet)
             self.vae = torch.compile(self.vae, mode="reduce-overhead")
+        self.budgeted_vae = BudgetedVAE(self.vae)
 
         # Enable TF32 for faster training on Ampere GPUs (A100 and RTX 30 series).
         if use_tf32:
             torch.set_float32_matmul_precision("high")
             torch.backends.cuda.matmul.allow_tf32 = True
 
+    @classmethod
+    def from_components(
+        cls,
+        vae,
+        unet,
+        noise_scheduler,
+        weight_dtype=torch.float32,
+        device="cuda",
+        strip_cross_attn=False,
+    ):
+        """
+        Builds a pipeline from already constructed modules without downloading
+        checkpoints, e.g. small randomly initialized ones for benchmarks. The
+        cross-attention layers of `unet` are replaced with `SkipAttnProcessor`
+        (or removed, with `strip_cross_attn`) and the safety check is skipped.
+        """
+        self = cls.__new__(cls)
+        self.device = device
+        self.weight_dtype = weight_dtype
+        self.skip_safety_check = True
+        self.safety_checker = None
+        self.load_timings = {}
+        self.vae = vae.to(device, dtype=weight_dtype)
+        self.noise_scheduler = noise_scheduler
+        self._sampler_configs = {}
+        self.unet = unet.to(device, dtype=weight_dtype)
+        init_adapter(self.unet, cross_attn_cls=SkipAttnProcessor)
+        self.attn_modules = get_trainable_module(self.unet, "attention")
+        if strip_cross_attn:
+            strip_cross_attention(self.unet)
+        self.deep_cache = None
+        self.token_merging = None
+        self.autocast_dtype = None
+        self.budgeted_vae = BudgetedVAE(self.vae)
+        return self
+
+    @classmethod
+    def from_bundle(cls, path, device="cuda", weight_dtype=None, strip_cross_attn=False):
+        """
+        Builds a pipeline from a `model.bundle.save_bundle` file: no downloads,
+        no checkpoint merging, and on CPU the weights are memory-mapped
+        rather than read. `weight_dtype` defaults to the bundle's; any other
+        dtype costs a cast. Stage times are in `load_timings`.
+        """
+        timings = {}
+        with timed(timings, "total"):
+            vae, unet, noise_scheduler, bundle_dtype = load_bundle(path, device, timings)
+            with timed(timings, "setup"):
+                self = cls.from_components(
+                    vae,
+                    unet,
+                    noise_scheduler,
+                    weight_dtype=weight_dtype or bundle_dtype,
+                    device=device,
+                    strip_cross_attn=strip_cross_attn,
+                )
+        self.load_timings = timings
+        return self
+
+    def enable_deep_cache(self, interval=3, depth=1):
+        """
+        Reuses the deep UNet features for `interval` steps and recomputes only
+        the outer `depth` levels in between (see `DeepCache`). An interval of
+        1 turns the cache off.
+        """
+        self.deep_cache = (
+            DeepCache(self.unet, interval, depth, unet_context=self.unet_context)
+            if interval > 1
+            else None
+        )
+
+    def enable_token_merging(self, ratios=(0.5,), priority_bonus=1.0):
+        """
+        Merges `ratios[level]` of the self-attention tokens at each UNet
+        resolution level (0 = latent resolution) before attention, preferring
+        the garment half and the person background (see `TokenMerging`).
+        All-zero ratios turn merging off.
+        """
+        self.token_merging = (
+            TokenMerging(ratios, priority_bonus=priority_bonus) if any(ratios) else None
+        )
+
+    def unet_context(self, sample):
+        """Context entered around each UNet pass over `sample`."""
+        stack = contextlib.ExitStack()
+        if self.autocast_dtype is not None:
+            stack.enter_context(torch.autocast(sample.device.type, dtype=self.autocast_dtype))
+        if self.token_merging is not None:
+            stack.enter_context(self.token_merging.context(sample))
+        return stack
+
+    def enable_cpu_backend(self, quantization="dynamic", bf16=None, channels_last=True, num_threads=None):
+        """
+        Sets up a float32 pipeline for CPU inference:
+
+        - `quantization`: `dynamic` runs the UNet linears as int8 GEMMs and
+          stores its conv weights in int8, `weight_only` stores both in int8
+          (see `quantize_modules`), `none` keeps float weights.
+        - `bf16`: runs the UNet under bf16 autocast; None enables it when the
+          CPU has native bf16 support.
+        - `channels_last`: NHWC memory format for the UNet and VAE convs.
+        - `num_threads`: intra-op threads (None keeps torch's default).
+
+        Quantization is applied in place and cannot be undone.
+        """
+        num_threads = configure_threads(num_threads)
+        if bf16 is None:
+            bf16 = bf16_supported()
+        self.autocast_dtype = torch.bfloat16 if bf16 else None
+        quantized = quantize_modules(
+            self.unet, quantization, compute_dtype=self.autocast_dtype or torch.float32
+        )
+        if channels_last:
+            self.unet.to(memory_format=torch.channels_last)
+            self.vae.to(memory_format=torch.channels_last)
+        print(
+            f"cpu backend: {quantized} modules quantized ({quantization}), "
+            f"bf16 autocast {bf16}, channels_last {channels_last}, {num_threads} threads"
+        )
+
+    def set_attn_backend(self, backend="sdpa", sdpa_kernels=None, chunk_size=1024, slice_size=None):
+        """
+        Switches the self-attention implementation of the UNet:
+
+        - `sdpa`: `F.scaled_dot_product_attention`, restricted to
+          `sdpa_kernels` (e.g. `["flash", "efficient"]`) if given.
+        - `chunked`: SDPA over `chunk_size` queries (and `slice_size` of the
+          batch x heads) at a time, bounding the attention score memory.
+        - `xformers`: `xformers.ops.memory_efficient_attention`.
+
+        Only the processors change, so loaded attention weights are kept.
+        """
+        if backend not in ATTN_BACKENDS:
+            raise ValueError(
+                f"Unknown attention backend: {backend} (available: {', '.join(ATTN_BACKENDS)})"
+            )
+        kwargs = {"sdpa_kernels": sdpa_kernels}
+        if backend == "chunked":
+            kwargs.update(chunk_size=chunk_size, slice_size=slice_size)
+        elif backend == "xformers":
+            is_xformers_available()  # raises if xformers is missing
+        init_adapter(self.unet, cross_attn_cls=SkipAttnProcessor, attn_backend=backend, **kwargs)
+
+    def enable_vae_memory_budget(self, budget_mb, tile_size=None):
+        """
+        Keeps VAE encode/decode activations under `budget_mb` by slicing the
+        batch or tiling each image when needed (see `BudgetedVAE`). A budget
+        of 0 or None runs every batch in one pass and leaves the VAE as it is.
+        `tile_size` overrides the VAE's tile size in pixels under a budget.
+        """
+        self.budgeted_vae = BudgetedVAE(self.vae, budget_mb, tile_size)
+
+    def use_exported(self, directory, num_threads=None):
+        """
+        Runs the UNet and VAE through the graphs `model.exported.export_pipeline`
+        wrote to `directory` (ONNX Runtime on CPU or `torch.export`). Inputs
+        of a shape that was not exported still run the eager modules. The
+        graphs bake in the attention setup at export time, so token merging,
+        attention backends and DeepCache only apply to eager calls.
+        """
+        self.unet, self.vae = load_exported(
+            directory, self.unet, self.vae, self.weight_dtype, self.device, num_threads
+        )
+        self.budgeted_vae.vae = self.vae
+
+    def exported_stats(self):
+        """Graph vs eager call counts, or None without `use_exported`."""
+        if not isinstance(self.unet, ExportedUNet):
+            return None
+        return {"unet": self.unet.stats(), "vae": self.vae.stats()}
+
     def auto_attn_ckpt_load(self, attn_ckpt, version):
         sub_folder = {
             "mix": "mix-48k-1024",
@@ -109,72 +310,165 @@ class CatVTONPipeline:
         return image, has_nsfw_concept
 
     def check_inputs(self, image, condition_image, mask, width, height):
-        if (
-            isinstance(image, torch.Tensor)
-            and isinstance(condition_image, torch.Tensor)
-            and isinstance(mask, torch.Tensor)
-        ):
-            return image, condition_image, mask
-        assert image.size == mask.size, "Image and mask must have the same size"
-        image = resize_and_crop(image, (width, height))
-        mask = resize_and_crop(mask, (width, height))
-        condition_image = resize_and_padding(condition_image, (width, height))
+        # image/mask or condition_image may be None when their latents are precomputed
+        if image is not None and not isinstance(image, torch.Tensor):
+            assert image.size == mask.size, "Image and mask must have the same size"
+            image = resize_and_crop(image, (width, height))
+            mask = resize_and_crop(mask, (width, height))
+        if condition_image is not None and not isinstance(condition_image, torch.Tensor):
+            condition_image = resize_and_padding(condition_image, (width, height))
         return image, condition_image, mask
 
-    def prepare_extra_step_kwargs(self, generator, eta):
+    def prepare_extra_step_kwargs(self, generator, eta, noise_scheduler=None):
         # prepare extra kwargs for the scheduler step, since not all schedulers have the same signature
         # eta (η) is only used with the DDIMScheduler, it will be ignored for other schedulers.
         # eta corresponds to η in DDIM paper: https://arxiv.org/abs/2010.02502
         # and should be between [0, 1]
+        if noise_scheduler is None:
+            noise_scheduler = self.noise_scheduler
 
-        accepts_eta = "eta" in set(
-            inspect.signature(self.noise_scheduler.step).parameters.keys()
-        )
+        # the signature lookup is cached per scheduler class
+        step_parameters = _step_parameters(type(noise_scheduler))
         extra_step_kwargs = {}
-        if accepts_eta:
+        if "eta" in step_parameters:
             extra_step_kwargs["eta"] = eta
 
         # check if the scheduler accepts generator
-        accepts_generator = "generator" in set(
-            inspect.signature(self.noise_scheduler.step).parameters.keys()
-        )
-        if accepts_generator:
+        if "generator" in step_parameters:
             extra_step_kwargs["generator"] = generator
         return extra_step_kwargs
 
+    def create_scheduler(self, sampler=None):
+        """
+        New scheduler instance for one request, so concurrent requests never
+        share timesteps or multistep solver history. `sampler` names an entry
+        of `model.samplers.SAMPLERS`; None keeps the pipeline's own scheduler.
+        """
+        if sampler is None:
+            return self.noise_scheduler.from_config(self.noise_scheduler.config)
+        scheduler_cls, overrides = get_sampler(sampler)
+        config = self._sampler_configs.get(sampler)
+        if config is None:
+            # translate the base config once; later requests reuse the clean config
+            config = scheduler_cls.from_config(self.noise_scheduler.config, **overrides).config
+            self._sampler_configs[sampler] = config
+        return scheduler_cls.from_config(config)
+
     @torch.no_grad()
-    def __call__(
-        self,
-        image: Union[PIL.Image.Image, torch.Tensor],
-        condition_image: Union[PIL.Image.Image, torch.Tensor],
-        mask: Union[PIL.Image.Image, torch.Tensor],
-        num_inference_steps: int = 50,
-        guidance_scale: float = 2.5,
-        height: int = 1024,
-        width: int = 768,
-        generator=None,
-        eta=1.0,
-        **kwargs,
-    ):
-        concat_dim = -2  # FIXME: y axis concat
-        # Prepare inputs to Tensor
-        image, condition_image, mask = self.check_inputs(
-            image, condition_image, mask, width, height
-        )
-        image = prepare_image(image).to(self.device, dtype=self.weight_dtype)
+    def encode_condition(self, condition_image):
+        """
+        Encodes an already resized garment image (or batch) into its
+        condition latent. The result can be passed back as `condition_latent`.
+        """
         condition_image = prepare_image(condition_image).to(
             self.device, dtype=self.weight_dtype
         )
+        with timed_stage("vae_encode", items=condition_image.shape[0]):
+            return compute_vae_encodings(condition_image, self.budgeted_vae)
+
+    @torch.no_grad()
+    def encode_person(self, image, mask):
+        """
+        Encodes an already resized person image and mask (or batches) into
+        `(masked_latent, mask_latent)`. The result can be passed back as
+        `masked_latent` and `mask_latent`.
+        """
+        image = prepare_image(image).to(self.device, dtype=self.weight_dtype)
         mask = prepare_mask_image(mask).to(self.device, dtype=self.weight_dtype)
         # Mask image
         masked_image = image * (mask < 0.5)
         # VAE encoding
-        masked_latent = compute_vae_encodings(masked_image, self.vae)
-        condition_latent = compute_vae_encodings(condition_image, self.vae)
+        with timed_stage("vae_encode", items=masked_image.shape[0]):
+            masked_latent = compute_vae_encodings(masked_image, self.budgeted_vae)
         mask_latent = torch.nn.functional.interpolate(
             mask, size=masked_latent.shape[-2:], mode="nearest"
         )
-        del image, mask, condition_image
+        return masked_latent, mask_latent
+
+    def encode_inputs(
+        self,
+        image,
+        condition_image,
+        mask,
+        width,
+        height,
+        condition_latent=None,
+        masked_latent=None,
+        mask_latent=None,
+    ):
+        """
+        Encodes the person image, garment image and mask into
+        `(masked_latent, condition_latent, mask_latent)`. Precomputed latents
+        are used as given, and the images they replace may be None.
+        """
+        if condition_latent is not None:
+            condition_image = None
+        if masked_latent is not None and mask_latent is not None:
+            image, mask = None, None
+        # Prepare inputs to Tensor
+        image, condition_image, mask = self.check_inputs(
+            image, condition_image, mask, width, height
+        )
+        if image is None:
+            masked_latent = masked_latent.to(self.device, dtype=self.weight_dtype)
+            mask_latent = mask_latent.to(self.device, dtype=self.weight_dtype)
+        else:
+            masked_latent, mask_latent = self.encode_person(image, mask)
+        if condition_latent is None:
+            condition_latent = self.encode_condition(condition_image)
+        else:
+            condition_latent = condition_latent.to(self.device, dtype=self.weight_dtype)
+        return masked_latent, condition_latent, mask_latent
+
+    def init_denoise_state(
+        self,
+        masked_latent,
+        condition_latent,
+        mask_latent,
+        num_inference_steps: int = 50,
+        guidance_scale: float = 2.5,
+        generator=None,
+        eta=1.0,
+        guidance_interval=(0.0, 1.0),
+        sampler=None,
+        coarse_scale=None,
+        coarse_until=0.5,
+    ):
+        """
+        Builds the per-request `DenoiseState` from encoded latents. Each state
+        owns its own scheduler instance, so states can be stepped together by
+        `denoise_step` even when they are at different timesteps.
+
+        A single person (`masked_latent`/`mask_latent` with batch size 1) is
+        broadcast across a batch of garments in `condition_latent`.
+
+        `guidance_interval` is the `(start, end)` fraction of the denoising
+        steps that use classifier-free guidance; the other steps run only the
+        conditional branch, at half the UNet batch.
+
+        `sampler` selects the scheduler from `model.samplers.SAMPLERS` (None
+        for the pipeline's own); `eta` only applies to DDIM.
+
+        With `coarse_scale` (e.g. 0.5), the first `coarse_until` fraction of
+        the steps runs at that fraction of the latent resolution; the state
+        then switches to full resolution (see `_upscale_state`).
+        """
+        start, end = guidance_interval
+        assert 0.0 <= start <= end <= 1.0, "guidance_interval must be within [0, 1]"
+        assert num_inference_steps >= 1, "num_inference_steps must be at least 1"
+        assert 0.0 <= coarse_until <= 1.0, "coarse_until must be within [0, 1]"
+        concat_dim = -2  # FIXME: y axis concat
+        batch_size = max(masked_latent.shape[0], condition_latent.shape[0])
+        if masked_latent.shape[0] == 1 and batch_size > 1:
+            masked_latent = masked_latent.expand(batch_size, -1, -1, -1)
+            mask_latent = mask_latent.expand(batch_size, -1, -1, -1)
+        assert (
+            masked_latent.shape[0] == condition_latent.shape[0]
+        ), "Person and garment latents must have the same batch size"
+        if isinstance(generator, list):
+            assert (
+                len(generator) == batch_size
+            ), "Number of generators must match the batch size"
         # Concatenate latents
         masked_latent_concat = torch.cat(
             [masked_latent, condition_latent], dim=concat_dim
@@ -182,17 +476,6 @@ class CatVTONPipeline:
         mask_latent_concat = torch.cat(
             [mask_latent, torch.zeros_like(mask_latent)], dim=concat_dim
         )
-        # Prepare noise
-        latents = randn_tensor(
-            masked_latent_concat.shape,
-            generator=generator,
-            device=masked_latent_concat.device,
-            dtype=self.weight_dtype,
-        )
-        # Prepare timesteps
-        self.noise_scheduler.set_timesteps(num_inference_steps, device=self.device)
-        timesteps = self.noise_scheduler.timesteps
-        latents = latents * self.noise_scheduler.init_noise_sigma
         # Classifier-Free Guidance
         if do_classifier_free_guidance := (guidance_scale > 1.0):
             masked_latent_concat = torch.cat(
@@ -205,64 +488,302 @@ class CatVTONPipeline:
                 ]
             )
             mask_latent_concat = torch.cat([mask_latent_concat] * 2)
+        # Coarse-to-fine: the early steps run on downscaled inputs
+        full_resolution = None
+        switch_step = round(num_inference_steps * coarse_until)
+        coarse_size = self._coarse_size(masked_latent.shape[-2:], coarse_scale)
+        if coarse_size is not None and 0 < switch_step < num_inference_steps:
+            full_resolution = dict(
+                masked_latent_concat=masked_latent_concat,
+                mask_latent_concat=mask_latent_concat,
+                sampler=sampler,
+                generator=generator,
+                eta=eta,
+            )
+            masked_latent_concat = _resize_halves(masked_latent_concat, coarse_size, "area")
+            # a latent cell stays masked if any of the cells it covers is
+            mask_latent_concat = _resize_halves(mask_latent_concat, coarse_size, "max")
+        # Prepare noise
+        latents = randn_tensor(
+            (batch_size, *masked_latent_concat.shape[1:]),
+            generator=generator,
+            device=masked_latent_concat.device,
+            dtype=self.weight_dtype,
+        )
+        # Prepare timesteps
+        noise_scheduler = self.create_scheduler(sampler)
+        noise_scheduler.set_timesteps(num_inference_steps, device=self.device)
+        latents = latents * noise_scheduler.init_noise_sigma
 
-        # Denoising loop
-        extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
-        num_warmup_steps = (
-            len(timesteps) - num_inference_steps * self.noise_scheduler.order
+        return DenoiseState(
+            latents=latents,
+            noise_scheduler=noise_scheduler,
+            masked_latent_concat=masked_latent_concat,
+            mask_latent_concat=mask_latent_concat,
+            guidance_scale=guidance_scale if do_classifier_free_guidance else None,
+            guidance_interval=guidance_interval,
+            extra_step_kwargs=self.prepare_extra_step_kwargs(
+                generator, eta, noise_scheduler
+            ),
+            switch_step=switch_step if full_resolution is not None else None,
+            full_resolution=full_resolution,
         )
-        with tqdm.tqdm(total=num_inference_steps) as progress_bar:
-            for i, t in enumerate(timesteps):
+
+    def _coarse_size(self, size, scale):
+        """
+        Latent `(height, width)` of one half at `scale`, rounded to a size
+        the UNet can downsample, or None if that is not smaller than `size`.
+        """
+        if not scale or scale >= 1.0:
+            return None
+        multiple = 2 ** (len(self.unet.config.block_out_channels) - 1)
+        coarse = tuple(max(round(x * scale / multiple), 1) * multiple for x in size)
+        if coarse[0] >= size[0] and coarse[1] >= size[1]:
+            return None
+        return coarse
+
+    def _upscale_state(self, state, original_sample):
+        """
+        Moves a coarse state to full resolution before its next step. The
+        clean latents predicted at the last coarse step are upsampled and
+        noised again to the next timestep with a fresh scheduler, since
+        multistep solver history does not carry over across resolutions.
+        """
+        full_resolution = state.full_resolution
+        noise_scheduler = self.create_scheduler(full_resolution["sampler"])
+        noise_scheduler.set_timesteps(len(state.timesteps), device=self.device)
+        mask_latent_concat = full_resolution["mask_latent_concat"]
+        height, width = mask_latent_concat.shape[-2:]
+        original_sample = _resize_halves(original_sample, (height // 2, width), "bilinear")
+        noise = randn_tensor(
+            original_sample.shape,
+            generator=full_resolution["generator"],
+            device=original_sample.device,
+            dtype=original_sample.dtype,
+        )
+        t = noise_scheduler.timesteps[state.step_index]
+        state.latents = noise_scheduler.add_noise(original_sample, noise, t.reshape(1))
+        state.noise_scheduler = noise_scheduler
+        state.timesteps = noise_scheduler.timesteps
+        state.masked_latent_concat = full_resolution["masked_latent_concat"]
+        state.mask_latent_concat = mask_latent_concat
+        state.extra_step_kwargs = self.prepare_extra_step_kwargs(
+            full_resolution["generator"], full_resolution["eta"], noise_scheduler
+        )
+        state.deep_features = None
+        state.switch_step = state.full_resolution = None
+
+    def denoise_step(self, states):
+        """
+        Advances every state in `states` by one timestep. States with the same
+        latent shape share a single UNet forward pass, each at its own timestep.
+        """
+        groups = {}
+        for state in states:
+            assert not state.done, "State has already finished denoising"
+            groups.setdefault(tuple(state.latents.shape[1:]), []).append(state)
+
+        for group in groups.values():
+            model_inputs, model_timesteps = [], []
+            for state in group:
+                t = state.timesteps[state.step_index]
                 # expand the latents if we are doing classifier free guidance
+                if state.use_guidance:
+                    non_inpainting_latent_model_input = torch.cat([state.latents] * 2)
+                    mask_latent_concat = state.mask_latent_concat
+                    masked_latent_concat = state.masked_latent_concat
+                else:
+                    # conditional branch only: the second half of the CFG batch
+                    batch_size = state.latents.shape[0]
+                    non_inpainting_latent_model_input = state.latents
+                    mask_latent_concat = state.mask_latent_concat[-batch_size:]
+                    masked_latent_concat = state.masked_latent_concat[-batch_size:]
                 non_inpainting_latent_model_input = (
-                    torch.cat([latents] * 2) if do_classifier_free_guidance else latents
-                )
-                non_inpainting_latent_model_input = (
-                    self.noise_scheduler.scale_model_input(
+                    state.noise_scheduler.scale_model_input(
                         non_inpainting_latent_model_input, t
                     )
                 )
                 # prepare the input for the inpainting model
-                inpainting_latent_model_input = torch.cat(
-                    [
-                        non_inpainting_latent_model_input,
-                        mask_latent_concat,
-                        masked_latent_concat,
-                    ],
-                    dim=1,
+                model_inputs.append(
+                    torch.cat(
+                        [
+                            non_inpainting_latent_model_input,
+                            mask_latent_concat,
+                            masked_latent_concat,
+                        ],
+                        dim=1,
+                    )
+                )
+                model_timesteps.append(
+                    t.to(self.device).repeat(non_inpainting_latent_model_input.shape[0])
                 )
-                # predict the noise residual
-                noise_pred = self.unet(
-                    inpainting_latent_model_input,
-                    t.to(self.device),
-                    encoder_hidden_states=None,  # FIXME
-                    return_dict=False,
-                )[0]
+            # predict the noise residual
+            if self.deep_cache is not None:
+                noise_preds = self.deep_cache(group, model_inputs, model_timesteps)
+            else:
+                model_input = torch.cat(model_inputs)
+                with self.unet_context(model_input):
+                    noise_preds = self.unet(
+                        model_input,
+                        torch.cat(model_timesteps),
+                        encoder_hidden_states=None,  # FIXME
+                        return_dict=False,
+                    )[0].split([x.shape[0] for x in model_inputs])
+
+            for state, noise_pred in zip(group, noise_preds):
+                t = state.timesteps[state.step_index]
+                # the UNet may have run under autocast
+                noise_pred = noise_pred.to(state.latents.dtype)
                 # perform guidance
-                if do_classifier_free_guidance:
+                if state.use_guidance:
                     noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
-                    noise_pred = noise_pred_uncond + guidance_scale * (
+                    noise_pred = noise_pred_uncond + state.guidance_scale * (
                         noise_pred_text - noise_pred_uncond
                     )
                 # compute the previous noisy sample x_t -> x_t-1
-                latents = self.noise_scheduler.step(
-                    noise_pred, t, latents, **extra_step_kwargs
-                ).prev_sample
-                # call the callback, if provided
-                if i == len(timesteps) - 1 or (
-                    (i + 1) > num_warmup_steps
-                    and (i + 1) % self.noise_scheduler.order == 0
-                ):
-                    progress_bar.update()
+                output = state.noise_scheduler.step(
+                    noise_pred, t, state.latents, **state.extra_step_kwargs
+                )
+                if state.switch_step == state.step_index + 1:
+                    original_sample = getattr(output, "pred_original_sample", None)
+                    if original_sample is None:
+                        original_sample = _predict_original_sample(
+                            state.noise_scheduler, state.latents, noise_pred, t
+                        )
+                state.latents = output.prev_sample
+                state.step_index += 1
+                if state.switch_step == state.step_index:
+                    self._upscale_state(state, original_sample)
+
+    @torch.no_grad()
+    def denoise(self, states):
+        """Runs `denoise_step` until every state in `states` is done."""
+        with tqdm.tqdm(total=max(len(state.timesteps) for state in states)) as progress_bar:
+            while not all(state.done for state in states):
+                active = [state for state in states if not state.done]
+                with timed_stage("denoise_step", items=sum(state.latents.shape[0] for state in active)):
+                    self.denoise_step(active)
+                progress_bar.update()
 
+    @torch.no_grad()
+    def decode_latents(self, latents):
+        concat_dim = -2  # FIXME: y axis concat
         # Decode the final latents
         latents = latents.split(latents.shape[concat_dim] // 2, dim=concat_dim)[0]
         latents = 1 / self.vae.config.scaling_factor * latents
-        image = self.vae.decode(latents.to(self.device, dtype=self.weight_dtype)).sample
-        image = (image / 2 + 0.5).clamp(0, 1)
-        # we always cast to float32 as this does not cause significant overhead and is compatible with bfloat16
-        image = image.cpu().permute(0, 2, 3, 1).float().numpy()
-        image = numpy_to_pil(image)
+        with timed_stage("decode", items=latents.shape[0]):
+            image = self.budgeted_vae.decode(
+                latents.to(self.device, dtype=self.weight_dtype)
+            ).sample
+            image = (image / 2 + 0.5).clamp(0, 1)
+            # we always cast to float32 as this does not cause significant overhead and is compatible with bfloat16
+            image = image.cpu().permute(0, 2, 3, 1).float().numpy()
+        return numpy_to_pil(image)
+
+    @staticmethod
+    def _sample_groups(batch_size, **settings):
+        """
+        Splits a batch into groups of samples with the same denoising
+        settings. Each setting is either one value for the whole batch or a
+        list with one value per sample. Yields `(indices, settings)`, with
+        `indices` None for the whole batch.
+        """
+        for name, value in settings.items():
+            if isinstance(value, list):
+                assert (
+                    len(value) == batch_size
+                ), f"Number of {name} values must match the batch size"
+        groups = {}
+        for i in range(batch_size):
+            key = tuple(
+                value[i] if isinstance(value, list) else value
+                for value in settings.values()
+            )
+            groups.setdefault(key, []).append(i)
+        for key, indices in groups.items():
+            yield (
+                None if len(groups) == 1 else indices,
+                dict(zip(settings, key)),
+            )
+
+    @torch.no_grad()
+    def __call__(
+        self,
+        image: Optional[Union[PIL.Image.Image, torch.Tensor]],
+        condition_image: Optional[Union[PIL.Image.Image, torch.Tensor]],
+        mask: Optional[Union[PIL.Image.Image, torch.Tensor]],
+        num_inference_steps: int = 50,
+        guidance_scale: float = 2.5,
+        height: int = 1024,
+        width: int = 768,
+        generator=None,
+        eta=1.0,
+        condition_latent: Optional[torch.Tensor] = None,
+        masked_latent: Optional[torch.Tensor] = None,
+        mask_latent: Optional[torch.Tensor] = None,
+        guidance_interval=(0.0, 1.0),
+        sampler=None,
+        coarse_scale=None,
+        coarse_until=0.5,
+        **kwargs,
+    ):
+        """
+        `num_inference_steps`, `guidance_interval`, `sampler`, `coarse_scale`
+        and `coarse_until` (see `init_denoise_state`) are either
+        one value for the whole batch or a list with one value per sample;
+        samples with different settings get their own `DenoiseState` but
+        still share each UNet pass.
+        """
+        masked_latent, condition_latent, mask_latent = self.encode_inputs(
+            image,
+            condition_image,
+            mask,
+            width,
+            height,
+            condition_latent=condition_latent,
+            masked_latent=masked_latent,
+            mask_latent=mask_latent,
+        )
+        del image, mask, condition_image
+        if isinstance(guidance_interval[0], (list, tuple)):
+            guidance_interval = [tuple(interval) for interval in guidance_interval]
+        else:
+            guidance_interval = tuple(guidance_interval)
+        states = []
+        for indices, settings in self._sample_groups(
+            max(masked_latent.shape[0], condition_latent.shape[0]),
+            num_inference_steps=num_inference_steps,
+            guidance_interval=guidance_interval,
+            sampler=sampler,
+            coarse_scale=coarse_scale,
+            coarse_until=coarse_until,
+        ):
+            group_generator = generator
+            if indices is not None and isinstance(generator, list):
+                group_generator = [generator[i] for i in indices]
+            state = self.init_denoise_state(
+                *[
+                    # a batch-1 person is broadcast by init_denoise_state
+                    x if indices is None or x.shape[0] == 1 else x[indices]
+                    for x in (masked_latent, condition_latent, mask_latent)
+                ],
+                guidance_scale=guidance_scale,
+                generator=group_generator,
+                eta=eta,
+                **settings,
+            )
+            states.append((indices, state))
+
+        # Denoising loop (states with different settings share each UNet pass)
+        self.denoise([state for _, state in states])
+
+        if len(states) == 1:
+            image = self.decode_latents(states[0][1].latents)
+        else:
+            image = [None] * sum(len(indices) for indices, _ in states)
+            for indices, state in states:
+                for i, result in zip(indices, self.decode_latents(state.latents)):
+                    image[i] = result
 
         # Safety Check
         if not self.skip_safety_check:
@@ -277,3 +798,77 @@ class CatVTONPipeline:
                 if not_safe:
                     image[i] = nsfw_image
         return image
+
+
+def _resize_halves(x, size, mode):
+    """
+    Resizes the person and garment halves of a y-concatenated latent
+    separately, each to `size`, so no output cell mixes the two.
+    """
+    halves = x.chunk(2, dim=-2)
+    if mode == "max":
+        resized = [torch.nn.functional.adaptive_max_pool2d(half, size) for half in halves]
+    else:
+        resized = [
+            torch.nn.functional.interpolate(half.float(), size=size, mode=mode).to(x.dtype)
+            for half in halves
+        ]
+    return torch.cat(resized, dim=-2)
+
+
+def _predict_original_sample(noise_scheduler, sample, model_output, t):
+    """x_0 predicted from a variance preserving `sample` at timestep `t`."""
+    alpha_prod_t = noise_scheduler.alphas_cumprod.to(sample.device)[int(t)]
+    beta_prod_t = 1 - alpha_prod_t
+    if noise_scheduler.config.prediction_type == "v_prediction":
+        return alpha_prod_t**0.5 * sample - beta_prod_t**0.5 * model_output
+    return (sample - beta_prod_t**0.5 * model_output) / alpha_prod_t**0.5
+
+
+class DenoiseState:
+    """
+    Denoising progress of one request: its latents, scheduler instance,
+    step count, guidance settings and generator-bound step kwargs.
+    """
+
+    def __init__(
+        self,
+        latents,
+        noise_scheduler,
+        masked_latent_concat,
+        mask_latent_concat,
+        guidance_scale=None,
+        guidance_interval=(0.0, 1.0),
+        extra_step_kwargs=None,
+        switch_step=None,
+        full_resolution=None,
+    ):
+        self.latents = latents
+        self.noise_scheduler = noise_scheduler
+        self.timesteps = noise_scheduler.timesteps
+        self.masked_latent_concat = masked_latent_concat
+        self.mask_latent_concat = mask_latent_concat
+        self.guidance_scale = guidance_scale
+        self.guidance_interval = guidance_interval
+        self.extra_step_kwargs = extra_step_kwargs or {}
+        self.step_index = 0
+        # deep UNet features kept by `DeepCache` and the step they came from
+        self.deep_features = None
+        self.deep_features_step = None
+        # coarse-to-fine: the step that switches to full resolution and the
+        # full resolution inputs (None once switched)
+        self.switch_step = switch_step
+        self.full_resolution = full_resolution
+
+    @property
+    def done(self):
+        return self.step_index >= len(self.timesteps)
+
+    @property
+    def use_guidance(self):
+        """Whether the current step runs classifier-free guidance."""
+        if self.guidance_scale is None:
+            return False
+        start, end = self.guidance_interval
+        progress = self.step_index / len(self.timesteps)
+        return start <= progress < end
@@ -0,0 +1,26 @@
+from diffusers import (
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerDiscreteScheduler,
+    UniPCMultistepScheduler,
+)
+
+# name -> (scheduler class, config overrides applied on top of the base scheduler config)
+SAMPLERS = {
+    "ddim": (DDIMScheduler, {}),
+    "dpmsolver++": (
+        DPMSolverMultistepScheduler,
+        {"algorithm_type": "dpmsolver++", "solver_order": 2},
+    ),
+    "unipc": (UniPCMultistepScheduler, {}),
+    "euler": (EulerDiscreteScheduler, {}),
+}
+
+
+def get_sampler(name):
+    try:
+        return SAMPLERS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown sampler: {name} (available: {', '.join(SAMPLERS)})"
+        ) from None
@@ -0,0 +1,167 @@
+import contextlib
+import math
+import threading
+
+import torch
+import torch.nn.functional as F
+
+_local = threading.local()
+
+
+class TokenMerging:
+    """
+    Token merging for self-attention (ToMe for SD, https://arxiv.org/abs/2303.17604).
+
+    Before attention, the `ratios[level]` fraction of the tokens at UNet
+    resolution `level` (0 = latent resolution) that are most similar to
+    another token are averaged into it; after attention the merged tokens
+    get copies of the result. Levels past the end of `ratios` are left
+    alone. One destination token is kept per `stride` x `stride` cell.
+
+    Tokens are ranked by similarity plus `priority_bonus` times their merge
+    priority, which `context` derives from the mask channel of the UNet
+    input: 1 in the garment half and the person background, 0 inside the
+    person mask. So redundant tokens are taken from the area the model
+    only reads before the area it repaints.
+    """
+
+    def __init__(self, ratios=(0.5,), stride=2, priority_bonus=1.0, seed=0):
+        assert all(0.0 <= ratio < 1.0 for ratio in ratios), "ratios must be in [0, 1)"
+        self.ratios = tuple(ratios)
+        self.stride = stride
+        self.priority_bonus = priority_bonus
+        self.seed = seed
+        self._dst_masks = {}
+
+    @contextlib.contextmanager
+    def context(self, model_input):
+        """
+        Enables merging in the attention processors of this thread for one
+        UNet call on `model_input` (`(B, 9, H, W)`, channel 4 is the mask).
+        """
+        previous = getattr(_local, "context", None)
+        _local.context = _MergeContext(self, model_input)
+        try:
+            yield
+        finally:
+            _local.context = previous
+
+    def dst_mask(self, height, width, device):
+        """`(height * width,)` bool mask of the destination tokens, one random token per cell."""
+        key = (height, width, str(device))
+        if key not in self._dst_masks:
+            cells_y, cells_x = height // self.stride, width // self.stride
+            # a fixed seed keeps the pattern (and so the results) reproducible
+            generator = torch.Generator().manual_seed(self.seed)
+            choice = torch.randint(self.stride**2, (cells_y, cells_x), generator=generator)
+            cell = torch.zeros(cells_y, cells_x, self.stride**2, dtype=torch.bool)
+            cell.scatter_(2, choice[..., None], True)
+            cell = cell.view(cells_y, cells_x, self.stride, self.stride).transpose(1, 2)
+            mask = torch.zeros(height, width, dtype=torch.bool)
+            mask[: cells_y * self.stride, : cells_x * self.stride] = cell.reshape(
+                cells_y * self.stride, cells_x * self.stride
+            )
+            self._dst_masks[key] = mask.flatten().to(device)
+        return self._dst_masks[key]
+
+
+class _MergeContext:
+    def __init__(self, token_merging, model_input):
+        self.token_merging = token_merging
+        self.latent_size = model_input.shape[-2:]
+        self.priority = 1.0 - model_input[:, 4:5].float()
+        self._priorities = {}
+
+    def level(self, num_tokens):
+        """`(level, height, width)` of a token sequence, or None if it is not a UNet feature map."""
+        height, width = self.latent_size
+        scale = round(math.sqrt(height * width / num_tokens))
+        if scale < 1 or scale & (scale - 1):
+            return None
+        height, width = -(-height // scale), -(-width // scale)
+        if height * width != num_tokens:
+            return None
+        return int(math.log2(scale)), height, width
+
+    def priority_at(self, height, width):
+        if (height, width) not in self._priorities:
+            self._priorities[(height, width)] = F.adaptive_avg_pool2d(
+                self.priority, (height, width)
+            ).flatten(1)
+        return self._priorities[(height, width)]
+
+
+def token_merge_fns(hidden_states):
+    """
+    `(merge, unmerge)` for `(B, N, C)` self-attention inputs when a
+    `TokenMerging.context` is active on this thread and merging applies at
+    this resolution, otherwise None.
+    """
+    context = getattr(_local, "context", None)
+    if context is None:
+        return None
+    level = context.level(hidden_states.shape[1])
+    if level is None:
+        return None
+    level, height, width = level
+    ratios = context.token_merging.ratios
+    ratio = ratios[level] if level < len(ratios) else 0.0
+    num_merged = int(hidden_states.shape[1] * ratio)
+    if num_merged <= 0:
+        return None
+    priority = None
+    if context.token_merging.priority_bonus and context.priority.shape[0] == hidden_states.shape[0]:
+        priority = context.token_merging.priority_bonus * context.priority_at(height, width)
+    return bipartite_soft_matching(
+        hidden_states,
+        context.token_merging.dst_mask(height, width, hidden_states.device),
+        num_merged,
+        priority,
+    )
+
+
+def bipartite_soft_matching(x, dst_mask, r, priority=None):
+    """
+    Pairs every source token of `x` (`(B, N, C)`; sources are the tokens
+    outside `dst_mask`) with its most similar destination token and picks
+    the `r` best pairs to merge, ranked by cosine similarity plus
+    `priority` (`(B, N)`). Returns `(merge, unmerge)`.
+    """
+    batch_size, num_tokens, _ = x.shape
+    dst_idx_all = dst_mask.nonzero()[:, 0]
+    src_idx_all = (~dst_mask).nonzero()[:, 0]
+    r = min(r, len(src_idx_all))
+
+    with torch.no_grad():
+        metric = x / x.norm(dim=-1, keepdim=True)
+        scores = metric[:, src_idx_all] @ metric[:, dst_idx_all].transpose(-1, -2)
+        node_max, node_idx = scores.max(dim=-1)
+        if priority is not None:
+            node_max = node_max + priority[:, src_idx_all].to(node_max.dtype)
+        edge_idx = node_max.argsort(dim=-1, descending=True)
+        unm_idx = edge_idx[:, r:]  # sources kept, indices into the sources
+        src_idx = edge_idx[:, :r]  # sources merged
+        dst_idx = node_idx.gather(1, src_idx)  # their destinations, indices into the destinations
+
+    def merge(x):
+        channels = x.shape[-1]
+        src, dst = x[:, src_idx_all], x[:, dst_idx_all]
+        unm = src.gather(1, unm_idx[..., None].expand(-1, -1, channels))
+        src = src.gather(1, src_idx[..., None].expand(-1, -1, channels))
+        dst = dst.scatter_reduce(
+            1, dst_idx[..., None].expand(-1, -1, channels), src, reduce="mean"
+        )
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x):
+        channels = x.shape[-1]
+        num_unm = unm_idx.shape[1]
+        unm, dst = x[:, :num_unm], x[:, num_unm:]
+        src = dst.gather(1, dst_idx[..., None].expand(-1, -1, channels))
+        out = x.new_empty(batch_size, num_tokens, channels)
+        out[:, dst_idx_all] = dst
+        out.scatter_(1, src_idx_all[unm_idx][..., None].expand(-1, -1, channels), unm)
+        out.scatter_(1, src_idx_all[src_idx][..., None].expand(-1, -1, channels), src)
+        return out
+
+    return merge, unmerge
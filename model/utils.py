@@ -1,14 +1,20 @@
+import contextlib
 import os
 import json
+import time
 import torch
-from model.attn_processor import AttnProcessor2_0, SkipAttnProcessor 
+from diffusers.models.attention_processor import Attention
+from model.attn_processor import ATTN_BACKENDS, SkipAttnProcessor
 
 
 def init_adapter(unet, 
                  cross_attn_cls=SkipAttnProcessor,
                  self_attn_cls=None,
                  cross_attn_dim=None, 
+                 attn_backend="sdpa",
                  **kwargs):
+    # `attn_backend` picks the self-attention processor from ATTN_BACKENDS
+    # (sdpa, chunked, xformers) when `self_attn_cls` is not given
     if cross_attn_dim is None:
         cross_attn_dim = unet.config.cross_attention_dim
     attn_procs = {}
@@ -27,7 +33,7 @@ def init_adapter(unet,
                 attn_procs[name] = self_attn_cls(hidden_size=hidden_size, cross_attention_dim=cross_attention_dim, **kwargs)
             else:
                 # retain the original attn processor
-                attn_procs[name] = AttnProcessor2_0(hidden_size=hidden_size, cross_attention_dim=cross_attention_dim, **kwargs)
+                attn_procs[name] = ATTN_BACKENDS[attn_backend](hidden_size=hidden_size, cross_attention_dim=cross_attention_dim, **kwargs)
         else:
             attn_procs[name] = cross_attn_cls(hidden_size=hidden_size, cross_attention_dim=cross_attention_dim, **kwargs)
                                                     
@@ -35,6 +41,53 @@ def init_adapter(unet,
     adapter_modules = torch.nn.ModuleList(unet.attn_processors.values())
     return adapter_modules
 
+class SkippedCrossAttention(torch.nn.Module):
+    """
+    Parameter-free stand-in for an `attn2` run by `SkipAttnProcessor`: returns
+    its input, i.e. the block's `norm2` output, so the block output is the same.
+    """
+
+    def forward(self, hidden_states, *args, **kwargs):
+        return hidden_states
+
+def strip_cross_attention(unet):
+    """
+    Replaces every `attn2` that uses `SkipAttnProcessor` with
+    `SkippedCrossAttention`, freeing its q/k/v/out projections and skipping
+    the `Attention` call overhead. `norm2` and the residual stay: the skipped
+    attention still adds `norm2(hidden_states)`, which the model relies on.
+    Self-attention (`attn1`) is untouched, so `get_trainable_module(unet,
+    "attention")` and checkpoint loading keep working. Returns the number of
+    parameters removed.
+    """
+    removed = 0
+    for module in unet.modules():
+        attn2 = getattr(module, "attn2", None)
+        if isinstance(attn2, Attention) and isinstance(attn2.processor, SkipAttnProcessor):
+            removed += sum(p.numel() for p in attn2.parameters())
+            module.attn2 = SkippedCrossAttention()
+    return removed
+
+@contextlib.contextmanager
+def timed(timings, stage):
+    """Adds the seconds spent in the block to `timings[stage]`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+# Per-request stage timer of the serving path: anything with a
+# `measure(stage, items)` context manager, e.g. the benchmarks' `StageTimer`.
+# None (the default) turns the measurements off.
+stage_timer = None
+
+def timed_stage(stage, items=1):
+    """Times the block on `stage_timer` as `items` requests of `stage`, if a timer is set."""
+    if stage_timer is None:
+        return contextlib.nullcontext()
+    return stage_timer.measure(stage, items=items)
+
 def init_diffusion_model(diffusion_model_name_or_path, unet_class=None):
     from diffusers import AutoencoderKL
     from transformers import CLIPTextModel, CLIPTokenizer
@@ -0,0 +1,127 @@
+import contextlib
+import threading
+
+import torch
+from diffusers.models.autoencoders.vae import DecoderOutput, DiagonalGaussianDistribution
+from diffusers.models.modeling_outputs import AutoencoderKLOutput
+
+FULL, SLICED, TILED = "full", "sliced", "tiled"
+
+# Full-resolution feature maps of `block_out_channels[0]` channels alive at the
+# peak of one VAE pass, measured on the SD VAE (the decoder's last up block
+# also holds the wider input of its first resnet).
+ENCODE_ACTIVATIONS = 4
+DECODE_ACTIVATIONS = 7
+
+
+class BudgetedVAE:
+    """
+    Runs VAE encode/decode within an activation memory budget.
+
+    Each call picks the cheapest mode whose estimated peak fits `budget_mb`:
+    the whole batch at once (`full`), one sample at a time (`sliced`), or one
+    sample at a time in overlapping, blended tiles (`tiled`, see
+    `AutoencoderKL.tiled_encode`). With no budget every call runs in full, as
+    a plain `vae.encode`/`vae.decode` would and the VAE is left as it is;
+    `tile_size` only applies under a budget. The VAE's own slicing/tiling
+    flags are left untouched, so concurrent callers never race on them.
+
+    On CUDA, `stats` also reports the measured peak of the calls that raised
+    the device's peak allocated memory: for those, the peak above what was
+    allocated before the call is known exactly (it includes whatever ran
+    concurrently), so it can be checked against the estimates the budget is
+    enforced on. The device's peak statistics are never reset, since other
+    code (e.g. the benchmarks' stage timer) may be reading them.
+    """
+
+    def __init__(self, vae, budget_mb=None, tile_size=None):
+        self.vae = vae
+        self.budget = None if not budget_mb else budget_mb * 1024 * 1024
+        if self.budget is not None and tile_size is not None:
+            scale = 2 ** (len(vae.config.block_out_channels) - 1)
+            module = getattr(vae, "_orig_mod", vae)  # torch.compile wrapper
+            module.tile_sample_min_size = tile_size
+            module.tile_latent_min_size = tile_size // scale
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._peaks = {}
+        self._measured_peaks = {}
+
+    @property
+    def device(self):
+        return self.vae.device
+
+    @property
+    def dtype(self):
+        return self.vae.dtype
+
+    @property
+    def config(self):
+        return self.vae.config
+
+    def estimate_bytes(self, op, batch_size, height, width):
+        """Estimated peak activation memory of one pass over `height`x`width` pixels."""
+        activations = ENCODE_ACTIVATIONS if op == "encode" else DECODE_ACTIVATIONS
+        element_size = torch.finfo(self.vae.dtype).bits // 8
+        channels = self.vae.config.block_out_channels[0]
+        return activations * channels * element_size * batch_size * height * width
+
+    def plan(self, op, batch_size, height, width):
+        """`(mode, estimated peak bytes)` for a batch of `height`x`width` images."""
+        full = self.estimate_bytes(op, batch_size, height, width)
+        if self.budget is None or full <= self.budget:
+            return FULL, full
+        sliced = self.estimate_bytes(op, 1, height, width)
+        if batch_size > 1 and sliced <= self.budget:
+            return SLICED, sliced
+        tile = self.vae.tile_sample_min_size
+        return TILED, self.estimate_bytes(op, 1, min(tile, height), min(tile, width))
+
+    def encode(self, x):
+        """Same as `vae.encode(x)`: returns an output with `latent_dist`."""
+        mode, peak = self.plan("encode", x.shape[0], *x.shape[-2:])
+        with self._record("encode", mode, peak):
+            if mode == FULL:
+                return self.vae.encode(x)
+            encode = self.vae.encode if mode == SLICED else self.vae.tiled_encode
+            moments = torch.cat([encode(sample).latent_dist.parameters for sample in x.split(1)])
+            return AutoencoderKLOutput(latent_dist=DiagonalGaussianDistribution(moments))
+
+    def decode(self, z):
+        """Same as `vae.decode(z)`: returns an output with `sample`."""
+        scale = 2 ** (len(self.vae.config.block_out_channels) - 1)
+        mode, peak = self.plan("decode", z.shape[0], z.shape[-2] * scale, z.shape[-1] * scale)
+        with self._record("decode", mode, peak):
+            if mode == FULL:
+                return self.vae.decode(z)
+            decode = self.vae.decode if mode == SLICED else self.vae.tiled_decode
+            return DecoderOutput(sample=torch.cat([decode(sample).sample for sample in z.split(1)]))
+
+    @contextlib.contextmanager
+    def _record(self, op, mode, peak):
+        device = self.vae.device
+        if device.type == "cuda":
+            allocated = torch.cuda.memory_allocated(device)
+            previous_peak = torch.cuda.max_memory_allocated(device)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._counts[(op, mode)] = self._counts.get((op, mode), 0) + 1
+                self._peaks[op] = max(self._peaks.get(op, 0), peak)
+                if device.type == "cuda":
+                    # below the previous peak, this call's own peak is unknown
+                    current_peak = torch.cuda.max_memory_allocated(device)
+                    if current_peak > previous_peak:
+                        measured = current_peak - allocated
+                        self._measured_peaks[op] = max(self._measured_peaks.get(op, 0), measured)
+
+    def stats(self):
+        with self._lock:
+            stats = {"budget_mb": self.budget / 1024 / 1024 if self.budget else None}
+            for op in ("encode", "decode"):
+                stats[op] = {mode: self._counts.get((op, mode), 0) for mode in (FULL, SLICED, TILED)}
+                stats[op]["max_estimated_peak_mb"] = self._peaks.get(op, 0) / 1024 / 1024
+                measured = self._measured_peaks.get(op)
+                stats[op]["max_measured_peak_mb"] = None if measured is None else measured / 1024 / 1024
+            return stats
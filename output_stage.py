@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from model.utils import timed_stage
+
+
+def encode_jpeg(image, quality=75):
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class OutputStage:
+    """
+    Background stage that encodes results to JPEG once, optionally keeps a
+    local copy, and uploads them to S3 on a worker pool.
+
+    At most `max_queue_size` results wait for a worker; `submit` blocks when
+    the queue is full. Failed uploads are retried with exponential backoff
+    on the output workers, never on the caller's thread.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket_name,
+        num_workers=4,
+        max_queue_size=64,
+        jpeg_quality=75,
+        transfer_config=None,
+        max_retries=3,
+        retry_backoff=0.5,
+    ):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.jpeg_quality = jpeg_quality
+        self.transfer_config = transfer_config
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._slots = threading.BoundedSemaphore(num_workers + max_queue_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="vton-output"
+        )
+        self._lock = threading.Lock()
+        self.uploaded = 0
+        self.failed = 0
+        self.retries = 0
+
+    def submit(self, image, object_name, local_path=None, on_uploaded=None):
+        """
+        Queues `image` for upload to `object_name`. Returns a future that
+        resolves to `{"bucket", "key"}` once the upload, and `on_uploaded`
+        if given, have finished.
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(
+                self._process, image, object_name, local_path, on_uploaded
+            )
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "uploaded": self.uploaded,
+                "failed": self.failed,
+                "retries": self.retries,
+            }
+
+    def _process(self, image, object_name, local_path, on_uploaded):
+        with timed_stage("jpeg_encode"):
+            data = encode_jpeg(image, self.jpeg_quality)
+
+        if local_path is not None:
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, "wb") as f:
+                f.write(data)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                extra_kwargs = {}
+                if self.transfer_config is not None:
+                    extra_kwargs["Config"] = self.transfer_config
+                with timed_stage("upload"):
+                    self.s3_client.upload_fileobj(
+                        BytesIO(data), self.bucket_name, object_name, **extra_kwargs
+                    )
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    with self._lock:
+                        self.failed += 1
+                    print(f"Error uploading {object_name}: {e}")
+                    raise
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.retry_backoff * 2**attempt)
+
+        with self._lock:
+            self.uploaded += 1
+        location = {"bucket": self.bucket_name, "key": object_name}
+        if on_uploaded is not None:
+            on_uploaded(location)
+        return location
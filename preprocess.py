@@ -0,0 +1,129 @@
+import numpy as np
+import torch
+from PIL import Image
+
+
+def concat_upper_and_lower(image1, image2):
+    # 두 이미지의 너비를 맞추고, 높이를 합산
+    new_width = max(image1.width, image2.width)
+    new_height = image1.height + image2.height
+
+    # 새 이미지를 만들고, 이미지1과 이미지2를 붙이기
+    new_image = Image.new("RGB", (new_width, new_height))
+    new_image.paste(image1, (0, 0))
+    new_image.paste(image2, (0, image1.height))
+
+    return new_image
+
+
+def crop_box(size, target_size):
+    """
+    Center crop box with the target aspect ratio, as used by `resize_and_crop`.
+    """
+    w, h = size
+    target_w, target_h = target_size
+    if w / h < target_w / target_h:
+        new_w = w
+        new_h = w * target_h // target_w
+    else:
+        new_h = h
+        new_w = h * target_w // target_h
+    return ((w - new_w) // 2, (h - new_h) // 2, (w + new_w) // 2, (h + new_h) // 2)
+
+
+def padded_size(size, target_size):
+    """
+    Size of the image inside the padded canvas, as used by `resize_and_padding`.
+    """
+    w, h = size
+    target_w, target_h = target_size
+    if w / h < target_w / target_h:
+        return w * target_h // h, target_h
+    return target_w, h * target_w // w
+
+
+class Preprocessor:
+    """
+    Maps decoded PIL images straight to model-ready tensors.
+
+    Each image is cropped, resampled exactly once and written into a
+    preallocated float32 buffer, normalized to [-1, 1] for images and
+    binarized to {0, 1} for masks.
+    Outputs match `resize_and_crop`/`resize_and_padding` followed by
+    `VaeImageProcessor.preprocess`.
+    """
+
+    def __init__(self, width, height, resample=Image.LANCZOS, pin_memory=False):
+        self.width = width
+        self.height = height
+        self.resample = resample
+        self.pin_memory = pin_memory
+
+    def _empty(self, batch_size, channels):
+        return torch.empty(
+            (batch_size, channels, self.height, self.width),
+            dtype=torch.float32,
+            pin_memory=self.pin_memory,
+        )
+
+    def _fill_rgb(self, out, image):
+        # out: (3, H, W) view; uint8 HWC -> float CHW in [-1, 1]
+        array = torch.from_numpy(np.array(image, dtype=np.uint8))
+        out.copy_(array.permute(2, 0, 1))
+        out.div_(127.5).sub_(1.0)
+
+    def _resize_crop(self, image, mode):
+        size = (self.width, self.height)
+        box = crop_box(image.size, size)
+        # crop first: `resize(box=...)` would blend in pixels from outside the box
+        return image.crop(box).convert(mode).resize(size, self.resample)
+
+    def person_batch(self, images):
+        """Person images -> (B, 3, H, W), like `resize_and_crop` + normalize."""
+        out = self._empty(len(images), 3)
+        for i, image in enumerate(images):
+            self._fill_rgb(out[i], self._resize_crop(image, "RGB"))
+        return out
+
+    def mask_batch(self, images):
+        """Masks -> (B, 1, H, W) in {0, 1}, like `resize_and_crop` + binarize."""
+        out = self._empty(len(images), 1)
+        for i, image in enumerate(images):
+            array = np.asarray(self._resize_crop(image, "L"), dtype=np.uint8)
+            # x / 255 >= 0.5
+            out[i, 0].copy_(torch.from_numpy(array >= 128))
+        return out
+
+    def cloth_batch(self, cloth_images):
+        """
+        `(upper, lower)` garment pairs -> (B, 3, H, W), like
+        `concat_upper_and_lower` + `resize_and_padding` + normalize. The white
+        padding is written straight into the buffer instead of a canvas image.
+        """
+        out = self._empty(len(cloth_images), 3)
+        out.fill_(1.0)
+        for i, (upper, lower) in enumerate(cloth_images):
+            image = concat_upper_and_lower(upper, lower)
+            new_w, new_h = padded_size(image.size, (self.width, self.height))
+            image = image.resize((new_w, new_h), self.resample)
+            left = (self.width - new_w) // 2
+            top = (self.height - new_h) // 2
+            self._fill_rgb(out[i, :, top : top + new_h, left : left + new_w], image)
+        return out
+
+    def resize_person(self, image):
+        """Person image resized and cropped to the output size, as PIL."""
+        return self._resize_crop(image, "RGB")
+
+    def resize_mask(self, image):
+        """Mask resized and cropped to the output size, as a PIL "L" image."""
+        return self._resize_crop(image, "L")
+
+    def person(self, image):
+        return self.person_batch([image])[0]
+
+    def mask(self, image):
+        return self.mask_batch([image])[0]
+
+    def cloth(self, upper, lower):
+        return self.cloth_batch([(upper, lower)])[0]
@@ -0,0 +1,191 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from model.utils import timed_stage
+
+
+class _Message:
+    def __init__(self, body):
+        self.body = body
+        self.enqueued_at = time.monotonic()
+        self.future = Future()
+
+
+class SQSNotifier:
+    """
+    Buffers completion messages and sends them with `send_message_batch`.
+
+    A batch is flushed when it holds `max_batch_size` messages (at most 10,
+    the SQS limit) or when its oldest message has waited `max_wait_ms`. Only
+    the entries SQS reports as failed are retried, and `shutdown` flushes
+    everything still buffered before returning.
+    """
+
+    def __init__(
+        self,
+        sqs_client,
+        queue_url,
+        max_batch_size=10,
+        max_wait_ms=100,
+        max_retries=3,
+        retry_backoff=0.2,
+    ):
+        assert 1 <= max_batch_size <= 10, "SQS batches hold 1 to 10 messages"
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.flushes = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.max_flush_size = 0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self._worker = threading.Thread(
+            target=self._run, name="vton-sqs-notifier", daemon=True
+        )
+        self._worker.start()
+
+    def notify(self, message_body) -> Future:
+        """
+        Queues `message_body` (a JSON-serializable dict). The returned future
+        resolves to the SQS MessageId once the message has been sent.
+        """
+        if self._stopped.is_set():
+            raise RuntimeError("SQSNotifier has been shut down")
+        message = _Message(json.dumps(message_body))
+        self._queue.put(message)
+        return message.future
+
+    def shutdown(self, wait=True):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "flushes": self.flushes,
+                "sent": self.sent,
+                "failed": self.failed,
+                "retries": self.retries,
+                "mean_flush_size": self.sent / self.flushes if self.flushes else 0.0,
+                "max_flush_size": self.max_flush_size,
+                "mean_latency_ms": (
+                    self.total_latency_ms / self.sent if self.sent else 0.0
+                ),
+                "max_latency_ms": self.max_latency_ms,
+            }
+
+    def _run(self):
+        pending = []
+        stopping = False
+        while True:
+            if not pending:
+                if stopping:
+                    break
+                message = self._queue.get()
+                if message is None:
+                    stopping = True
+                    continue
+                pending.append(message)
+
+            # Size or time trigger, measured from the oldest buffered message
+            deadline = pending[0].enqueued_at + self.max_wait
+            while not stopping and len(pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    message = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if message is None:
+                    stopping = True
+                else:
+                    pending.append(message)
+
+            if stopping:
+                # Flush everything that is left before exiting
+                while True:
+                    try:
+                        message = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if message is not None:
+                        pending.append(message)
+
+            batch = pending[: self.max_batch_size]
+            pending = pending[self.max_batch_size :]
+            self._flush(batch)
+
+    def _flush(self, batch):
+        for attempt in range(self.max_retries + 1):
+            entries = [
+                {"Id": str(i), "MessageBody": message.body}
+                for i, message in enumerate(batch)
+            ]
+            try:
+                with timed_stage("notify", items=len(batch)):
+                    response = self.sqs_client.send_message_batch(
+                        QueueUrl=self.queue_url, Entries=entries
+                    )
+                successful = {
+                    entry["Id"]: entry["MessageId"]
+                    for entry in response.get("Successful", [])
+                }
+                failed = {entry["Id"]: entry for entry in response.get("Failed", [])}
+            except Exception as e:
+                print(f"Error sending message batch: {str(e)}")
+                successful = {}
+                failed = {str(i): {"Message": str(e)} for i in range(len(batch))}
+
+            sent_at = time.monotonic()
+            retry = []
+            with self._lock:
+                if successful:
+                    self.flushes += 1
+                    self.sent += len(successful)
+                    self.max_flush_size = max(self.max_flush_size, len(successful))
+                for i, message in enumerate(batch):
+                    if str(i) in successful:
+                        latency_ms = (sent_at - message.enqueued_at) * 1000
+                        self.total_latency_ms += latency_ms
+                        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+                        message.future.set_result(successful[str(i)])
+                    elif failed.get(str(i), {}).get("SenderFault"):
+                        # malformed entries will not succeed on retry
+                        self.failed += 1
+                        message.future.set_exception(
+                            RuntimeError(f"SQS rejected message: {failed[str(i)]}")
+                        )
+                    else:
+                        retry.append(message)
+                if retry and attempt < self.max_retries:
+                    self.retries += len(retry)
+
+            batch = retry
+            if not batch:
+                return
+            if attempt < self.max_retries:
+                time.sleep(self.retry_backoff * 2**attempt)
+
+        with self._lock:
+            self.failed += len(batch)
+        for message in batch:
+            print(f"Error sending message: giving up after {self.max_retries} retries")
+            message.future.set_exception(
+                RuntimeError("Error sending message to SQS")
+            )
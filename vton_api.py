@@ -1,11 +1,81 @@
-from fastapi import FastAPI
+import asyncio
+import threading
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from typing import List, Optional, Tuple
 import os
-from get_vton import get_vton
+from batching import ContinuousBatchingEngine, MicroBatchScheduler
+from cpu_workers import WorkerPool, parse_core_sets
+import get_vton
+from get_vton import (
+    BATCHING_MODE,
+    CPU_THREADS,
+    CPU_WORKER_CORES,
+    CPU_WORKERS,
+    DEVICE,
+    MAX_BATCH_SIZE,
+    MAX_BATCH_WAIT_MS,
+    MAX_INFERENCE_STEPS,
+    cold_start,
+    get_vton_batch,
+    get_vton_continuous,
+    get_vton_multi,
+    startup,
+)
+from jobs import SUCCEEDED, JobManager, JobQueueFull
+from model.samplers import SAMPLERS
 import uvicorn
 
 app = FastAPI()
 
+if BATCHING_MODE not in ("continuous", "micro"):
+    raise ValueError(f"Unknown BATCHING_MODE: {BATCHING_MODE}")
+if CPU_WORKERS and (DEVICE != "cpu" or BATCHING_MODE != "micro"):
+    raise ValueError("CPU_WORKERS needs DEVICE=cpu and BATCHING_MODE=micro")
+
+# 파이프라인 로드 후 start()에서 생성 (CPU_WORKERS면 startup 훅에서)
+batch_scheduler = None
+
+
+def start():
+    """Loads the pipeline, starts the batch scheduler and warms up; runs off the event loop."""
+    global batch_scheduler
+    try:
+        if CPU_WORKERS:
+            # 모델은 zygote 프로세스가 로드, 워커는 거기서 fork 되어 각자 워밍업
+            startup["phase"] = "loading"
+            cold_start.update(batch_scheduler.wait_loaded())
+            startup["phase"] = "warming_up"
+            batch_scheduler.start_workers()
+            startup["phase"] = "ready"
+            print(f"cpu workers : {batch_scheduler.stats()}")
+            return
+        get_vton.load()
+        if BATCHING_MODE == "continuous":
+            batch_scheduler = ContinuousBatchingEngine(
+                get_vton.pipeline, max_batch_size=MAX_BATCH_SIZE
+            )
+        else:
+            batch_scheduler = MicroBatchScheduler(
+                get_vton_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS
+            )
+        get_vton.warmup()
+    except Exception as e:
+        startup["phase"] = "failed"
+        startup["error"] = repr(e)
+        print(f"Startup failed: {e!r}")
+        raise
+
+# 비동기 작업(/jobs) 실행용 추론 워커 풀
+job_manager = JobManager(
+    num_workers=int(os.environ.get("JOB_WORKERS", MAX_BATCH_SIZE)),
+    max_jobs=int(os.environ.get("MAX_JOBS", 1000)),
+    max_pending=int(os.environ.get("MAX_PENDING_JOBS", 64)),
+)
+
 
 class VtonRequest(BaseModel):
     person_image_url: str
@@ -15,19 +85,99 @@ class VtonRequest(BaseModel):
     cloth_type: str
     userId: str
     timestamp: str
+    # (시작, 끝) 비율 구간에서만 CFG 적용, 없으면 GUIDANCE_INTERVAL 기본값
+    guidance_interval: Optional[Tuple[float, float]] = None
+    # 없으면 SAMPLER, NUM_STEP 기본값
+    sampler: Optional[str] = None
+    num_inference_steps: Optional[int] = None
+
+
+class Outfit(BaseModel):
+    upper_cloth_url: str
+    lower_cloth_url: str
+
+
+class VtonMultiRequest(BaseModel):
+    person_image_url: str
+    mask_image_url: str
+    outfits: List[Outfit]
+    cloth_type: str
+    userId: str
+    timestamp: str
+    guidance_interval: Optional[Tuple[float, float]] = None
+    sampler: Optional[str] = None
+    num_inference_steps: Optional[int] = None
 
 
 @app.get("/")
 def home():
     return "Virtual Try On"
 
+@app.on_event("startup")
+def start_in_background():
+    global batch_scheduler
+    if CPU_WORKERS:
+        # 워커 풀은 스레드가 생기기 전에 fork 해야 안전하므로 여기서 생성
+        batch_scheduler = WorkerPool(
+            get_vton_batch,
+            parse_core_sets(CPU_WORKER_CORES, CPU_WORKERS),
+            load_fn=get_vton.load,
+            init_fn=get_vton.init_worker,
+            exit_fn=get_vton.close_clients,
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=MAX_BATCH_WAIT_MS,
+            num_threads=CPU_THREADS or None,
+        )
+    # 로드/웜업 동안에도 /ping, /metrics에 응답하도록 별도 스레드에서 실행
+    threading.Thread(target=start, name="startup", daemon=True).start()
+
+
 @app.get("/ping")
 async def ping():
+    # 웜업까지 끝나야 healthy (그 전에는 503으로 트래픽을 받지 않음)
+    if startup["phase"] == "ready" and CPU_WORKERS and not batch_scheduler.alive():
+        return JSONResponse(status_code=503, content={"status": "workers_exited", "error": None})
+    if startup["phase"] != "ready":
+        return JSONResponse(
+            status_code=503, content={"status": startup["phase"], "error": startup["error"]}
+        )
     return {"status": "healthy"}
 
-@app.post("/invocations")
-async def virtual_try_on(request: VtonRequest):
-    get_vton(
+
+def check_ready():
+    if startup["phase"] != "ready":
+        raise HTTPException(status_code=503, detail=f"Server is not ready: {startup['phase']}")
+
+
+def check_guidance_interval(guidance_interval):
+    if guidance_interval is None:
+        return
+    start, end = guidance_interval
+    if not 0.0 <= start <= end <= 1.0:
+        raise HTTPException(
+            status_code=422,
+            detail="guidance_interval must satisfy 0 <= start <= end <= 1",
+        )
+
+
+def check_sampler(sampler, num_inference_steps):
+    if sampler is not None and sampler not in SAMPLERS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"sampler must be one of {', '.join(SAMPLERS)}",
+        )
+    if num_inference_steps is not None and not 1 <= num_inference_steps <= MAX_INFERENCE_STEPS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"num_inference_steps must be between 1 and {MAX_INFERENCE_STEPS}",
+        )
+
+
+def to_vton_kwargs(request: VtonRequest):
+    check_ready()
+    check_guidance_interval(request.guidance_interval)
+    check_sampler(request.sampler, request.num_inference_steps)
+    return dict(
         person_image_url=request.person_image_url,
         upper_cloth_url=request.upper_cloth_url,
         lower_cloth_url=request.lower_cloth_url,
@@ -35,10 +185,113 @@ async def virtual_try_on(request: VtonRequest):
         cloth_type=request.cloth_type,
         username=request.userId,
         timestamp=request.timestamp,
+        guidance_interval=request.guidance_interval,
+        sampler=request.sampler,
+        num_inference_steps=request.num_inference_steps,
     )
 
+
+def run_vton(**vton_kwargs):
+    # 블로킹 실행: 추론 워커 스레드에서 호출됨
+    if BATCHING_MODE == "continuous":
+        return get_vton_continuous(batch_scheduler, **vton_kwargs)
+    return batch_scheduler.submit(vton_kwargs).result()
+
+
+@app.get("/metrics")
+async def metrics():
+    stats = {"startup": startup, "cold_start": cold_start}
+    if startup["phase"] not in ("warming_up", "ready"):
+        return stats
+    if CPU_WORKERS:
+        # 캐시와 업로드 스테이지는 워커 프로세스마다 따로 있음
+        if batch_scheduler is not None:
+            stats["cpu_workers"] = batch_scheduler.stats()
+        return stats
+    pipeline = get_vton.pipeline
+    stats.update(
+        garment_cache=get_vton.garment_cache.stats(),
+        person_cache=get_vton.person_cache.stats(),
+        output_stage=get_vton.output_stage.stats(),
+        sqs_notifier=get_vton.notifier.stats(),
+        deep_cache=pipeline.deep_cache.stats() if pipeline.deep_cache else None,
+        vae=pipeline.budgeted_vae.stats(),
+        exported=pipeline.exported_stats(),
+    )
+    return stats
+
+@app.post("/invocations")
+async def virtual_try_on(request: VtonRequest):
+    vton_kwargs = to_vton_kwargs(request)
+    if BATCHING_MODE == "continuous":
+        await run_in_threadpool(get_vton_continuous, batch_scheduler, **vton_kwargs)
+    else:
+        await asyncio.wrap_future(batch_scheduler.submit(vton_kwargs))
+
     return {"message": "VTON run successfully"}
 
 
+@app.post("/invocations/multi")
+async def virtual_try_on_multi(request: VtonMultiRequest):
+    check_ready()
+    if not request.outfits:
+        raise HTTPException(status_code=422, detail="outfits must not be empty")
+    check_guidance_interval(request.guidance_interval)
+    check_sampler(request.sampler, request.num_inference_steps)
+    multi_kwargs = dict(
+        person_image_url=request.person_image_url,
+        mask_image_url=request.mask_image_url,
+        outfits=[outfit.dict() for outfit in request.outfits],
+        cloth_type=request.cloth_type,
+        username=request.userId,
+        timestamp=request.timestamp,
+        guidance_interval=request.guidance_interval,
+        sampler=request.sampler,
+        num_inference_steps=request.num_inference_steps,
+    )
+    # 다른 요청과 같은 추론 스레드(또는 워커)에서 실행
+    locations = await asyncio.wrap_future(
+        batch_scheduler.submit_call(get_vton_multi, **multi_kwargs)
+    )
+
+    return {"message": "VTON run successfully", "results": locations}
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: VtonRequest):
+    try:
+        job = job_manager.submit(run_vton, **to_vton_kwargs(request))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+    return {"job_id": job.job_id, "status": job.status}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    if job.status != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return {"job_id": job.job_id, "result": job.result}
+
+
+@app.on_event("shutdown")
+def shutdown():
+    job_manager.shutdown()
+    # 로드 중에 종료되면 아직 만들어지지 않은 것도 있음
+    for stage in (batch_scheduler, get_vton.output_stage, get_vton.notifier):
+        if stage is not None:
+            stage.shutdown()
+
+
 if __name__ == "__main__":
     uvicorn.run("vton_api:app", host="0.0.0.0", port=8080, reload=False)